@@ -12,22 +12,21 @@ manipulating them in various ways, and writing them back to ASCII.
 from __future__ import print_function, absolute_import, division
 # import shlex
 from io import StringIO, BytesIO, IOBase
-from collections import OrderedDict
+from collections import OrderedDict, Counter, deque
 import copy
 import warnings
-import six
+import sys
 import re
 from asmljobsdef import ASMLJOBSECTIONS,ASMLELEMENTALIGN,ASMLELEMENTINDENT
+from asmljobsdef import ASMLMAXIMAGECOUNT,ASMLMAXLAYERCOUNT,ASMLMAXRETICLEDATACOUNT,ASMLSECTIONLIMITS
 
 
-if six.PY2:
+if sys.version_info[0] == 2:
     COMPATFILE = file
     COMPATSTRIO = BytesIO
-elif six.PY3:
+else:
     COMPATFILE = IOBase
     COMPATSTRIO = StringIO
-else:
-    raise(IOError, 'Can\'t figure out python version')
 
 
 class asmlElement(object):
@@ -48,6 +47,8 @@ class asmlElement(object):
     Class methods provide functionality to get and set values, to validate values, and to read
     and make an ASCII string representing the element.
     """
+    version = 0     # Number of times the value was assigned, see asmlSection.makeAscii
+
     def __init__(self,name=None,count=0,element_type=None,is_optional=True,default=None,validator=None,value=None):
         """ Initializes element parameters
         
@@ -67,20 +68,46 @@ class asmlElement(object):
         else:
             self.set(value)
 
+    def __setstate__(self,state):
+        """ Restores a copied or unpickled element, including those pickled with a plain value attribute """
+        if 'value' in state:
+            state['_value'] = state.pop('value')
+        self.__dict__.update(state)
+
+    @property
+    def value(self):
+        """ Value of the element, a list of count values or None """
+        return self._value
+
+    @value.setter
+    def value(self,value):
+        self._value = value
+        self.version += 1
+
     def set(self,value):
-        """ Sets the element value """
+        """ Sets the element value
+
+        Returns boolean indicating whether the value passed the range or list check
+        and was set.
+        """
         # Pack single value into list
         if not isinstance(value,list):
             value = [value]
         
         if self.validate(value):
             self.value = value
+            return True
+        return False
     
     def get(self):
-        """ Gets the element values """
+        """ Gets a copy of the element values
+
+        Changing the returned list does not change the element (use set), so the
+        cached section text and summary statistics stay valid.
+        """
         if self.value is None: return None
 
-        return self.value
+        return list(self.value)
     
     def validate(self,value):
         """ Validates a value against the element specifications
@@ -105,7 +132,7 @@ class asmlElement(object):
         # Check type of values passed
         for v in value:
             if self.element_type == 'int':
-                if not isinstance(v,int):
+                if not isinstance(v,int) or isinstance(v,bool):
                     raise TypeError('{} element expects integer, received {}'.format(self.name,type(v)))
             elif self.element_type == 'float':
                 if not isinstance(v,float):
@@ -128,20 +155,26 @@ class asmlElement(object):
         
         return True
 
-    def makeAscii(self):
-        """ Generates ASCII string representation of element """
+    def makeAscii(self,value=None):
+        """ Generates ASCII string representation of element
+
+        If a value is passed (e.g. a transformed copy of the element value), it is
+        written instead of the stored value.
+        """
+        if value is None:
+            value = self.value
         asciistring = '   ' + self.name + ' '*(ASMLELEMENTALIGN - ASMLELEMENTINDENT - len(self.name))
         for n in range(self.count):
             if self.element_type == 'int':
-                asciistring += '{:d} '.format(self.value[n])
+                asciistring += '{:d} '.format(value[n])
             elif self.element_type == 'float':
-                asciistring += '{:.6f} '.format(self.value[n])
+                asciistring += '{:.6f} '.format(value[n])
             elif self.element_type == 'string':
-                asciistring += '"{}" '.format(self.value[n])
+                asciistring += '"{}" '.format(value[n])
             elif self.element_type == 'multiline':
                 if n > 0:
                     asciistring += ' '*(ASMLELEMENTALIGN)
-                asciistring += '"{}"\n'.format(self.value[n])
+                asciistring += '"{}"\n'.format(value[n])
 
         return asciistring[:-1] # Trim final whitespace character
     
@@ -149,6 +182,8 @@ class asmlElement(object):
         """ Parses ASCII string representation of element
 
         Note that the section reader extracts the element name and only passes the string containing the values.
+
+        Returns the parsed value and boolean indicating whether it was set (see set).
         """
         if self.element_type == 'int':
             value = list(map(int,re.findall(r'[-]?[0-9]+',asciistring)))
@@ -159,7 +194,7 @@ class asmlElement(object):
         elif self.element_type == 'multiline':
             value = list(map(str,re.findall(r'"([^"]*)"',asciistring)))
 
-        self.set(value)
+        return value, self.set(value)
 
 
 
@@ -193,6 +228,9 @@ class asmlSection(object):
         self.is_optional = ASMLJOBSECTIONS[sectionname]['is_optional']
         self.multiple_allowed = ASMLJOBSECTIONS[sectionname]['multiple_allowed']
         self.id_elements = ASMLJOBSECTIONS[sectionname]['id_elements']
+        self._asciicache = None
+        self.rejected = []  # Values rejected while reading, reported by asmlAscii.validate
+        self.owners = []    # Jobfiles containing this section, kept for summary bookkeeping
 
         self.elements = OrderedDict()
         for elementname in ASMLJOBSECTIONS[sectionname]['elements']:
@@ -200,21 +238,79 @@ class asmlSection(object):
             self.elements[elementname] = asmlElement(name=elementname,count=elementdict['count'],element_type=elementdict['element_type'],
                                         is_optional=elementdict['is_optional'],default=elementdict['default'],
                                         validator=elementdict['validator'])
-    
+
+    def __getstate__(self):
+        """ Drops the owning jobfiles when copying or pickling a section
+
+        A copied section does not belong to any jobfile until it is appended; a copied
+        jobfile re-registers itself with its own sections in asmlAscii.__setstate__.
+        """
+        state = self.__dict__.copy()
+        state['owners'] = []
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_asciicache',None)
+        self.__dict__.setdefault('rejected',[])
+        self.owners = []
+
+    def copy(self):
+        """ Copies the section
+
+        Much faster than copy.deepcopy: element values are lists of immutable values,
+        so only the lists are copied, and the element specifications are shared.
+        """
+        newsection = self.__class__.__new__(self.__class__)
+        newsection.__dict__.update(self.__dict__)
+        newsection.rejected = list(self.rejected)
+        newsection.owners = []
+        newsection.elements = OrderedDict()
+        for elementname, element in self.elements.items():
+            newelement = element.__class__.__new__(element.__class__)
+            newelement.__dict__.update(element.__dict__)
+            if element.value is not None:
+                newelement._value = list(element.value)     # Keeps the version, and so the cached text
+            newsection.elements[elementname] = newelement
+
+        return newsection
+
     def set(self,elementname,value):
-        """ Sets the value of an element """
+        """ Sets the value of an element
+
+        Keeps the summary statistics of the jobfiles containing the section up to date.
+        """
         if elementname not in ASMLJOBSECTIONS[self.sectionname]['elements']:
             raise ValueError('Element {} not found in section {} in ASMLJOBSECTIONS'.format(elementname,self.sectionname))
-        
-        self.elements[elementname].set(value)
-    
+
+        if self.rejected:
+            self.rejected = [rejection for rejection in self.rejected if rejection['element'] != elementname]
+        if self.owners and elementname in asmlSummary.TRACKED.get(self.sectionname,()):
+            with _recounted(self):
+                self.elements[elementname].set(value)
+        else:
+            self.elements[elementname].set(value)
+
     def get(self,elementname):
         """ Gets the value of an element """
         if elementname not in ASMLJOBSECTIONS[self.sectionname]['elements']:
             raise ValueError('Element {} not found in section {} in ASMLJOBSECTIONS'.format(elementname,self.sectionname))
         
         return self.elements[elementname].get()
-    
+
+    def getIdKey(self):
+        """ Gets a hashable key of the id element values
+
+        Sections of the same name with equal keys interfere with each other.
+        """
+        key = []
+        for id_element in self.id_elements:
+            element = self.elements.get(id_element)
+            value = None if element is None else element.value
+            key.append(None if value is None else tuple(value))
+
+        return tuple(key)
+
     def isSpecified(self):
         """ Checks if section is adequately specified """
         for elementname in ASMLJOBSECTIONS[self.sectionname]['elements']:
@@ -238,28 +334,75 @@ class asmlSection(object):
                 return True     # Only one instance allowed
             
             for id_element in section1.id_elements:
-                if section1.elements[id_element] != section2.elements[id_element]:
+                if section1.get(id_element) != section2.get(id_element):
                     return False
             else:
                 return True     # All ID elements identical
         else:
             return False        # Why would two different types of section interfere?
 
-    def makeAscii(self):
+    @staticmethod
+    def compare(section1,section2):
+        """ Compares the element values of two sections of the same name
+
+        Returns an OrderedDict of element name to (value1, value2) for every element
+        whose values differ. Unset elements compare as None.
+        """
+        if section1.sectionname != section2.sectionname:
+            raise ValueError('Cannot compare {} section with {} section'.format(section1.sectionname,section2.sectionname))
+
+        differences = OrderedDict()
+        if (isinstance(section1,asmlRawSection) and isinstance(section2,asmlRawSection)
+            and not section1.modified and not section2.modified
+            and section1.asciistring == section2.asciistring):
+            return differences      # Identical unparsed text
+
+        for elementname in ASMLJOBSECTIONS[section1.sectionname]['elements']:
+            element1 = section1.elements.get(elementname)
+            element2 = section2.elements.get(elementname)
+            value1 = None if element1 is None else element1.value
+            value2 = None if element2 is None else element2.value
+            if value1 != value2:
+                differences[elementname] = (value1,value2)
+
+        return differences
+
+    def makeAscii(self,transforms=()):
         """ Generates ASCII string representation of section
-        
+
         Within the bracketing section text, includes ASCII representation
         for all the elements specified either by the user or by the defaults.
+
+        Each output transform (see ASMLOUTPUTTRANSFORMS) is applied to a copy of the
+        element values as the text is generated, so the section itself is never
+        changed. The text is cached for the last sequence of transforms used, together
+        with the versions of the elements, and regenerated once a value is assigned to
+        any element, whether through set, readAscii or the element object. Changes made
+        in place to a value list are not detected.
         """
-        asciistring = 'START_SECTION ' + self.sectionname + '\n'
+        key = (tuple(transforms),self._versions())
+        if self._asciicache is not None and self._asciicache[0] == key:
+            return self._asciicache[1]
+
+        asciilines = ['START_SECTION ' + self.sectionname]
         for elementname in self.elements:
-            if self.elements[elementname].get() is not None:
-                asciistring += self.elements[elementname].makeAscii() + '\n'
-        asciistring += 'END_SECTION'
+            value = self.elements[elementname].value   # Transforms return new lists
+            if value is not None:
+                for transform in transforms:
+                    value = transform(self.sectionname,elementname,value)
+                asciilines.append(self.elements[elementname].makeAscii(value))
+        asciilines.append('END_SECTION')
+
+        asciistring = '\n'.join(asciilines)
+        self._asciicache = (key,asciistring)
 
         return asciistring
 
-    def readAscii(self,asciistring):
+    def _versions(self):
+        """ Gets the versions of the elements, which change whenever a value is assigned """
+        return tuple(element.version for element in self.elements.values())
+
+    def readAscii(self,asciistring,firstline=None):
         """ Reads an ASCII string representation of a jobfile section
 
         Uses the definitions in asmljobsdef.py to define the section and steps through the
@@ -268,9 +411,25 @@ class asmlSection(object):
 
         The ASCII string must include all non-optional elements and present the elements
         in the same order as specified in asmljobsdef.py.
+
+        Values failing the range or list check are not set, as with set, but are kept
+        in rejected with their line number (counted from firstline, the line number of
+        the first line of asciistring in its file, if given) for asmlAscii.validate.
+
+        Keeps the summary statistics of the jobfiles containing the section up to date.
         """
+        if self.owners and self.sectionname in asmlSummary.TRACKED:
+            with _recounted(self):
+                self._readElements(asciistring,firstline)
+        else:
+            self._readElements(asciistring,firstline)
+
+    def _readElements(self,asciistring,firstline=None):
+        """ Parses the section body into the elements, see readAscii """
         sectionlines = asciistring.split('\n')
         self.elements = OrderedDict()
+        self._asciicache = None
+        self.rejected = []
 
         # Steps through the elements of the section attempting to match them to lines
         # in the section body. Requires elements to be in fixed order.
@@ -282,19 +441,22 @@ class asmlSection(object):
                                         is_optional=elementdict['is_optional'],default=elementdict['default'],
                                         validator=elementdict['validator'])
                 newvalue = sectionlines[l][ASMLELEMENTALIGN:]
+                line = None if firstline is None else firstline + l
                 l += 1
                 if elementdict['element_type'] == 'multiline':
                     while l < len(sectionlines) and sectionlines[l][:ASMLELEMENTALIGN] == ' '*(ASMLELEMENTALIGN):
                         newvalue += '\n' + sectionlines[l][ASMLELEMENTALIGN:]
                         l += 1
-                newelement.readAscii(newvalue)
+                value, accepted = newelement.readAscii(newvalue)
+                if not accepted:
+                    self.rejected.append({'element':elementname, 'value':value, 'line':line})
                 self.elements[elementname] = newelement     # Add element to section element dict
             elif not elementdict['is_optional']:
                 raise ValueError('Required element {} not found'.format(elementname))
             
         if l != len(sectionlines):
             # Note that a section with duplicate elements will land here
-            raise ValueError('Unread lines in section {}'.format(sectionname))
+            raise ValueError('Unread lines in section {}'.format(self.sectionname))
     
     def fixDelimBug(self):
         """ Fixes strings contaminated by JDAS bug
@@ -307,12 +469,523 @@ class asmlSection(object):
         """
         for elementname in self.elements:
             if 'fix_delim_bug' in ASMLJOBSECTIONS[self.sectionname]['elements'][elementname]:
-                tempvals = self.get(elementname)
-                for n in range(len(tempvals)):
-                    if tempvals[n][0]=='<' and tempvals[n][-1]=='>':
-                        tempvals[n] = tempvals[n][1:-1]                 # Strip the angle brackets from the string
-            
-                self.elements[elementname].set(tempvals)
+                tempvals = delimBugTransform(self.sectionname,elementname,self.get(elementname))
+                self.set(elementname,tempvals)
+
+
+
+class asmlRawSection(asmlSection):
+    """ Class for sections kept as raw ASCII text
+
+    Used by asmlAscii.readAscii for section types that are not selected for full
+    parsing. The section text, including the bracketing START_SECTION/END_SECTION
+    lines, is stored as read. It is parsed only when the elements are first accessed,
+    and makeAscii returns the stored text byte-for-byte unless the section has been
+    modified, through set, readAscii or its element objects.
+    """
+    def __init__(self,sectionname,asciistring,firstline=None):
+        """ Initializes section parameters and stores the raw section text
+
+        firstline is the line number of the START_SECTION line in the file, if known,
+        used to locate values rejected when the text is parsed.
+        """
+        if sectionname not in ASMLJOBSECTIONS:
+            raise ValueError('Section {} not found in ASMLJOBSECTIONS'.format(sectionname))
+
+        self.sectionname = sectionname
+        self.is_optional = ASMLJOBSECTIONS[sectionname]['is_optional']
+        self.multiple_allowed = ASMLJOBSECTIONS[sectionname]['multiple_allowed']
+        self.id_elements = ASMLJOBSECTIONS[sectionname]['id_elements']
+
+        self._asciicache = None
+        self.rejected = []
+        self.owners = []
+        self.asciistring = asciistring
+        self.firstline = firstline
+        self._modified = False
+        self._elements = None
+        self._parsedversions = None
+
+    @property
+    def elements(self):
+        """ Element dictionary, parsed from the raw text on first access """
+        if self._elements is None:
+            sectionbody = self.asciistring.split('\n',1)[1].rsplit('\n',1)[0]
+            self._readElements(sectionbody,None if self.firstline is None else self.firstline + 1)
+            self._parsedversions = self._versions()
+
+        return self._elements
+
+    @elements.setter
+    def elements(self,elements):
+        self._elements = elements
+
+    @property
+    def modified(self):
+        """ Whether the section was changed after it was read """
+        return self._modified or (self._elements is not None and self._versions() != self._parsedversions)
+
+    def get(self,elementname):
+        """ Gets the value of an element
+
+        Values of id elements are read from their line of the raw text without
+        parsing the rest of the section.
+        """
+        if self._elements is None and elementname in self.id_elements:
+            m = re.search(r'^   ' + elementname + r' +(.*)$',self.asciistring,re.MULTILINE)
+            if m is None:
+                raise KeyError(elementname)
+            elementdict = ASMLJOBSECTIONS[self.sectionname]['elements'][elementname]
+            element = asmlElement(name=elementname,count=elementdict['count'],element_type=elementdict['element_type'])
+            element.readAscii(m.group(1))
+            return element.get()
+
+        return asmlSection.get(self,elementname)
+
+    def getIdKey(self):
+        """ Gets a hashable key of the id element values
+
+        Reads the id element values from the raw text (see get), so that matching
+        sections by id, e.g. in asmlAscii.extend, diff and merge, does not parse them.
+        """
+        if self._elements is not None:
+            return asmlSection.getIdKey(self)
+
+        key = []
+        for id_element in self.id_elements:
+            try:
+                value = self.get(id_element)
+            except KeyError:
+                value = None
+            key.append(None if value is None else tuple(value))
+
+        return tuple(key)
+
+    def set(self,elementname,value):
+        """ Sets the value of an element, marking the section as modified """
+        asmlSection.set(self,elementname,value)
+        self._modified = True
+
+    def readAscii(self,asciistring,firstline=None):
+        """ Reads an ASCII string representation, marking the section as modified """
+        asmlSection.readAscii(self,asciistring,firstline)
+        self._modified = True
+
+    def fixDelimBug(self):
+        """ Fixes strings contaminated by JDAS bug, only if the section was modified """
+        if self.modified:
+            asmlSection.fixDelimBug(self)
+
+    def makeAscii(self,transforms=()):
+        """ Returns the raw section text, or regenerates it if modified
+
+        Output transforms only apply to modified sections.
+        """
+        if not self.modified:
+            return self.asciistring
+
+        return asmlSection.makeAscii(self,transforms)
+
+
+
+def delimBugTransform(sectionname,elementname,value):
+    """ Output transform fixing strings contaminated by JDAS bug
+
+    Strips the angle brackets that JDAS writes around e.g. "<Default>", only for the
+    elements flagged with fix_delim_bug in asmljobsdef.py (see asmlSection.fixDelimBug).
+    """
+    if 'fix_delim_bug' not in ASMLJOBSECTIONS[sectionname]['elements'][elementname]:
+        return value
+
+    return [v[1:-1] if v[:1] == '<' and v[-1:] == '>' else v for v in value]
+
+def idNormalizeTransform(sectionname,elementname,value):
+    """ Output transform normalizing identifiers
+
+    Strips surrounding whitespace from and upper-cases the values of id elements
+    and of elements referring to ids defined in other sections.
+    """
+    elementdict = ASMLJOBSECTIONS[sectionname]['elements'][elementname]
+    if elementdict['element_type'] != 'string' or (elementname not in ASMLJOBSECTIONS[sectionname]['id_elements']
+                                                    and 'defined_in' not in elementdict):
+        return value
+
+    return [v.strip().upper() for v in value]
+
+class floatPrecisionTransform(object):
+    """ Output transform rounding float values to a number of decimals
+
+    Instances with the same number of decimals compare equal, so that the cached
+    section text is reused across writes.
+    """
+    def __init__(self,decimals):
+        self.decimals = decimals
+
+    def __call__(self,sectionname,elementname,value):
+        if ASMLJOBSECTIONS[sectionname]['elements'][elementname]['element_type'] != 'float':
+            return value
+
+        return [round(v,self.decimals) for v in value]
+
+    def __eq__(self,other):
+        return isinstance(other,floatPrecisionTransform) and other.decimals == self.decimals
+
+    def __ne__(self,other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((floatPrecisionTransform,self.decimals))
+
+# Output transforms applied by asmlAscii.makeAscii when fix_delim_bug is set
+ASMLOUTPUTTRANSFORMS = (delimBugTransform,)
+
+
+
+# Python types expected for each element type
+ASMLELEMENTTYPES = {'int':int, 'float':float, 'string':str, 'multiline':str}
+
+def _violation(sectionname,index,elementname,value,message,line=None):
+    """ Packs a validation violation into a dictionary """
+    return {'section':sectionname, 'index':index, 'element':elementname, 'value':value, 'message':message, 'line':line}
+
+def _checkElementValues(sectionname,elementname,elementdict,values):
+    """ Checks the values of one element across a list of sections
+
+    values is a list with one entry per section (None where the element is unset).
+    The type test and validator are prepared once for the element specification
+    and then applied to every value. Returns a list of violations.
+    """
+    violations = []
+    count = elementdict['count']
+    expectedtype = ASMLELEMENTTYPES[elementdict['element_type']]
+    validator = elementdict['validator']
+    allowed = lo = hi = None
+    if validator is not None:
+        if validator[0] == 'list':
+            allowed = set(validator[1:])
+        elif validator[0] == 'range':
+            lo, hi = validator[1], validator[2]
+
+    for index, value in enumerate(values):
+        if value is None:
+            if not elementdict['is_optional']:
+                violations.append(_violation(sectionname,index,elementname,None,'Required element not specified'))
+            continue
+        if not isinstance(value,list) or len(value) != count:
+            violations.append(_violation(sectionname,index,elementname,value,'Expects {:d} value(s)'.format(count)))
+            continue
+        # bool is a subclass of int, but not a valid integer value
+        badtypes = [v for v in value if not isinstance(v,expectedtype) or (isinstance(v,bool) and expectedtype is not bool)]
+        if badtypes:
+            violations.append(_violation(sectionname,index,elementname,value,
+                'Expects {}, received {}'.format(elementdict['element_type'],type(badtypes[0]).__name__)))
+            continue
+        if allowed is not None:
+            for v in value:
+                if v not in allowed:
+                    violations.append(_violation(sectionname,index,elementname,value,
+                        'Expects values from set {}, received {}'.format(validator[1:],v)))
+                    break
+        elif lo is not None:
+            for v in value:
+                if v < lo or v > hi:
+                    violations.append(_violation(sectionname,index,elementname,value,
+                        'Expects values between {} and {}, received {}'.format(lo,hi,v)))
+                    break
+
+    return violations
+
+# NumPy dtype kinds accepted for each element type
+ASMLDTYPEKINDS = {'int':'iu', 'float':'f', 'string':'U', 'multiline':'U'}
+
+def _isBroadcast(column,count):
+    """ Checks whether a column is a single value to use for every section """
+    if isinstance(column,str) or not hasattr(column,'__len__'):
+        return True
+    if hasattr(column,'ndim'):
+        return column.ndim == (0 if count == 1 else 1)
+    if count == 1 or len(column) == 0 or column[0] is None:
+        return False
+
+    return isinstance(column[0],str) or not hasattr(column[0],'__len__')
+
+def _checkColumn(sectionname,elementname,elementdict,column,dtype):
+    """ Validates a column of element values as a whole
+
+    Returns the column as a list with one list of values (or None) per section.
+    Raises TypeError or ValueError describing the first violation.
+    """
+    count = elementdict['count']
+    if dtype is not None:
+        # NumPy array: check shape and dtype once, then convert to Python values
+        if dtype.kind not in ASMLDTYPEKINDS[elementdict['element_type']]:
+            raise TypeError('{} element expects {}, received array of {}'.format(elementname,elementdict['element_type'],dtype))
+        if column.shape[1:] != (() if count == 1 else (count,)):
+            raise TypeError('{} element expects {:d} value(s) per section, received array of shape {}'.format(elementname,count,column.shape))
+        values = column.tolist()
+        if count == 1:
+            values = [[v] for v in values]
+
+        validator = elementdict['validator']
+        if validator is not None and len(values) > 0:
+            if validator[0] == 'range':
+                if column.min() < validator[1] or column.max() > validator[2]:
+                    raise ValueError('{} element expects values between {} and {}, received values between {} and {}'.format(
+                        elementname,validator[1],validator[2],column.min(),column.max()))
+            elif validator[0] == 'list':
+                invalid = set(column.ravel().tolist()) - set(validator[1:])
+                if invalid:
+                    raise ValueError('{} element expects values from set {}, received {}'.format(elementname,validator[1:],sorted(invalid)))
+
+        return values
+
+    values = []
+    for value in column:
+        if value is None:
+            values.append(None)
+        elif count == 1 and (isinstance(value,str) or not hasattr(value,'__len__')):
+            values.append([value])
+        else:
+            values.append(list(value))
+
+    violations = _checkElementValues(sectionname,elementname,dict(elementdict,is_optional=True),values)
+    if violations:
+        raise ValueError('{} element: {}'.format(elementname,violations[0]['message']))
+
+    return values
+
+
+
+def makeColumnSections(sectionname,**columns):
+    """ Makes many sections of one type from columns of element values
+
+    Each keyword names an element and gives a list, tuple or NumPy array with one
+    entry per new section. For elements with a count greater than one, each entry
+    is itself a sequence of values, e.g. an N x 2 array for IMAGE_CELL_SHIFT.
+    A single value (or a single flat sequence of count values) is used for every
+    new section, and None entries leave the element unset. Elements that are not
+    given keep their defaults.
+
+    Each column is validated once as a whole: NumPy arrays by their dtype, and
+    range and list validators against the column extremes or its set of distinct
+    values. Unlike set, invalid values raise a ValueError rather than being
+    silently ignored.
+
+    Returns the list of new sections, which do not belong to any jobfile.
+    """
+    if sectionname not in ASMLJOBSECTIONS:
+        raise ValueError('Section {} not found in ASMLJOBSECTIONS'.format(sectionname))
+
+    elementdicts = ASMLJOBSECTIONS[sectionname]['elements']
+    for elementname in columns:
+        if elementname not in elementdicts:
+            raise ValueError('Element {} not found in section {} in ASMLJOBSECTIONS'.format(elementname,sectionname))
+
+    # Split columns into per-section values and broadcast values
+    nsections = None
+    rowcolumns = OrderedDict()
+    broadcasts = OrderedDict()
+    for elementname in columns:
+        elementdict = elementdicts[elementname]
+        column = columns[elementname]
+        if _isBroadcast(column,elementdict['count']):
+            value = column.tolist() if hasattr(column,'tolist') else column
+            broadcasts[elementname] = value if isinstance(value,list) else [value]
+            _checkColumn(sectionname,elementname,elementdict,[broadcasts[elementname]],None)
+            continue
+
+        if nsections is None:
+            nsections = len(column)
+        elif len(column) != nsections:
+            raise ValueError('Column {} has {:d} entries, expected {:d}'.format(elementname,len(column),nsections))
+        dtype = getattr(column,'dtype',None)
+        if dtype is not None and dtype.kind == 'O':
+            column, dtype = column.tolist(), None   # Object arrays are checked value by value
+        rowcolumns[elementname] = _checkColumn(sectionname,elementname,elementdict,column,dtype)
+
+    if nsections is None:
+        nsections = 1   # Only broadcast values: make a single section
+
+    newsections = []
+    for n in range(nsections):
+        newsection = asmlSection(sectionname)
+        for elementname in broadcasts:
+            newsection.elements[elementname].value = list(broadcasts[elementname])
+        for elementname in rowcolumns:
+            newsection.elements[elementname].value = rowcolumns[elementname][n]
+        newsections.append(newsection)
+
+    return newsections
+
+
+
+class asmlSummary(object):
+    """ Class for summary statistics of an ASML jobfile
+
+    Counters are updated incrementally as sections are added to and discarded from
+    the jobfile (and around changes of the id elements they depend on), so reading
+    the summary does not require a pass over the sections. Stores the following:
+
+    sectioncounts       : number of sections of each type
+    imageplacements     : number of IMAGE_DISTRIBUTION placements of each image
+    imagelayers         : number of RETICLE_DATA sections of each image, by layer
+    layerplacements     : number of placements exposed in each layer, i.e. the
+                          placements of every image with reticle data in that layer
+    placementhistogram  : number of images with each placement count, used to
+                          maintain the maximum number of placements of an image
+    maxplacements       : maximum number of placements of an image
+    """
+
+    # Elements the counters depend on, by section type
+    TRACKED = {'IMAGE_DISTRIBUTION':['IMAGE_ID'],
+               'RETICLE_DATA':['IMAGE_ID','LAYER_ID']}
+
+    def __init__(self):
+        """ Initializes empty counters """
+        self.sectioncounts = Counter()
+        self.imageplacements = Counter()
+        self.imagelayers = {}
+        self.layerplacements = Counter()
+        self.placementhistogram = Counter()
+        self.maxplacements = 0
+
+    def add(self,section):
+        """ Counts a section added to the jobfile """
+        self._count(section,1)
+
+    def discard(self,section):
+        """ Uncounts a section removed from the jobfile """
+        self._count(section,-1)
+
+    def _count(self,section,change):
+        """ Applies a change of +1 or -1 for a section to the counters """
+        self.sectioncounts[section.sectionname] += change
+
+        if section.sectionname == 'IMAGE_DISTRIBUTION':
+            image_id = firstValue(section,'IMAGE_ID')
+            if image_id is not None:
+                self._changePlacements(image_id,change)
+
+        elif section.sectionname == 'RETICLE_DATA':
+            image_id = firstValue(section,'IMAGE_ID')
+            layer_id = firstValue(section,'LAYER_ID')
+            if image_id is not None and layer_id is not None:
+                layers = self.imagelayers.setdefault(image_id,Counter())
+                layers[layer_id] += change
+                if layers[layer_id] == 0:
+                    del layers[layer_id]
+                    if not layers:
+                        del self.imagelayers[image_id]
+                self.layerplacements[layer_id] += change*self.imageplacements[image_id]
+
+    def _changePlacements(self,image_id,change):
+        """ Changes the placement count of an image by one """
+        old = self.imageplacements[image_id]
+        new = old + change
+        self.imageplacements[image_id] = new
+
+        # Keep the histogram of placement counts and its maximum
+        if old > 0:
+            self.placementhistogram[old] -= 1
+            if self.placementhistogram[old] == 0:
+                del self.placementhistogram[old]
+        if new > 0:
+            self.placementhistogram[new] += 1
+        if new > self.maxplacements:
+            self.maxplacements = new
+        elif old == self.maxplacements and old not in self.placementhistogram:
+            self.maxplacements = new    # Counts change by one, so new is the next highest
+
+        for layer_id, n in self.imagelayers.get(image_id,{}).items():
+            self.layerplacements[layer_id] += change*n
+
+    def results(self):
+        """ Returns the summary statistics as a dictionary """
+        return OrderedDict([
+            ('images', self.sectioncounts['IMAGE_DEFINITION']),
+            ('instances', self.sectioncounts['INSTANCE_DEFINITION']),
+            ('layers', self.sectioncounts['LAYER_DEFINITION']),
+            ('placements', self.sectioncounts['IMAGE_DISTRIBUTION']),
+            ('placements_per_layer', OrderedDict((layer_id,n) for layer_id,n in self.layerplacements.items() if n > 0)),
+            ('max_placements_per_image', self.maxplacements)])
+
+class _recounted(object):
+    """ Context manager uncounting a section from the summaries of its jobfiles, and counting it again on exit """
+    def __init__(self,section):
+        self.section = section
+
+    def __enter__(self):
+        for owner in self.section.owners:
+            owner.summary.discard(self.section)
+
+    def __exit__(self,*exc_info):
+        for owner in self.section.owners:
+            owner.summary.add(self.section)
+
+def firstValue(section,elementname):
+    """ Gets the first value of an element, or None if it is unset """
+    try:
+        value = section.get(elementname)
+    except KeyError:
+        return None
+
+    return None if value is None else value[0]
+
+# Types whose instances hold no references to other objects
+_ATOMICTYPES = (str, bytes, int, float, bool, type(None))
+
+def _reachable(obj):
+    """ Gets the ids of all objects reachable from an object """
+    ids = set()
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in ids:
+            continue
+        ids.add(id(o))
+        if isinstance(o,dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o,(list,tuple,set,frozenset,deque)):
+            stack.extend(o)
+    return ids
+
+def _deepSize(obj,seen,stats):
+    """ Gets the size in bytes of an object and the objects it references
+
+    Objects whose ids are in seen are not counted again; their sizes are added
+    to stats['shared'] the first time they are met again. Objects whose ids are
+    in stats['definitionids'] belong to the jobfile definitions (ASMLJOBSECTIONS)
+    and are added to stats['definitions'] instead. Other jobfiles (e.g. those
+    also owning a section) are not followed.
+    """
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in stats['definitionids']:
+            if id(o) not in stats['definitionsseen']:
+                stats['definitionsseen'].add(id(o))
+                stats['definitions'] += sys.getsizeof(o)
+            continue
+        if id(o) in seen:
+            if id(o) not in stats['sharedseen']:
+                stats['sharedseen'].add(id(o))
+                stats['shared'] += sys.getsizeof(o)
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o,_ATOMICTYPES) or isinstance(o,asmlAscii):
+            continue
+        if isinstance(o,dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o,(list,tuple,set,frozenset,deque)):
+            stack.extend(o)
+        if hasattr(o,'__dict__'):
+            stack.append(o.__dict__)
+
+    return size
 
 
 
@@ -328,11 +1001,27 @@ class asmlAscii(object):
     and to read and write ASCII strings and files.
     """
     def __init__(self):
-        """ Initializes dictionary of empty section lists """
+        """ Initializes dictionary of empty section lists and summary statistics """
         self.sections = OrderedDict()
         for sectionname in ASMLJOBSECTIONS:
             self.sections[sectionname] = []
-    
+        self.summary = asmlSummary()
+
+    def __getstate__(self):
+        """ Leaves out the summary statistics, which are recounted when restoring """
+        state = self.__dict__.copy()
+        state.pop('summary',None)
+        return state
+
+    def __setstate__(self,state):
+        """ Restores a copied or unpickled jobfile as the owner of its sections """
+        self.__dict__.update(state)
+        self.summary = asmlSummary()
+        for sectionname in self.sections:
+            for section in self.sections[sectionname]:
+                section.owners.append(self)
+                self.summary.add(section)
+
     def append(self,newsection,check_interference=False):
         """ Adds a new section object to the jobfile
 
@@ -347,10 +1036,130 @@ class asmlAscii(object):
                 if asmlSection.interfere(section,newsection):
                     return False
 
-        # If the interference test passes, append the new section            
+        # If the interference test passes, append the new section
         self.sections[newsection.sectionname].append(newsection)
+        newsection.owners.append(self)
+        self.summary.add(newsection)
         return True
 
+    def extend(self,newsections,check_interference=False):
+        """ Adds many section objects to the jobfile
+
+        Equivalent to appending the sections one at a time, but interference is
+        checked by looking up the id element values of each new section in a hash
+        of the sections already in the jobfile, so the cost is linear rather than
+        quadratic in the number of sections.
+
+        Returns the number of sections added.
+        """
+        idkeys = {}
+        added = 0
+        for newsection in newsections:
+            sectionname = newsection.sectionname
+            if check_interference:
+                if sectionname not in idkeys:
+                    idkeys[sectionname] = set(section.getIdKey() for section in self.sections[sectionname])
+                if not newsection.multiple_allowed and self.sections[sectionname]:
+                    continue    # Only one instance allowed
+                key = newsection.getIdKey()
+                if key in idkeys[sectionname]:
+                    continue
+                idkeys[sectionname].add(key)
+            self.append(newsection)
+            added += 1
+
+        return added
+
+    def extendColumns(self,sectionname,**columns):
+        """ Appends many sections of one type from columns of element values
+
+        See makeColumnSections for the columns. Returns the list of new sections.
+        """
+        newsections = makeColumnSections(sectionname,**columns)
+        self.extend(newsections)
+
+        return newsections
+
+    def toRecords(self,sectionname,elements=None):
+        """ Exports the sections of one type as a structured NumPy array
+
+        The array has one record per section and one field per element of the
+        section specification (or per element in the given list of names). Field
+        types follow element_type: int64 for 'int', float64 for 'float', and unicode
+        strings sized to the longest value for 'string' and 'multiline'. Elements
+        with a count greater than one become subarray fields.
+
+        Returns a numpy.ma.MaskedArray in which unset values are masked.
+        """
+        import numpy as np      # Only needed for record export
+
+        if sectionname not in ASMLJOBSECTIONS:
+            raise ValueError('Section {} not found in ASMLJOBSECTIONS'.format(sectionname))
+        elementdicts = ASMLJOBSECTIONS[sectionname]['elements']
+        if elements is None:
+            elements = list(elementdicts)
+
+        sectionlist = self.sections[sectionname]
+        dtype = []
+        fields = OrderedDict()
+        for elementname in elements:
+            if elementname not in elementdicts:
+                raise ValueError('Element {} not found in section {} in ASMLJOBSECTIONS'.format(elementname,sectionname))
+            elementdict = elementdicts[elementname]
+            count = elementdict['count']
+
+            values = []
+            missing = []
+            for section in sectionlist:
+                element = section.elements.get(elementname)
+                value = None if element is None else element.value
+                missing.append(value is None)
+                values.append(value)
+
+            if elementdict['element_type'] == 'int':
+                fieldtype, fill = np.int64, 0
+            elif elementdict['element_type'] == 'float':
+                fieldtype, fill = np.float64, np.nan
+            else:
+                maxlen = max([len(v) for value in values if value is not None for v in value] + [1])
+                fieldtype, fill = 'U{:d}'.format(maxlen), ''
+            values = [[fill]*count if value is None else value for value in values]
+
+            shape = () if count == 1 else (count,)
+            dtype.append((elementname,fieldtype,shape))
+            fields[elementname] = (values,missing,shape)
+
+        records = np.zeros(len(sectionlist),dtype=dtype)
+        mask = np.zeros(len(sectionlist),dtype=[(elementname,bool,shape) for elementname,fieldtype,shape in dtype])
+        for elementname in fields:
+            values, missing, shape = fields[elementname]
+            if len(values) > 0:
+                records[elementname] = np.array(values,dtype=records.dtype[elementname].base).reshape((len(values),)+shape)
+                mask[elementname] = np.array(missing).reshape((len(missing),)+(1,)*len(shape))
+
+        return np.ma.array(records,mask=mask)
+
+    def fromRecords(self,sectionname,records):
+        """ Appends sections of one type from a structured NumPy array
+
+        Inverse of toRecords: each field is taken as a column for extendColumns, and
+        masked values (if records is a masked array) leave the element unset.
+
+        Returns the list of new sections.
+        """
+        import numpy as np      # Only needed for record import
+
+        columns = OrderedDict()
+        for elementname in records.dtype.names:
+            column = np.ma.getdata(records[elementname])
+            missing = np.ma.getmaskarray(records[elementname])
+            if missing.any():
+                missing = missing.reshape((len(missing),-1)).any(axis=1)
+                column = [None if m else v for v,m in zip(column.tolist(),missing)]
+            columns[elementname] = column
+
+        return self.extendColumns(sectionname,**columns)
+
     def get(self,sectionname,**id_element_values):
         """ Get sections from jobfile
 
@@ -380,17 +1189,24 @@ class asmlAscii(object):
         ID elements. If the specification matches several sections
         in the jobfile, removes all of them.
         """
+        for id_element_name in id_element_values:
+            if id_element_name not in ASMLJOBSECTIONS[sectionname]['id_elements']:
+                raise ValueError('{} not a valid id element for {} section'.format(id_element_name,sectionname))
+
+        keepsections = []
         for section in self.sections[sectionname]:
             id_match = True
             for id_element_name in id_element_values:
-                if id_element_name not in section.id_elements:
-                    raise ValueError('{} not a valid id element for {} section'.format(id_element_name,sectionname))
-
                 if section.get(id_element_name) != id_element_values[id_element_name]:
                     id_match = False
             if id_match:
-                self.sections.remove(section)
-    
+                self.summary.discard(section)
+                section.owners.remove(self)
+            else:
+                keepsections.append(section)
+
+        self.sections[sectionname] = keepsections
+
     @staticmethod
     def merge(job1,job2):
         """ Merges two jobfiles
@@ -399,12 +1215,51 @@ class asmlAscii(object):
         ignore conflicting sections from the second jobfile.
         """
         mergedjob = copy.deepcopy(job1)
-        for sectionname in ASMLJOBSECTIONS:
-            for section in job2.sections[sectionname]:
-                mergedjob.append(section,check_interference=True)
+        mergedjob.extend([section for sectionname in ASMLJOBSECTIONS for section in job2.sections[sectionname]],
+                         check_interference=True)
         
         return mergedjob
-    
+
+    def diff(self,other):
+        """ Structural comparison with another jobfile
+
+        Sections are matched by section name and the values of their id elements
+        using a hash join, so the comparison runs in linear time. Sections sharing
+        the same id element values are matched in the order they appear.
+
+        Returns a dictionary with keys:
+            added   : list of sections in other without a match in this jobfile
+            removed : list of sections in this jobfile without a match in other
+            changed : list of (section, othersection, differences) tuples, where
+                      differences is an OrderedDict of element name to
+                      (value, othervalue) for every element that differs
+        """
+        added = []
+        removed = []
+        changed = []
+        for sectionname in ASMLJOBSECTIONS:
+            # Build phase: hash this jobfile's sections by id key
+            sectionsbykey = OrderedDict()
+            for section in self.sections[sectionname]:
+                sectionsbykey.setdefault(section.getIdKey(),deque()).append(section)
+
+            # Probe phase: look up each section of the other jobfile
+            for othersection in other.sections[sectionname]:
+                matches = sectionsbykey.get(othersection.getIdKey())
+                if not matches:
+                    added.append(othersection)
+                    continue
+
+                section = matches.popleft()
+                differences = asmlSection.compare(section,othersection)
+                if differences:
+                    changed.append((section,othersection,differences))
+
+            for matches in sectionsbykey.values():
+                removed.extend(matches)
+
+        return {'added':added, 'removed':removed, 'changed':changed}
+
     def isSpecified(self):
         """ Checks whether jobfile is adequately specified
 
@@ -432,56 +1287,337 @@ class asmlAscii(object):
             for section in self.sections[sectionname]:
                 if not section.isSpecified():
                     return False
-        
+
         return True
-        
-    def makeAscii(self,fix_delim_bug=True):
-        """ Generates ASCII string representation of jobfile """
-        asciistring = ''
+
+    def validate(self):
+        """ Validates the whole jobfile in a single pass
+
+        Unlike isSpecified, which stops at the first problem, and element.set, which
+        silently ignores values that fail the range or list check, this collects every
+        violation in the jobfile. Checks are grouped by element specification: for each
+        element of each section type, the values are gathered across all sections and
+        checked together against a type test and validator prepared once.
+
+        Returns a list of violations, each a dictionary with keys:
+            section : name of the section type
+            index   : position of the section in self.sections[section] (None for
+                      violations of the section type as a whole)
+            element : name of the element (None for section-level violations)
+            value   : offending value
+            message : description of the violation
+            line    : line number in the file read, for values rejected while reading
+                      (None otherwise)
+
+        Values rejected while reading (see asmlSection.readAscii) are not in the
+        sections, so they are reported from the record kept by each section.
+        """
+        violations = []
+        for sectionname in ASMLJOBSECTIONS:
+            sectiondict = ASMLJOBSECTIONS[sectionname]
+            sectionlist = self.sections[sectionname]
+
+            if not sectiondict['is_optional'] and len(sectionlist) == 0:
+                violations.append(_violation(sectionname,None,None,None,'Required section not found'))
+            if not sectiondict['multiple_allowed'] and len(sectionlist) > 1:
+                violations.append(_violation(sectionname,None,None,len(sectionlist),'Job can only have one section'))
+            if len(sectionlist) == 0:
+                continue
+
+            for elementname in sectiondict['elements']:
+                values = []
+                for section in sectionlist:
+                    element = section.elements.get(elementname)
+                    values.append(None if element is None else element.get())
+                violations.extend(_checkElementValues(sectionname,elementname,sectiondict['elements'][elementname],values))
+
+            for index, section in enumerate(sectionlist):
+                for rejection in section.rejected:
+                    elementname = rejection['element']
+                    checks = _checkElementValues(sectionname,elementname,sectiondict['elements'][elementname],[rejection['value']])
+                    message = checks[0]['message'] if checks else 'Invalid value'
+                    violations.append(_violation(sectionname,index,elementname,rejection['value'],
+                                                 'Rejected while reading: ' + message,rejection['line']))
+
+        return violations
+
+    def checkLimits(self):
+        """ Checks the jobfile against the scanner limits in ASMLSECTIONLIMITS
+
+        Only section counts are used, so the check is cheap enough to run after
+        every change. Returns a list of violations in the format of validate.
+        """
+        violations = []
+        for sectionname in ASMLSECTIONLIMITS:
+            count = len(self.sections[sectionname])
+            if count > ASMLSECTIONLIMITS[sectionname]:
+                violations.append(_violation(sectionname,None,None,count,
+                    '{:d} sections exceed the limit of {:d}'.format(count,ASMLSECTIONLIMITS[sectionname])))
+
+        return violations
+
+    def shard(self,common_images=()):
+        """ Splits the jobfile into jobfiles within the scanner limits
+
+        Cells (by CELL_SELECTION of IMAGE_DISTRIBUTION) are the units of the split:
+        each shard gets all placements in its cells, together with the image
+        definitions and reticle data of the images placed there. Cells with the
+        same set of images are kept together, and cells are packed greedily, largest
+        image sets first, into the shard that needs the fewest additional images and
+        reticle data sections, so that images are duplicated across as few shards as
+        possible. A new shard is only opened when a cell fits in none of the others.
+
+        Common images are defined in every shard, with their image definitions and
+        reticle data. These are the images given in common_images (e.g. flood
+        exposures in the template), images used by alignment marks and images
+        without placements. Their placements, and other sections selected by cell,
+        are put in exactly one shard, the one holding the cell or else the first,
+        so that each placement is exposed once. All other sections, e.g. layers
+        and alignment, are copied to every shard.
+
+        Returns a list of jobfiles; a jobfile within the limits is returned as a
+        single copy. Raises ValueError if the limits cannot be met by splitting cells.
+        """
+        if len(self.sections['LAYER_DEFINITION']) > ASMLMAXLAYERCOUNT:
+            raise ValueError('{:d} layers exceed the limit of {:d}, which cannot be fixed by splitting cells'
+                             .format(len(self.sections['LAYER_DEFINITION']),ASMLMAXLAYERCOUNT))
+        if not self.checkLimits():
+            return [copy.deepcopy(self)]
+
+        # Images of each cell, and the common images kept in every shard
+        placed = set()
+        for section in self.sections['IMAGE_DISTRIBUTION']:
+            placed.add(firstValue(section,'IMAGE_ID'))
+        common = set(common_images)
+        for section in self.sections['ALIGNMENT_MARK']:
+            common.add(firstValue(section,'IMAGE_ID'))
+        for section in self.sections['IMAGE_DEFINITION']:
+            if firstValue(section,'IMAGE_ID') not in placed:
+                common.add(firstValue(section,'IMAGE_ID'))
+
+        cellimages = OrderedDict()
+        for section in self.sections['IMAGE_DISTRIBUTION']:
+            image_id = firstValue(section,'IMAGE_ID')
+            if image_id not in common:
+                cellimages.setdefault(tuple(section.get('CELL_SELECTION')),set()).add(image_id)
+
+        units = OrderedDict()
+        for cell in cellimages:
+            units.setdefault(frozenset(cellimages[cell]),[]).append(cell)
+
+        # Room left for cell images once the common images are counted
+        reticledata = Counter(firstValue(section,'IMAGE_ID') for section in self.sections['RETICLE_DATA'])
+        defined = set(firstValue(section,'IMAGE_ID') for section in self.sections['IMAGE_DEFINITION'])
+        imagelimit = ASMLMAXIMAGECOUNT - len(common & defined)
+        reticlelimit = ASMLMAXRETICLEDATACOUNT - sum(reticledata[image_id] for image_id in common)
+        if imagelimit < 0 or reticlelimit < 0:
+            raise ValueError('Common images alone exceed the image or reticle data limit')
+
+        shards = []
+        for images in sorted(units,key=lambda images: (-len(images),-sum(reticledata[i] for i in images))):
+            if len(images & defined) > imagelimit or sum(reticledata[i] for i in images) > reticlelimit:
+                raise ValueError('Images of cell {} alone exceed the image or reticle data limit'.format(list(units[images][0])))
+
+            best = None
+            for shard in shards:
+                newimages = images - shard['images']
+                imagecount = len((shard['images'] | newimages) & defined)
+                reticlecount = shard['reticledata'] + sum(reticledata[i] for i in newimages)
+                if imagecount <= imagelimit and reticlecount <= reticlelimit:
+                    score = (len(newimages),reticlecount - shard['reticledata'],-imagecount)
+                    if best is None or score < bestscore:
+                        best, bestscore = shard, score
+            if best is None:
+                best = {'images':set(), 'reticledata':0, 'cells':set()}
+                shards.append(best)
+            best['reticledata'] += sum(reticledata[i] for i in images - best['images'])
+            best['images'] |= images
+            best['cells'].update(units[images])
+
+        cellshards = dict((cell,n) for n, shard in enumerate(shards) for cell in shard['cells'])
+
+        jobfiles = []
+        for n, shard in enumerate(shards):
+            images = shard['images'] | common
+            jobfile = asmlAscii()
+            for sectionname in ASMLJOBSECTIONS:
+                id_elements = ASMLJOBSECTIONS[sectionname]['id_elements']
+                for section in self.sections[sectionname]:
+                    image_id = firstValue(section,'IMAGE_ID') if 'IMAGE_ID' in id_elements else None
+                    if image_id is not None and image_id not in images:
+                        continue
+                    if 'CELL_SELECTION' in id_elements:
+                        cell = tuple(section.get('CELL_SELECTION'))
+                        if image_id in common:
+                            if cellshards.get(cell,0) != n:
+                                continue
+                        elif cell in cellimages and cell not in shard['cells']:
+                            continue
+                    jobfile.append(copy.deepcopy(section))
+            jobfiles.append(jobfile)
+
+        return jobfiles
+
+    def makeAscii(self,fix_delim_bug=True,transforms=None):
+        """ Generates ASCII string representation of jobfile
+
+        The text is rendered through a pipeline of output transforms, applied to
+        copies of the values as each section is written (see asmlSection.makeAscii),
+        so the jobfile itself is not modified. By default the pipeline is
+        ASMLOUTPUTTRANSFORMS, i.e. the JDAS delimiter fix, or no transforms if
+        fix_delim_bug is False. Other pipelines can be given as a sequence of
+        transforms, e.g. (delimBugTransform, idNormalizeTransform, floatPrecisionTransform(3)).
+        """
+        if transforms is None:
+            transforms = ASMLOUTPUTTRANSFORMS if fix_delim_bug else ()
+
+        asciistrings = []
         for sectionname in self.sections:
             for section in self.sections[sectionname]:
-                if fix_delim_bug:
-                    section.fixDelimBug()
-                asciistring += section.makeAscii() + '\n\n'
-        
-        return asciistring[:-2]     # strip off final newlines
+                asciistrings.append(section.makeAscii(transforms))
+
+        return '\n\n'.join(asciistrings)
     
-    def readAscii(self,asciistring):
-        """ Reads an ASCII string representation of a jobfile section """
+    def readAscii(self,asciistring,sections=None):
+        """ Reads an ASCII string representation of a jobfile section
 
-        # Matches all section blocks in the string
-        mm = re.findall(r'START_SECTION (\S*)\n(.*?)\nEND_SECTION',asciistring,re.DOTALL)
-        for m in mm:
-            sectionname = m[0]
-            sectionbody = m[1]
-            newsection = asmlSection(sectionname)
-            newsection.readAscii(sectionbody)
+        If a list of section names is given, only sections of those types are fully
+        parsed. All other sections are kept as raw text blocks (asmlRawSection) that
+        are written back byte-for-byte unless they are modified.
+        """
+        if sections is not None:
+            for sectionname in sections:
+                if sectionname not in ASMLJOBSECTIONS:
+                    raise ValueError('Section {} not found in ASMLJOBSECTIONS'.format(sectionname))
+
+        # Matches all section blocks in the string, counting lines as it goes
+        line = 1
+        position = 0
+        for m in re.finditer(r'START_SECTION (\S*)\n(.*?)\nEND_SECTION',asciistring,re.DOTALL):
+            line += asciistring.count('\n',position,m.start())
+            position = m.start()
+            sectionname = m.group(1)
+            if sections is None or sectionname in sections:
+                newsection = asmlSection(sectionname)
+                newsection.readAscii(m.group(2),line + 1)
+            else:
+                newsection = asmlRawSection(sectionname,m.group(0),line)
 
             self.append(newsection)
 
-    def readAsciiJobfile(self,filename):
-        """ Loads and parses ASCII jobfile """
+    def readAsciiJobfile(self,filename,sections=None):
+        """ Loads and parses ASCII jobfile
+
+        See readAscii for the meaning of sections.
+        """
         with open(filename,'r') as f:
             asciistring = f.read()
-        
-        self.readAscii(asciistring)
+
+        self.readAscii(asciistring,sections=sections)
     
-    def writeAsciiJobfile(self,filename):
-        """ Generates and saves ASCII jobfile """
-        asciistring = self.makeAscii()
+    def writeAsciiJobfile(self,filename,fix_delim_bug=True,transforms=None):
+        """ Generates and saves ASCII jobfile
+
+        See makeAscii for the output transforms.
+        """
+        asciistring = self.makeAscii(fix_delim_bug=fix_delim_bug,transforms=transforms)
 
         with open(filename,'w') as f:
             f.write(asciistring)
 
-    def printSummary(self):
-        """ Print summary information on the jobfile
+    def getSummary(self):
+        """ Gets summary information on the jobfile
+
+        The counters are maintained incrementally by append, extend, remove and the
+        set and readAscii calls of the sections, so no pass over the sections is
+        needed. Sections added or removed by changing the section lists directly, and
+        values changed directly on element objects, are not counted.
 
-        Summary values could include:
+        Returns a dictionary with:
             - number of images
             - number of instances
             - number of layers
+            - number of image placements
             - number of image placements per layer
             - max. number of placements of each image
-            - etc. 
         """
-        print('Not yet implemented')
+        return self.summary.results()
+
+    def printSummary(self):
+        """ Print summary information on the jobfile
+
+        Returns the summary dictionary from getSummary.
+        """
+        summary = self.getSummary()
+        print('Images                      : {:d}'.format(summary['images']))
+        print('Instances                   : {:d}'.format(summary['instances']))
+        print('Layers                      : {:d}'.format(summary['layers']))
+        print('Image placements            : {:d}'.format(summary['placements']))
+        for layer_id in summary['placements_per_layer']:
+            print('  in layer {:<18}: {:d}'.format(layer_id,summary['placements_per_layer'][layer_id]))
+        print('Max. placements of an image : {:d}'.format(summary['max_placements_per_image']))
+
+        return summary
+
+    def memoryReport(self):
+        """ Estimates the memory used by the jobfile
+
+        Sizes are deep sizes in bytes from sys.getsizeof, following the references
+        of each section. An object referenced from several places (e.g. a default
+        value or a string reused across sections) is counted once, against the
+        first section or element it is found in, and its size is also reported as
+        shared. Objects belonging to the jobfile definitions in asmljobsdef.py,
+        such as element names (interned strings), defaults and validators, are
+        reported as definitions but not counted in the total, as they are shared
+        by all jobfiles in the process.
+
+        Returns an OrderedDict with:
+            total       : bytes used by the jobfile
+            sections    : OrderedDict of section name to OrderedDict with count,
+                          bytes, and elements, an OrderedDict of element name to
+                          bytes (for raw sections, only parsed elements are listed
+                          and the raw text is counted against the section)
+            other       : bytes of the section lists, summary counters and jobfile object
+            shared      : bytes of objects referenced from more than one place
+            definitions : bytes of definition objects referenced by the jobfile
+        """
+        seen = set([id(self)])
+        stats = {'definitionids':_reachable(ASMLJOBSECTIONS), 'definitionsseen':set(), 'definitions':0,
+                 'sharedseen':set(), 'shared':0}
+
+        sections = OrderedDict()
+        for sectionname in self.sections:
+            if not self.sections[sectionname]:
+                continue
+            report = OrderedDict([('count',0), ('bytes',0), ('elements',OrderedDict())])
+            for section in self.sections[sectionname]:
+                if id(section) in seen:
+                    continue
+                seen.add(id(section))
+                state = section.__dict__
+                seen.add(id(state))
+                size = sys.getsizeof(section) + sys.getsizeof(state)
+                elements = state.get('elements',state.get('_elements'))
+                for key, value in state.items():
+                    if value is elements and elements is not None:
+                        continue
+                    size += _deepSize(key,seen,stats) + _deepSize(value,seen,stats)
+                if elements is not None:
+                    seen.add(id(elements))
+                    size += sys.getsizeof(elements)
+                    for elementname, element in elements.items():
+                        elementsize = _deepSize(elementname,seen,stats) + _deepSize(element,seen,stats)
+                        report['elements'][elementname] = report['elements'].get(elementname,0) + elementsize
+                        size += elementsize
+                report['count'] += 1
+                report['bytes'] += size
+            sections[sectionname] = report
+
+        other = sys.getsizeof(self) + _deepSize(self.__dict__,seen,stats)
+
+        return OrderedDict([
+            ('total', sum(report['bytes'] for report in sections.values()) + other),
+            ('sections', sections),
+            ('other', other),
+            ('shared', stats['shared']),
+            ('definitions', stats['definitions'])])
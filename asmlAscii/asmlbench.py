@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks guarding the performance budgets of the asmlAscii core.
+
+Usage:
+    python asmlbench.py import [--repeat N] [--budget SECONDS] [MODULE ...]
+    python asmlbench.py memory [SECTIONS ...]
+
+The import benchmark imports each module in a fresh interpreter and times the
+import, excluding interpreter startup. It fails (exit status 1) if the median
+time exceeds the budget, or if a core module pulls in one of HEAVYMODULES,
+which are only to be imported by the features that need them.
+
+The memory benchmark records with tracemalloc the peak memory allocated while
+reading, merging and writing synthetic jobfiles of increasing numbers of
+placements, along with the size estimated by asmlAscii.memoryReport. It only
+reports, and always succeeds.
+"""
+
+from __future__ import print_function, absolute_import, division
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+COREMODULES = ['asmljobsdef', 'asmlascii', 'asmlindex', 'asmlcli']
+HEAVYMODULES = ['numpy', 'scipy', 'matplotlib', 'six']
+IMPORTBUDGET = 0.1      # Seconds allowed for importing a core module
+MEMORYSIZES = [1000, 4000, 16000]   # Placements in the synthetic jobfiles
+
+# Run in a fresh interpreter: times one import and lists the heavy modules it loaded
+IMPORTSCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(' '.join(name for name in {heavy!r} if name in sys.modules))
+'''
+
+
+def importTime(module,repeat=5):
+    """ Measures the import time of a module in fresh interpreters
+
+    Modules are imported from the directory of this script. Returns the median
+    import time over repeat runs, and the list of heavy modules loaded.
+    """
+    times = []
+    for n in range(repeat):
+        output = subprocess.check_output([sys.executable,'-c',IMPORTSCRIPT.format(module=module,heavy=HEAVYMODULES)],
+                                         cwd=os.path.dirname(os.path.abspath(__file__)),universal_newlines=True)
+        lines = output.split('\n')
+        times.append(float(lines[0]))
+        heavy = lines[1].split()
+
+    return sorted(times)[len(times)//2], heavy
+
+def benchImport(modules,repeat=5,budget=IMPORTBUDGET):
+    """ Runs the import benchmark, printing one line per module
+
+    Returns boolean indicating whether all modules are within the budget.
+    """
+    passed = True
+    for module in modules:
+        seconds, heavy = importTime(module,repeat)
+        status = 'ok'
+        if seconds > budget:
+            status = 'OVER BUDGET'
+            passed = False
+        if heavy and module in COREMODULES:
+            status = 'LOADS ' + ', '.join(heavy)
+            passed = False
+        print('{:<16} {:8.1f} ms  {}'.format(module,1000*seconds,status))
+
+    return passed
+
+def syntheticJobfile(nplacements,offset=0):
+    """ Makes a jobfile with the given number of image placements
+
+    Placements are spread over images of 100 placements each, with an image
+    definition and reticle data section per image. Jobfiles with different
+    offsets have distinct images, so they can be merged without interference.
+    """
+    from asmlascii import asmlAscii
+
+    nimages = max(1,nplacements//100)
+    image_ids = ['IMAGE{:05d}'.format(n + offset) for n in range(nimages)]
+
+    jobfile = asmlAscii()
+    jobfile.extendColumns('IMAGE_DEFINITION',IMAGE_ID=image_ids,RETICLE_ID='RETICLE',
+                          IMAGE_SIZE=[1.0,1.0],MASK_SIZE=[1.0,1.0],IMAGE_SHIFT=[0.0,0.0],MASK_SHIFT=[0.0,0.0])
+    jobfile.extendColumns('IMAGE_DISTRIBUTION',IMAGE_ID=[image_ids[n % nimages] for n in range(nplacements)],
+                          INSTANCE_ID='001',DISTRIBUTION_ACTION='I',
+                          CELL_SELECTION=[[str(n % 100),str(n//100)] for n in range(nplacements)],
+                          IMAGE_CELL_SHIFT=[[0.01*(n % 7),0.01*(n % 11)] for n in range(nplacements)])
+    jobfile.extendColumns('RETICLE_DATA',IMAGE_ID=image_ids,LAYER_ID='L1',RETICLE_ID='RETICLE',
+                          IMAGE_SIZE=[1.0,1.0],MASK_SIZE=[1.0,1.0],IMAGE_SHIFT=[0.0,0.0],MASK_SHIFT=[0.0,0.0],
+                          GLOBAL_LEVEL_POINT_1=[0.0,0.0],GLOBAL_LEVEL_POINT_2=[0.0,0.0],GLOBAL_LEVEL_POINT_3=[0.0,0.0])
+
+    return jobfile
+
+def _tracePeak(function,*args):
+    """ Calls a function under tracemalloc
+
+    Returns the result and the peak memory allocated during the call.
+    """
+    tracemalloc.start()
+    try:
+        result = function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, peak
+
+def benchMemory(sizes=MEMORYSIZES):
+    """ Runs the memory benchmark, printing one line per jobfile size
+
+    Returns a list of dictionaries with the number of placements and the peak
+    memory in bytes of each step: read, merge (with a distinct jobfile of the
+    same size) and write, and the total of asmlAscii.memoryReport.
+    """
+    from asmlascii import asmlAscii
+
+    def read(filename):
+        jobfile = asmlAscii()
+        jobfile.readAsciiJobfile(filename)
+        return jobfile
+
+    results = []
+    print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format('placements','read MB','merge MB','write MB','report MB'))
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for size in sizes:
+            filename = os.path.join(tmpdir,'synthetic.txt')
+            syntheticJobfile(size).writeAsciiJobfile(filename)
+            other = syntheticJobfile(size,offset=size)
+
+            jobfile, readpeak = _tracePeak(read,filename)
+            merged, mergepeak = _tracePeak(asmlAscii.merge,jobfile,other)
+            del merged
+            dummy, writepeak = _tracePeak(jobfile.writeAsciiJobfile,filename)
+
+            result = {'placements':size, 'read':readpeak, 'merge':mergepeak, 'write':writepeak,
+                      'report':jobfile.memoryReport()['total']}
+            results.append(result)
+            print('{:>10d} {:10.2f} {:10.2f} {:10.2f} {:10.2f}'.format(size,*[result[step]/2**20 for step in ('read','merge','write','report')]))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return results
+
+
+def main(argv=None):
+    """ Parses command-line arguments and runs the requested benchmark
+
+    Returns the exit status: 0 if within budget, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(description='Performance budget benchmarks for the asmlAscii core')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser('import',help='time module imports in fresh interpreters')
+    subparser.add_argument('--repeat',type=int,default=5,help='number of runs per module (default: 5)')
+    subparser.add_argument('--budget',type=float,default=IMPORTBUDGET,help='seconds allowed per import')
+    subparser.add_argument('modules',nargs='*',default=COREMODULES,help='modules to import (default: core modules)')
+
+    subparser = subparsers.add_parser('memory',help='record peak memory of reading, merging and writing jobfiles')
+    subparser.add_argument('sizes',nargs='*',type=int,default=MEMORYSIZES,help='placements in the synthetic jobfiles')
+
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'import':
+        passed = benchImport(args.modules,args.repeat,args.budget)
+    elif args.benchmark == 'memory':
+        benchMemory(args.sizes)
+        passed = True
+
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
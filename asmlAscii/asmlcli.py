@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+"""
+Command-line entry point for batch processing of ASCII jobfiles.
+
+Usage:
+    python asmlcli.py validate  [--workers N] FILE [FILE ...]
+    python asmlcli.py summary   [--workers N] FILE [FILE ...]
+    python asmlcli.py merge     [--workers N] OUTPUT FILE [FILE ...]
+    python asmlcli.py diff      [--workers N] REFERENCE FILE [FILE ...]
+    python asmlcli.py normalize [--workers N] [--outdir DIR] [--decimals D] FILE [FILE ...]
+
+Files are processed concurrently in a pool of worker processes, and results are
+printed as each file finishes, together with the time spent on that file.
+"""
+
+from __future__ import print_function, absolute_import, division
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from asmlascii import asmlAscii, delimBugTransform, idNormalizeTransform, floatPrecisionTransform
+
+
+def _readJobfile(filename):
+    """ Loads and parses an ASCII jobfile """
+    jobfile = asmlAscii()
+    jobfile.readAsciiJobfile(filename)
+    return jobfile
+
+def validateFile(filename):
+    """ Validates a jobfile, returning the list of violations """
+    return _readJobfile(filename).validate()
+
+def summarizeFile(filename):
+    """ Returns the summary dictionary of a jobfile """
+    return _readJobfile(filename).getSummary()
+
+def diffFile(filename,referencefilename):
+    """ Compares a jobfile to a reference jobfile
+
+    Returns a dictionary of added, removed and changed section descriptions,
+    which, unlike the sections themselves, are cheap to send between processes.
+    """
+    result = _readJobfile(referencefilename).diff(_readJobfile(filename))
+    changes = []
+    for section, othersection, differences in result['changed']:
+        changes.append('{} {}: {}'.format(section.sectionname,list(section.getIdKey()),', '.join(differences)))
+
+    return {'added':['{} {}'.format(s.sectionname,list(s.getIdKey())) for s in result['added']],
+            'removed':['{} {}'.format(s.sectionname,list(s.getIdKey())) for s in result['removed']],
+            'changed':changes}
+
+def normalizeFile(filename,outfilename,decimals=None):
+    """ Rewrites a jobfile with the delimiter fix and identifier normalization
+
+    Optionally rounds float values to a number of decimals.
+    """
+    transforms = [delimBugTransform, idNormalizeTransform]
+    if decimals is not None:
+        transforms.append(floatPrecisionTransform(decimals))
+    _readJobfile(filename).writeAsciiJobfile(outfilename,transforms=transforms)
+    return outfilename
+
+def _timed(function,*args):
+    """ Calls a function in a worker process, returning its result and elapsed time """
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+def runPool(function,argslist,workers=None):
+    """ Runs a function over a list of argument tuples in a process pool
+
+    Yields (args, result, elapsed, error) tuples in order of completion, so that
+    results can be reported as they stream in. Exceptions raised for one file are
+    returned as its error rather than stopping the batch.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for args in argslist:
+            futures[pool.submit(_timed,function,*args)] = args
+        for future in as_completed(futures):
+            try:
+                result, elapsed = future.result()
+                yield futures[future], result, elapsed, None
+            except Exception as error:
+                yield futures[future], None, 0.0, error
+
+
+def main(argv=None):
+    """ Parses command-line arguments and runs the requested subcommand
+
+    Returns the exit status: 0 on success, 1 if any file failed or had violations
+    (or differences, for diff).
+    """
+    parser = argparse.ArgumentParser(description='Batch processing of ASCII jobfiles')
+    parser.add_argument('--workers',type=int,default=None,help='number of worker processes (default: number of CPUs)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    subparser = subparsers.add_parser('validate',help='report every violation in each jobfile')
+    subparser.add_argument('files',nargs='+')
+    subparser = subparsers.add_parser('summary',help='print summary statistics of each jobfile')
+    subparser.add_argument('files',nargs='+')
+    subparser = subparsers.add_parser('merge',help='merge jobfiles, earlier files taking precedence')
+    subparser.add_argument('output')
+    subparser.add_argument('files',nargs='+')
+    subparser = subparsers.add_parser('diff',help='compare jobfiles to a reference jobfile')
+    subparser.add_argument('reference')
+    subparser.add_argument('files',nargs='+')
+    subparser = subparsers.add_parser('normalize',help='rewrite jobfiles with normalized identifiers')
+    subparser.add_argument('--outdir',default=None,help='output directory (default: rewrite in place)')
+    subparser.add_argument('--decimals',type=int,default=None,help='round float values to this many decimals')
+    subparser.add_argument('files',nargs='+')
+
+    args = parser.parse_args(argv)
+    status = 0
+    batchstart = time.time()
+
+    if args.command == 'validate':
+        for (filename,), violations, elapsed, error in runPool(validateFile,[(f,) for f in args.files],args.workers):
+            if error is not None:
+                print('{}: ERROR {} ({:.3f} s)'.format(filename,error,elapsed))
+                status = 1
+                continue
+            print('{}: {:d} violation(s) ({:.3f} s)'.format(filename,len(violations),elapsed))
+            for violation in violations:
+                location = violation['section'] if violation['index'] is None else '{}[{:d}]'.format(violation['section'],violation['index'])
+                if violation['element'] is not None:
+                    location += '.' + violation['element']
+                if violation.get('line') is not None:
+                    location += ' (line {:d})'.format(violation['line'])
+                print('    {}: {}'.format(location,violation['message']))
+            if violations:
+                status = 1
+
+    elif args.command == 'summary':
+        for (filename,), summary, elapsed, error in runPool(summarizeFile,[(f,) for f in args.files],args.workers):
+            if error is not None:
+                print('{}: ERROR {} ({:.3f} s)'.format(filename,error,elapsed))
+                status = 1
+                continue
+            print('{}: ({:.3f} s)'.format(filename,elapsed))
+            for key in summary:
+                print('    {:<26}: {}'.format(key,summary[key] if not isinstance(summary[key],dict) else dict(summary[key])))
+
+    elif args.command == 'merge':
+        # Parse concurrently, then merge in the order given on the command line
+        jobfiles = {}
+        for (filename,), jobfile, elapsed, error in runPool(_readJobfile,[(f,) for f in args.files],args.workers):
+            if error is not None:
+                print('{}: ERROR {} ({:.3f} s)'.format(filename,error,elapsed))
+                status = 1
+                continue
+            print('{}: read ({:.3f} s)'.format(filename,elapsed))
+            jobfiles[filename] = jobfile
+        if status == 0:
+            mergedjob = asmlAscii()
+            for filename in args.files:
+                mergedjob = asmlAscii.merge(mergedjob,jobfiles[filename])
+            mergedjob.writeAsciiJobfile(args.output)
+            print('{}: written'.format(args.output))
+
+    elif args.command == 'diff':
+        argslist = [(f,args.reference) for f in args.files]
+        for (filename,referencefilename), result, elapsed, error in runPool(diffFile,argslist,args.workers):
+            if error is not None:
+                print('{}: ERROR {} ({:.3f} s)'.format(filename,error,elapsed))
+                status = 1
+                continue
+            print('{}: {:d} added, {:d} removed, {:d} changed ({:.3f} s)'.format(
+                filename,len(result['added']),len(result['removed']),len(result['changed']),elapsed))
+            for key, sign in [('added','+'),('removed','-'),('changed','~')]:
+                for line in result[key]:
+                    print('    {} {}'.format(sign,line))
+            if result['added'] or result['removed'] or result['changed']:
+                status = 1
+
+    elif args.command == 'normalize':
+        argslist = []
+        for filename in args.files:
+            outfilename = filename if args.outdir is None else os.path.join(args.outdir,os.path.basename(filename))
+            argslist.append((filename,outfilename,args.decimals))
+        for (filename,outfilename,decimals), result, elapsed, error in runPool(normalizeFile,argslist,args.workers):
+            if error is not None:
+                print('{}: ERROR {} ({:.3f} s)'.format(filename,error,elapsed))
+                status = 1
+                continue
+            print('{}: written to {} ({:.3f} s)'.format(filename,outfilename,elapsed))
+
+    print('{:d} file(s) in {:.3f} s'.format(len(args.files),time.time() - batchstart))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+
+"""
+Byte-offset index of the sections in an ASCII jobfile.
+
+Memory-maps the jobfile and records where each START_SECTION/END_SECTION
+block begins and ends, together with the section type and the values of
+its id elements, so that individual sections can be materialized without
+reading or parsing the rest of the file.
+"""
+
+from __future__ import print_function, absolute_import, division
+import json
+import mmap
+import os
+import re
+from asmljobsdef import ASMLJOBSECTIONS
+from asmlascii import asmlElement, asmlSection, ASMLOUTPUTTRANSFORMS
+
+ASMLINDEXSUFFIX = '.idx'    # Appended to the jobfile name for the persisted index
+
+# Matches a section block, capturing the section name and body
+SECTIONPATTERN = re.compile(br'^START_SECTION (\S+)\r?\n(.*?)\r?\nEND_SECTION',re.MULTILINE | re.DOTALL)
+
+
+class asmlIndex(object):
+    """ Index of section byte offsets in an ASCII jobfile
+
+    Each entry of the index is a dictionary with keys:
+
+    sectionname : name of section
+    start       : byte offset of START_SECTION
+    end         : byte offset just past END_SECTION
+    id_values   : dictionary of id element values, as returned by asmlSection.get
+
+    Class methods provide functionality to scan a jobfile, to persist the index
+    next to the jobfile, to look up sections by id elements, and to read
+    individual sections on demand.
+    """
+    def __init__(self,filename,persist=False,rebuild=False):
+        """ Loads or builds the index for a jobfile
+
+        If a persisted index exists next to the file and matches the file size
+        and modification time, it is loaded instead of rescanning the file.
+        If persist is True, a freshly scanned index is saved next to the file.
+        """
+        self.filename = filename
+        self.indexfilename = filename + ASMLINDEXSUFFIX
+        self.entries = []
+
+        if rebuild or not self.load():
+            self.scan()
+            if persist:
+                self.save()
+
+    def _stamp(self):
+        """ Returns the size and modification time used to detect a stale index """
+        stat = os.stat(self.filename)
+        return [stat.st_size, stat.st_mtime]
+
+    def scan(self):
+        """ Scans the memory-mapped jobfile for section blocks
+
+        Only the id element lines of each section are parsed.
+        """
+        self.entries = []
+        self.stamp = self._stamp()
+        if self.stamp[0] == 0:
+            return      # mmap cannot map an empty file
+
+        with open(self.filename,'rb') as f:
+            mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            try:
+                for m in SECTIONPATTERN.finditer(mm):
+                    sectionname = m.group(1).decode('ascii')
+                    if sectionname not in ASMLJOBSECTIONS:
+                        raise ValueError('Section {} not found in ASMLJOBSECTIONS'.format(sectionname))
+                    self.entries.append({'sectionname':sectionname, 'start':m.start(), 'end':m.end(),
+                                         'id_values':_readIdValues(sectionname,m.group(2))})
+            finally:
+                mm.close()
+
+    def load(self):
+        """ Loads the persisted index if it exists and is up to date
+
+        Returns boolean indicating whether the index was loaded.
+        """
+        if not os.path.exists(self.indexfilename):
+            return False
+
+        with open(self.indexfilename,'r') as f:
+            indexdict = json.load(f)
+
+        if indexdict['stamp'] != self._stamp():
+            return False    # Jobfile changed since the index was saved
+
+        self.stamp = indexdict['stamp']
+        self.entries = indexdict['entries']
+        return True
+
+    def save(self):
+        """ Saves the index next to the jobfile """
+        with open(self.indexfilename,'w') as f:
+            json.dump({'stamp':self.stamp, 'entries':self.entries},f)
+
+    def get(self,sectionname,**id_element_values):
+        """ Get index entries
+
+        Identifies sections by name and optional specification of ID elements,
+        in the same way as asmlAscii.get. Returns a list of matching entries.
+        """
+        for id_element_name in id_element_values:
+            if id_element_name not in ASMLJOBSECTIONS[sectionname]['id_elements']:
+                raise ValueError('{} not a valid id element for {} section'.format(id_element_name,sectionname))
+
+        matchentries = []
+        for entry in self.entries:
+            if entry['sectionname'] != sectionname:
+                continue
+            for id_element_name in id_element_values:
+                value = id_element_values[id_element_name]
+                if not isinstance(value,list):
+                    value = [value]
+                if entry['id_values'][id_element_name] != value:
+                    break
+            else:
+                matchentries.append(entry)
+
+        return matchentries
+
+    def readEntry(self,entry):
+        """ Reads and parses the section for a single index entry
+
+        Only the bytes of that section are read from the file.
+        """
+        with open(self.filename,'rb') as f:
+            f.seek(entry['start'])
+            asciibytes = f.read(entry['end'] - entry['start'])
+
+        m = SECTIONPATTERN.match(asciibytes)
+        section = asmlSection(entry['sectionname'])
+        section.readAscii(m.group(2).decode('utf-8').replace('\r\n','\n'))
+
+        return section
+
+    def readSections(self,sectionname,**id_element_values):
+        """ Reads and parses the sections matching a name and ID elements """
+        return [self.readEntry(entry) for entry in self.get(sectionname,**id_element_values)]
+
+    def patch(self,append=(),replace=(),remove=(),outfilename=None):
+        """ Applies section changes to the jobfile without parsing it
+
+        append  : list of new section objects, inserted after the last existing
+                  section of the same type (or of the closest preceding type)
+        replace : list of section objects, each replacing the first not yet replaced
+                  section with the same name and id element values, either as
+                  stored in the section or as written with the output transforms
+        remove  : list of (sectionname, id_element_values) pairs, each removing all
+                  matching sections as in asmlAscii.remove
+
+        Only the affected sections are generated, with the same output transforms
+        as asmlAscii.writeAsciiJobfile; all other bytes, including the
+        blank lines between sections, are copied verbatim from the memory-mapped
+        file. The result is written to outfilename, or replaces the jobfile if no
+        output file is given, and the index is updated to describe the result.
+
+        If the jobfile changed since the index was built, it is rescanned first so
+        that the byte offsets are never taken from a stale index.
+        """
+        if self._stamp() != self.stamp:
+            self.scan()
+
+        # Locate the affected entries
+        removed = set()
+        for sectionname, id_element_values in remove:
+            for entry in self.get(sectionname,**id_element_values):
+                removed.add(id(entry))
+
+        entriesbykey = {}
+        for entry in self.entries:
+            entriesbykey.setdefault(_entryKey(entry),[]).append(entry)
+
+        replaced = {}
+        for section in replace:
+            keys = [(section.sectionname,section.getIdKey()), _entryKey(_renderedEntry(section))]
+            matches = [entry for key in keys for entry in entriesbykey.get(key,[]) if id(entry) not in replaced]
+            if not matches:
+                raise ValueError('No {} section with id {} to replace'.format(section.sectionname,section.getIdKey()))
+            replaced[id(matches[0])] = section
+
+        # Anchor each appended section after the last entry of its type, or of the
+        # closest preceding type in ASMLJOBSECTIONS order
+        sectionorder = list(ASMLJOBSECTIONS)
+        lastentry = {}
+        for n, entry in enumerate(self.entries):
+            lastentry[entry['sectionname']] = n
+        appended = {}
+        for section in append:
+            anchor = -1
+            for sectionname in reversed(sectionorder[:sectionorder.index(section.sectionname)+1]):
+                if sectionname in lastentry:
+                    anchor = lastentry[sectionname]
+                    break
+            appended.setdefault(anchor,[]).append(section)
+
+        if outfilename is None:
+            outfilename = self.filename
+        tempfilename = outfilename + '.tmp'
+
+        with open(self.filename,'rb') as f:
+            mm = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ) if self.stamp[0] > 0 else b''
+            try:
+                with open(tempfilename,'wb') as out:
+                    writer = _patchWriter(mm,out)
+
+                    # Text before the first section
+                    writer.copy(0,self.entries[0]['start'] if self.entries else len(mm))
+                    for section in appended.get(-1,[]):
+                        if writer.emitted:
+                            writer.text('\n\n')
+                        writer.block(section)
+
+                    for n, entry in enumerate(self.entries):
+                        if id(entry) not in removed:
+                            if writer.emitted:
+                                # Keep the original separator, or use a blank line
+                                # if only appended sections precede this one
+                                if n > 0:
+                                    writer.copy(self.entries[n-1]['end'],entry['start'])
+                                else:
+                                    writer.text('\n\n')
+                            if id(entry) in replaced:
+                                writer.block(replaced[id(entry)])
+                            else:
+                                writer.original(entry)
+                        for section in appended.get(n,[]):
+                            if writer.emitted:
+                                writer.text('\n\n')
+                            writer.block(section)
+
+                    # Text after the last section
+                    writer.copy(self.entries[-1]['end'] if self.entries else len(mm),len(mm))
+                    writer.flush()
+            finally:
+                if not isinstance(mm,bytes):
+                    mm.close()
+
+        os.replace(tempfilename,outfilename)
+
+        self.filename = outfilename
+        self.indexfilename = outfilename + ASMLINDEXSUFFIX
+        self.entries = writer.entries
+        self.stamp = self._stamp()
+        if os.path.exists(self.indexfilename):
+            self.save()
+
+
+
+class _patchWriter(object):
+    """ Writes a patched jobfile, coalescing runs of original bytes into single copies """
+    def __init__(self,mm,out):
+        self.mm = mm
+        self.out = out
+        self.position = 0       # Position in the output file
+        self.runstart = None    # Pending run of original bytes
+        self.runend = None
+        self.emitted = False    # Whether any section has been written
+        self.entries = []
+
+    def copy(self,start,end):
+        """ Copies a range of the original file """
+        if end <= start:
+            return
+        if self.runend != start:
+            self.flush()
+            self.runstart = start
+        self.runend = end
+        self.position += end - start
+
+    def flush(self):
+        """ Writes the pending run of original bytes """
+        if self.runstart is not None:
+            self.out.write(self.mm[self.runstart:self.runend])
+        self.runstart = self.runend = None
+
+    def text(self,asciistring):
+        """ Writes new text """
+        self.flush()
+        asciibytes = asciistring.encode('utf-8')
+        self.out.write(asciibytes)
+        self.position += len(asciibytes)
+
+    def original(self,entry):
+        """ Copies an unchanged section """
+        start = self.position
+        self.copy(entry['start'],entry['end'])
+        self.entries.append({'sectionname':entry['sectionname'], 'start':start, 'end':self.position,
+                             'id_values':entry['id_values']})
+        self.emitted = True
+
+    def block(self,section):
+        """ Writes a new or replacement section, without a preceding separator """
+        start = self.position
+        entry = _renderedEntry(section)
+        self.text(section.makeAscii(ASMLOUTPUTTRANSFORMS))
+        entry['start'], entry['end'] = start, self.position
+        self.entries.append(entry)
+        self.emitted = True
+
+
+
+def _entryKey(entry):
+    """ Gets a hashable key of the section name and id element values of an entry,
+    matching asmlSection.getIdKey """
+    key = []
+    for id_element_name in ASMLJOBSECTIONS[entry['sectionname']]['id_elements']:
+        value = entry['id_values'][id_element_name]
+        key.append(None if value is None else tuple(value))
+
+    return (entry['sectionname'], tuple(key))
+
+
+def _renderedEntry(section):
+    """ Makes an index entry for a section as written with the output transforms,
+    reading the id element values from the generated text as scan does """
+    asciibytes = section.makeAscii(ASMLOUTPUTTRANSFORMS).encode('utf-8')
+    return {'sectionname':section.sectionname, 'id_values':_readIdValues(section.sectionname,asciibytes)}
+
+
+def _readIdValues(sectionname,sectionbody):
+    """ Parses only the id element lines from the bytes of a section body """
+    id_values = {}
+    for id_element_name in ASMLJOBSECTIONS[sectionname]['id_elements']:
+        elementdict = ASMLJOBSECTIONS[sectionname]['elements'][id_element_name]
+        m = re.search(br'^   ' + id_element_name.encode('ascii') + br' +(.*?)\r?$',sectionbody,re.MULTILINE)
+        if m is None:
+            id_values[id_element_name] = None
+            continue
+
+        element = asmlElement(name=id_element_name,count=elementdict['count'],element_type=elementdict['element_type'],
+                              is_optional=elementdict['is_optional'],default=None,validator=None)
+        element.readAscii(m.group(1).decode('utf-8'))
+        id_values[id_element_name] = element.get()
+
+    return id_values
@@ -13,12 +13,17 @@ from collections import OrderedDict
 ASMLELEMENTINDENT = 3       # Indentation of element lines in ASCII jobfile
 ASMLELEMENTALIGN = 49       # Alignment position of element values in ASCII jobfile
 
-# # Discovered limitations on ASML jobfiles
-# ASMLMAXIMAGECOUNT = 50
-# ASMLMAXLAYERCOUNT = 60
-# ASMLMAXRETICLEDATACOUNT = 80 # this one is not really clear
+# Discovered limitations on ASML jobfiles
+ASMLMAXIMAGECOUNT = 50
+ASMLMAXLAYERCOUNT = 60
+ASMLMAXRETICLEDATACOUNT = 80 # this one is not really clear
 # more...
 
+# Section counts limited by the above
+ASMLSECTIONLIMITS = OrderedDict([('IMAGE_DEFINITION',ASMLMAXIMAGECOUNT),
+                                 ('LAYER_DEFINITION',ASMLMAXLAYERCOUNT),
+                                 ('RETICLE_DATA',ASMLMAXRETICLEDATACOUNT)])
+
 """
 Section fields:
     is_optional         : Section is not required for a valid jobfile
@@ -189,7 +194,7 @@ ASMLJOBSECTIONS = OrderedDict([
             ('IMAGE_ID',{'count':1,'element_type':'string','is_optional':False,
                 'default':None,'validator':None }),
             ('INSTANCE_ID',{'count':1,'element_type':'string','is_optional':False,  # Was optional
-                'default':'<Default>','validator':None, 'fix_delim_bug':True }),
+                'default':['<Default>',],'validator':None, 'fix_delim_bug':True }),
             ('CELL_SELECTION',{'count':2,'element_type':'string','is_optional':False,
                 'default':None,'validator':None }),
             ('DISTRIBUTION_ACTION',{'count':1,'element_type':'string','is_optional':False,
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+"""
+Exposure planning for ASML jobfiles.
+
+Route optimization reorders the IMAGE_DISTRIBUTION sections of a jobfile to
+reduce stage travel and image switching within each layer. Placements are
+located at CELL_SIZE * CELL_SELECTION + IMAGE_CELL_SHIFT on the wafer.
+
+Exposure order planning sets IMAGE_EXPOSURE_ORDER in RETICLE_DATA to reduce
+the number of reticle exchanges within and between layers.
+"""
+
+from __future__ import print_function, absolute_import, division
+from collections import OrderedDict
+import numpy as np
+from asmlascii import firstValue
+
+
+def placementPositions(jobfile,sections=None):
+    """ Gets the wafer positions of IMAGE_DISTRIBUTION sections
+
+    Returns an (n,2) array of positions of the given sections, or of all
+    IMAGE_DISTRIBUTION sections of the jobfile.
+    """
+    if not jobfile.sections['GENERAL'] or jobfile.sections['GENERAL'][0].get('CELL_SIZE') is None:
+        raise ValueError('Jobfile has no CELL_SIZE to locate placements')
+    cellsize = np.array(jobfile.sections['GENERAL'][0].get('CELL_SIZE'),dtype=float)
+
+    if sections is None:
+        sections = jobfile.sections['IMAGE_DISTRIBUTION']
+    positions = np.empty((len(sections),2))
+    for n, section in enumerate(sections):
+        positions[n] = cellsize*np.array(section.get('CELL_SELECTION'),dtype=float) + section.get('IMAGE_CELL_SHIFT')
+
+    return positions
+
+def routeLength(positions):
+    """ Total stage travel along a sequence of positions """
+    if len(positions) < 2:
+        return 0.0
+    return float(np.sum(np.hypot(*np.diff(positions,axis=0).T)))
+
+def layerImages(jobfile):
+    """ Gets the images exposed in each layer, according to RETICLE_DATA
+
+    Returns an OrderedDict of layer ID to set of image IDs, with layers in
+    order of LAYER_NO.
+    """
+    layers = OrderedDict()
+    for section in sorted(jobfile.sections['LAYER_DEFINITION'],key=lambda section: firstValue(section,'LAYER_NO')):
+        layers[firstValue(section,'LAYER_ID')] = set()
+    for section in jobfile.sections['RETICLE_DATA']:
+        layers.setdefault(firstValue(section,'LAYER_ID'),set()).add(firstValue(section,'IMAGE_ID'))
+
+    return layers
+
+def routeMetrics(jobfile):
+    """ Measures the exposure route of each layer
+
+    The route of a layer visits, in IMAGE_DISTRIBUTION order, the placements of
+    the images exposed in that layer.
+
+    Returns an OrderedDict of layer ID to a dictionary with:
+        placements : number of placements exposed
+        distance   : total stage travel between consecutive placements
+        switches   : number of changes of image between consecutive placements
+    """
+    sections = jobfile.sections['IMAGE_DISTRIBUTION']
+    positions = placementPositions(jobfile)
+    images = [firstValue(section,'IMAGE_ID') for section in sections]
+
+    metrics = OrderedDict()
+    for layer_id, layerimages in layerImages(jobfile).items():
+        indices = [n for n in range(len(sections)) if images[n] in layerimages]
+        metrics[layer_id] = {'placements':len(indices),
+                             'distance':routeLength(positions[indices]),
+                             'switches':sum(images[indices[n]] != images[indices[n+1]] for n in range(len(indices)-1))}
+
+    return metrics
+
+def _nearestNeighbour(positions,start):
+    """ Orders positions by repeatedly visiting the nearest unvisited one """
+    n = len(positions)
+    visited = np.zeros(n,dtype=bool)
+    order = np.empty(n,dtype=int)
+    current = start
+    for k in range(n):
+        order[k] = current
+        visited[current] = True
+        if k == n - 1:
+            break
+        distances = np.hypot(*(positions - positions[current]).T)
+        distances[visited] = np.inf
+        current = int(np.argmin(distances))
+
+    return order
+
+def _twoOpt(positions,order,window,passes):
+    """ Improves an open route by reversing segments of at most window placements
+
+    Each candidate move is evaluated for all segment ends within the window at
+    once, so a pass costs O(n*window) vectorized operations. The route positions
+    and the lengths of its edges are kept up to date as segments are reversed.
+    """
+    n = len(order)
+    route = positions[order]
+    edges = np.zeros(n)     # edges[m] joins route[m] and route[m+1]; the last placement has none
+    edges[:-1] = np.hypot(*np.diff(route,axis=0).T)
+    for p in range(passes):
+        improved = False
+        for i in range(n - 2):
+            # Reversing order[i+1:j+1] replaces edges (i,i+1) and (j,j+1) by (i,j) and (i+1,j+1)
+            j = np.arange(i + 2,min(i + 1 + window,n))
+            inner = j < n - 1
+            removed = edges[i] + edges[j]
+            added = np.hypot(*(route[j] - route[i]).T) + inner*np.hypot(*(route[np.minimum(j + 1,n - 1)] - route[i+1]).T)
+            gain = removed - added
+            if len(gain) and gain.max() > 1e-9:
+                k = int(j[np.argmax(gain)])
+                order[i+1:k+1] = order[i+1:k+1][::-1]
+                route[i+1:k+1] = route[i+1:k+1][::-1]
+                edges[i+1:k] = edges[i+1:k][::-1]
+                edges[i] = np.hypot(*(route[i+1] - route[i]))
+                if k < n - 1:
+                    edges[k] = np.hypot(*(route[k+1] - route[k]))
+                improved = True
+        if not improved:
+            break
+
+    return order
+
+def optimizeRoute(jobfile,window=50,passes=3):
+    """ Reorders IMAGE_DISTRIBUTION sections to shorten the exposure route
+
+    The placements of each image are kept together, so each layer switches
+    image only once per image. Images are chained greedily: the next image is
+    the one with a placement closest to where the previous image ended, and its
+    route starts there. Within each image, placements are ordered by nearest
+    neighbour and then improved with 2-opt moves limited to segments of window
+    placements, repeated for up to the given number of passes.
+
+    The sections are reordered in place; the OPTIMIZE_ROUTE element is left as
+    it is. Returns the route metrics of each layer (see routeMetrics) before and
+    after optimization.
+    """
+    before = routeMetrics(jobfile)
+
+    sections = jobfile.sections['IMAGE_DISTRIBUTION']
+    if len(sections) < 2:
+        return before, before
+    positions = placementPositions(jobfile)
+
+    groups = OrderedDict()
+    for n, section in enumerate(sections):
+        groups.setdefault(firstValue(section,'IMAGE_ID'),[]).append(n)
+    groups = OrderedDict((image_id,np.array(indices)) for image_id, indices in groups.items())
+
+    neworder = []
+    current = positions[0]
+    while groups:
+        # Next image: the one with a placement closest to the current position
+        best = None
+        for image_id, indices in groups.items():
+            distances = np.hypot(*(positions[indices] - current).T)
+            k = int(np.argmin(distances))
+            if best is None or distances[k] < bestdistance:
+                best, bestdistance, start = image_id, distances[k], k
+        indices = groups.pop(best)
+
+        order = _nearestNeighbour(positions[indices],start)
+        order = _twoOpt(positions[indices],order,window,passes)
+        neworder.extend(indices[order])
+        current = positions[neworder[-1]]
+
+    jobfile.sections['IMAGE_DISTRIBUTION'] = [sections[n] for n in neworder]
+
+    return before, routeMetrics(jobfile)
+
+
+
+def _reticleId(section,imagereticles):
+    """ Gets the reticle of a RETICLE_DATA section, falling back to its IMAGE_DEFINITION """
+    reticle_id = firstValue(section,'RETICLE_ID')
+    if reticle_id is None:
+        reticle_id = imagereticles.get(firstValue(section,'IMAGE_ID'))
+    return reticle_id
+
+def reticleSequence(jobfile):
+    """ Gets the sequence of exposures in each layer
+
+    Images of a layer are exposed in order of IMAGE_EXPOSURE_ORDER, images
+    without one coming last, in jobfile order.
+
+    Returns an OrderedDict of layer ID to list of RETICLE_DATA sections, with
+    layers in order of LAYER_NO.
+    """
+    sequence = OrderedDict((layer_id,[]) for layer_id in layerImages(jobfile))
+    for section in jobfile.sections['RETICLE_DATA']:
+        sequence[firstValue(section,'LAYER_ID')].append(section)
+
+    for layer_id in sequence:
+        orders = [firstValue(section,'IMAGE_EXPOSURE_ORDER') for section in sequence[layer_id]]
+        keys = [(order is None, order, n) for n, order in enumerate(orders)]
+        sequence[layer_id] = [sequence[layer_id][n] for n in sorted(range(len(keys)),key=keys.__getitem__)]
+
+    return sequence
+
+def reticleSwaps(jobfile):
+    """ Counts the reticle exchanges in each layer
+
+    An exchange is counted whenever an exposure uses a different reticle than
+    the one before, including the first exposure of a layer if the previous
+    layer ended on a different reticle. The first reticle load of the job is
+    not counted.
+
+    Returns an OrderedDict of layer ID to number of exchanges.
+    """
+    imagereticles = dict((firstValue(section,'IMAGE_ID'),firstValue(section,'RETICLE_ID'))
+                         for section in jobfile.sections['IMAGE_DEFINITION'])
+
+    swaps = OrderedDict()
+    current = None
+    for layer_id, sections in reticleSequence(jobfile).items():
+        swaps[layer_id] = 0
+        for section in sections:
+            reticle_id = _reticleId(section,imagereticles)
+            if current is not None and reticle_id != current:
+                swaps[layer_id] += 1
+            current = reticle_id
+
+    return swaps
+
+def planExposureOrder(jobfile):
+    """ Sets IMAGE_EXPOSURE_ORDER to minimize reticle exchanges
+
+    Within each layer, the images on the same reticle are exposed together, so a
+    layer exchanges reticles at most once per reticle it uses. Layers are chained
+    in order of LAYER_NO: a layer starts with the reticle the previous layer
+    ended on, if it uses it, and ends on a reticle that the next layer uses, so
+    that the exchange between layers is avoided where possible. Images on the
+    same reticle keep their previous relative order.
+
+    Exposure orders are numbered from 1 in each layer. Returns the reticle
+    exchanges of each layer (see reticleSwaps) before and after planning.
+    """
+    before = reticleSwaps(jobfile)
+
+    imagereticles = dict((firstValue(section,'IMAGE_ID'),firstValue(section,'RETICLE_ID'))
+                         for section in jobfile.sections['IMAGE_DEFINITION'])
+    sequence = reticleSequence(jobfile)
+    layer_ids = list(sequence)
+
+    # Sections of each layer grouped by reticle, in order of first use
+    groups = []
+    for layer_id in layer_ids:
+        plates = OrderedDict()
+        for section in sequence[layer_id]:
+            plates.setdefault(_reticleId(section,imagereticles),[]).append(section)
+        groups.append(plates)
+
+    current = None
+    for k, plates in enumerate(groups):
+        order = list(plates)
+        if current in plates:
+            order.remove(current)
+            order.insert(0,current)
+        if k + 1 < len(groups) and len(order) > 1:
+            for reticle_id in order[1:]:
+                if reticle_id in groups[k+1]:
+                    order.remove(reticle_id)
+                    order.append(reticle_id)
+                    break
+
+        n = 1
+        for reticle_id in order:
+            for section in plates[reticle_id]:
+                section.set('IMAGE_EXPOSURE_ORDER',n)
+                n += 1
+        if order:
+            current = order[-1]
+
+    return before, reticleSwaps(jobfile)
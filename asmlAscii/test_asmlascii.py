@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for asmlascii.
+"""
+
+from __future__ import print_function, absolute_import, division
+import copy
+import pickle
+from asmlascii import asmlAscii, asmlSection, makeColumnSections
+
+
+def _distributionJobfile(n=3):
+    """ Makes a jobfile with n IMAGE_DISTRIBUTION sections in cells (k,0) """
+    jobfile = asmlAscii()
+    jobfile.extendColumns('IMAGE_DISTRIBUTION',IMAGE_ID='IMAGE',INSTANCE_ID='001',DISTRIBUTION_ACTION='I',
+                          CELL_SELECTION=[[str(k),'0'] for k in range(n)],IMAGE_CELL_SHIFT=[0.0,0.0])
+    return jobfile
+
+
+def test_validate_reports_values_rejected_while_reading():
+    asciistring = _distributionJobfile().makeAscii()
+    lines = asciistring.split('\n')
+    # Corrupt the DISTRIBUTION_ACTION of the second section
+    index = [n for n, line in enumerate(lines) if 'DISTRIBUTION_ACTION' in line][1]
+    lines[index] = lines[index].replace('"I"','"X"')
+
+    jobfile = asmlAscii()
+    jobfile.readAscii('\n'.join(lines))
+    violations = [v for v in jobfile.validate() if v['element'] == 'DISTRIBUTION_ACTION']
+
+    assert len(violations) == 1
+    assert violations[0]['index'] == 1
+    assert violations[0]['value'] == ['X']
+    assert violations[0]['line'] == index + 1
+
+    # Setting the element again clears the rejection
+    jobfile.sections['IMAGE_DISTRIBUTION'][1].set('DISTRIBUTION_ACTION','S')
+    assert not [v for v in jobfile.validate() if v['element'] == 'DISTRIBUTION_ACTION']
+
+def test_validate_reports_rejections_in_raw_sections():
+    asciistring = _distributionJobfile().makeAscii().replace('"I"','"X"',1)
+
+    jobfile = asmlAscii()
+    jobfile.readAscii(asciistring,sections=[])
+    violations = [v for v in jobfile.validate() if v['element'] == 'DISTRIBUTION_ACTION']
+
+    assert [v['index'] for v in violations] == [0]
+    assert asciistring.split('\n')[violations[0]['line'] - 1].strip().startswith('DISTRIBUTION_ACTION')
+
+def test_raw_sections_are_matched_without_parsing():
+    asciistring = _distributionJobfile(3).makeAscii()
+    jobfile = asmlAscii()
+    jobfile.readAscii(asciistring,sections=[])
+    other = asmlAscii()
+    other.readAscii(asciistring.replace('"2" "0"','"5" "0"'),sections=[])
+
+    result = jobfile.diff(other)
+    assert [s.get('CELL_SELECTION') for s in result['added']] == [['5','0']]
+    assert [s.get('CELL_SELECTION') for s in result['removed']] == [['2','0']]
+    assert not result['changed']
+
+    merged = asmlAscii.merge(jobfile,other)
+    assert ([s.get('CELL_SELECTION') for s in merged.sections['IMAGE_DISTRIBUTION']]
+            == [['0','0'],['1','0'],['2','0'],['5','0']])
+    assert all(s._elements is None for s in jobfile.sections['IMAGE_DISTRIBUTION'] + other.sections['IMAGE_DISTRIBUTION'])
+
+def test_validate_rejects_bool_for_int():
+    jobfile = asmlAscii()
+    section = asmlSection('LAYER_DEFINITION')
+    section.elements['LAYER_NO'].value = [True]
+    jobfile.append(section)
+
+    assert [v for v in jobfile.validate() if v['element'] == 'LAYER_NO']
+
+def test_column_sections_are_counted_by_the_jobfile_they_join():
+    sections = makeColumnSections('INSTANCE_DEFINITION',INSTANCE_ID=['002','003'])
+    jobfile = asmlAscii()
+    jobfile.extend(sections)
+    assert jobfile.getSummary()['instances'] == 2
+
+def test_records_round_trip():
+    jobfile = _distributionJobfile()
+    jobfile.sections['IMAGE_DISTRIBUTION'][1].set('IMAGE_CELL_SHIFT',[1.5,-2.25])
+    jobfile.sections['IMAGE_DISTRIBUTION'][2].elements['OPTIMIZE_ROUTE'].value = None
+    jobfile.extendColumns('LAYER_DEFINITION',LAYER_NO=[1,2],LAYER_ID=['BEV',None])
+
+    for sectionname in ['IMAGE_DISTRIBUTION','LAYER_DEFINITION']:
+        newjobfile = asmlAscii()
+        newjobfile.fromRecords(sectionname,jobfile.toRecords(sectionname))
+        assert [s.makeAscii() for s in newjobfile.sections[sectionname]] == [s.makeAscii() for s in jobfile.sections[sectionname]]
+
+def _recountedSummary(jobfile):
+    """ Summary of a jobfile read back from its text, counted from scratch """
+    newjobfile = asmlAscii()
+    newjobfile.readAscii(jobfile.makeAscii(),sections=['IMAGE_DISTRIBUTION'])
+    return newjobfile.getSummary()
+
+def test_summary_is_updated_incrementally():
+    jobfile = _distributionJobfile(3)
+    jobfile.extendColumns('RETICLE_DATA',IMAGE_ID='IMAGE',LAYER_ID='L1',RETICLE_ID='RETICLE',
+                          GLOBAL_LEVEL_POINT_1=[0.0,0.0],GLOBAL_LEVEL_POINT_2=[0.0,0.0],GLOBAL_LEVEL_POINT_3=[0.0,0.0])
+    assert jobfile.getSummary()['placements_per_layer'] == {'L1':3}
+    assert jobfile.getSummary()['max_placements_per_image'] == 3
+
+    # Section set and readAscii
+    sections = jobfile.sections['IMAGE_DISTRIBUTION']
+    sections[0].set('IMAGE_ID','OTHER')
+    assert jobfile.getSummary()['placements_per_layer'] == {'L1':2}
+    assert jobfile.getSummary()['max_placements_per_image'] == 2
+    reticledata = jobfile.sections['RETICLE_DATA'][0]
+    reticledata.readAscii(reticledata.makeAscii().replace('"L1"','"L2"').split('\n',1)[1].rsplit('\n',1)[0])
+    assert jobfile.getSummary()['placements_per_layer'] == {'L2':2}
+    assert jobfile.getSummary() == _recountedSummary(jobfile)
+
+    # Remove and append
+    jobfile.remove('IMAGE_DISTRIBUTION',CELL_SELECTION=['1','0'])
+    assert jobfile.getSummary()['placements'] == 2
+    assert jobfile.getSummary()['max_placements_per_image'] == 1
+    jobfile.append(sections[0].copy())
+    assert jobfile.getSummary()['max_placements_per_image'] == 2
+    assert jobfile.getSummary() == _recountedSummary(jobfile)
+
+    # The summaries of all jobfiles containing a section follow its changes
+    other = asmlAscii()
+    other.append(sections[0])
+    copied = copy.deepcopy(jobfile)
+    sections[0].set('IMAGE_ID','IMAGE')
+    assert other.getSummary()['max_placements_per_image'] == 1
+    assert jobfile.getSummary() == _recountedSummary(jobfile)
+    assert copied.getSummary() == _recountedSummary(copied) != jobfile.getSummary()
+    assert pickle.loads(pickle.dumps(jobfile)).getSummary() == jobfile.getSummary()
+
+def test_get_returns_a_copy():
+    section = _distributionJobfile(1).sections['IMAGE_DISTRIBUTION'][0]
+    asciistring = section.makeAscii()
+    section.get('IMAGE_CELL_SHIFT')[0] = 5.0
+
+    assert section.get('IMAGE_CELL_SHIFT') == [0.0,0.0]
+    assert section.makeAscii() == asciistring
+
+def test_cached_text_follows_element_edits():
+    jobfile = _distributionJobfile(2)
+    section = jobfile.sections['IMAGE_DISTRIBUTION'][0]
+    section.makeAscii()
+    section.elements['IMAGE_ID'].set('B')
+    assert '"B"' in section.makeAscii()
+    section.elements['IMAGE_ID'].value = ['C']
+    assert '"C"' in section.makeAscii()
+    assert section.copy().makeAscii() == section.makeAscii()
+
+    # Raw sections are written as read until an element is changed, even if parsed
+    asciistring = jobfile.makeAscii().replace('0.000000 0.000000','0.0 0.0')
+    rawjobfile = asmlAscii()
+    rawjobfile.readAscii(asciistring,sections=[])
+    rawsection = rawjobfile.sections['IMAGE_DISTRIBUTION'][1]
+    assert rawsection.get('IMAGE_CELL_SHIFT') == [0.0,0.0]
+    assert rawjobfile.makeAscii() == asciistring
+    rawsection.elements['IMAGE_CELL_SHIFT'].set([1.0,2.0])
+    assert '1.000000 2.000000' in rawjobfile.makeAscii()
+
+def test_shard_exposes_every_placement_once():
+    # 60 images in cells (k,0), over the image limit, and a common FLOOD image in
+    # a cell of its own and in a cell shared with another image
+    jobfile = asmlAscii()
+    image_ids = ['IMAGE{:02d}'.format(k) for k in range(60)] + ['FLOOD']
+    jobfile.extendColumns('IMAGE_DEFINITION',IMAGE_ID=image_ids,RETICLE_ID='RETICLE')
+    jobfile.extendColumns('IMAGE_DISTRIBUTION',IMAGE_ID=image_ids[:60] + ['FLOOD','FLOOD'],INSTANCE_ID='001',
+                          DISTRIBUTION_ACTION='I',CELL_SELECTION=[[str(k),'0'] for k in range(60)] + [['99','0'],['3','0']],
+                          IMAGE_CELL_SHIFT=[0.0,0.0])
+
+    shards = jobfile.shard(common_images=['FLOOD'])
+    assert len(shards) == 2
+    assert all(not shard.checkLimits() for shard in shards)
+
+    placements = [section.getIdKey() for shard in shards for section in shard.sections['IMAGE_DISTRIBUTION']]
+    assert sorted(placements) == sorted(section.getIdKey() for section in jobfile.sections['IMAGE_DISTRIBUTION'])
+    assert all(len(shard.get('IMAGE_DEFINITION',IMAGE_ID=['FLOOD'])) == 1 for shard in shards)
+
+    # The FLOOD placement in cell (3,0) goes with the other image in that cell
+    shard = [shard for shard in shards if shard.get('IMAGE_DISTRIBUTION',IMAGE_ID=['IMAGE03'])][0]
+    assert shard.get('IMAGE_DISTRIBUTION',IMAGE_ID=['FLOOD'],CELL_SELECTION=['3','0'])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for asmlindex.
+"""
+
+from __future__ import print_function, absolute_import, division
+from asmlascii import asmlAscii
+from asmlindex import asmlIndex
+
+
+def _writeDistributionJobfile(filename,n=4):
+    """ Writes a jobfile with n IMAGE_DISTRIBUTION sections in cells (k,0) """
+    jobfile = asmlAscii()
+    jobfile.extendColumns('IMAGE_DISTRIBUTION',IMAGE_ID='IMAGE',INSTANCE_ID='001',DISTRIBUTION_ACTION='I',
+                          CELL_SELECTION=[[str(k),'0'] for k in range(n)],IMAGE_CELL_SHIFT=[0.0,0.0])
+    jobfile.writeAsciiJobfile(filename)
+    return jobfile
+
+
+def test_patch_matches_rescan(tmp_path):
+    filename = str(tmp_path / 'job.txt')
+    jobfile = _writeDistributionJobfile(filename)
+    index = asmlIndex(filename)
+
+    sections = jobfile.sections['IMAGE_DISTRIBUTION']
+    sections[1].set('IMAGE_CELL_SHIFT',[1.0,2.0])
+    newsection = sections[0].copy()
+    newsection.set('CELL_SELECTION',['9','0'])
+    index.patch(append=[newsection],replace=[sections[1]],remove=[('IMAGE_DISTRIBUTION',{'CELL_SELECTION':['2','0']})])
+
+    assert index.entries == asmlIndex(filename,rebuild=True).entries
+
+    # Sections stay separated by exactly one blank line, as written by writeAsciiJobfile
+    with open(filename) as f:
+        asciistring = f.read()
+    assert '\n\n\n' not in asciistring
+    assert asciistring.count('END_SECTION\n\nSTART_SECTION') == len(index.entries) - 1
+
+    # Replacing the same section again uses the updated index
+    sections[1].set('IMAGE_CELL_SHIFT',[3.0,4.0])
+    index.patch(replace=[sections[1]])
+    assert index.entries == asmlIndex(filename,rebuild=True).entries
+    assert index.readSections('IMAGE_DISTRIBUTION',CELL_SELECTION=['1','0'])[0].get('IMAGE_CELL_SHIFT') == [3.0,4.0]
+
+def test_patch_rescans_stale_index(tmp_path):
+    filename = str(tmp_path / 'job.txt')
+    _writeDistributionJobfile(filename,n=2)
+    index = asmlIndex(filename)
+
+    # Rewrite the file behind the index, moving the sections
+    jobfile = _writeDistributionJobfile(filename,n=4)
+    jobfile.sections['IMAGE_DISTRIBUTION'][3].set('IMAGE_CELL_SHIFT',[5.0,5.0])
+    index.patch(replace=[jobfile.sections['IMAGE_DISTRIBUTION'][3]])
+
+    assert index.entries == asmlIndex(filename,rebuild=True).entries
+    assert index.readSections('IMAGE_DISTRIBUTION',CELL_SELECTION=['3','0'])[0].get('IMAGE_CELL_SHIFT') == [5.0,5.0]
+
+def test_repeated_replace_of_transformed_ids(tmp_path):
+    filename = str(tmp_path / 'job.txt')
+    jobfile = asmlAscii()
+    jobfile.extendColumns('IMAGE_DISTRIBUTION',IMAGE_ID='IMAGE',INSTANCE_ID='<DEFAULT>',DISTRIBUTION_ACTION='I',
+                          CELL_SELECTION=[['0','0'],['1','0']],IMAGE_CELL_SHIFT=[0.0,0.0])
+    jobfile.writeAsciiJobfile(filename)
+    index = asmlIndex(filename)
+
+    # The file holds DEFAULT, written by the delimiter bug fix, while the sections keep <DEFAULT>
+    section = jobfile.sections['IMAGE_DISTRIBUTION'][1]
+    for shift in [[1.0,1.0],[2.0,2.0]]:
+        section.set('IMAGE_CELL_SHIFT',shift)
+        index.patch(replace=[section])
+        assert index.entries == asmlIndex(filename,rebuild=True).entries
+
+    assert index.readSections('IMAGE_DISTRIBUTION',INSTANCE_ID='DEFAULT',CELL_SELECTION=['1','0'])[0].get('IMAGE_CELL_SHIFT') == [2.0,2.0]
@@ -1,14 +1,15 @@
+import os
 import sys
-sys.path.insert(0, './asml_ascii')
+import pickle
+import copy
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'asmlAscii'))
 sys.path.insert(0, './semiwafer')
 
-import asml_ascii
+from asmlascii import asmlAscii
 import resonatorDistribution
-import semiwafer
+import readReticlesetReport
 
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
 
 class cellDistribution(object):
     """ Distribution of chips across a wafer
@@ -25,15 +26,24 @@ class cellDistribution(object):
     edge_clearance : safe distance from perimeter of wafer (mm)
     x0,y0          : center of the [0,0] cell (mm)
     width,height   : cell dimensions (mm)
+    wafer          : wafer with these cells, a semiwafer.semiWaferCells object
+                     made from the parameters above if not given
 
     bands          : dictionary of resonator distribution objects,
                      indexed by bandname
     cells          : dictionary of lists of cell coordinate tuples,
                      indexed by bandname
 
+    undolog        : list of placement operations that can be undone, each a tuple
+                     of a unique operation id, the operation ('place' or 'remove')
+                     and its changes
+    redolog        : list of undone operations that can be redone
+    undoids        : set of the operation ids in undolog
+    operationcount : number of operations logged, from which operation ids are drawn
+
     """
 
-    def __new__(cls, wfr_diameter=76.2, edge_clearance=2.0, x0=0.0, y0=0.0, width=0.0, height=0.0, filename=None):
+    def __new__(cls, wfr_diameter=76.2, edge_clearance=2.0, x0=0.0, y0=0.0, width=0.0, height=0.0, filename=None, wafer=None):
         """ Instantiator for cell distribution
 
         If passed a filename, loads the pickled instance instead of creating a new instance.
@@ -48,10 +58,13 @@ class cellDistribution(object):
 
         return inst
 
-    def __init__(self, wfr_diameter=76.2, edge_clearance=0.0, x0=0.0, y0=0.0, width=5.0, height=5.0, filename=None):
+    def __init__(self, wfr_diameter=76.2, edge_clearance=0.0, x0=0.0, y0=0.0, width=5.0, height=5.0, filename=None, wafer=None):
         """ Initialize data structures for cell distribution """
         if filename is None:
-            self.wafer = semiwafer.semiWaferCells(size='3 inch',x0=x0,y0=y0,width=width,height=height,edge_clearance=edge_clearance)
+            if wafer is None:
+                import semiwafer    # Loaded on first use, as distributions can also be loaded or given a wafer
+                wafer = semiwafer.semiWaferCells(size='3 inch',x0=x0,y0=y0,width=width,height=height,edge_clearance=edge_clearance)
+            self.wafer = wafer
 
             # self.wfr_diameter = wfr_diameter
             # self.edge_clearance = edge_clearance
@@ -62,6 +75,19 @@ class cellDistribution(object):
 
             self.bands = {} # Initialize empty dictionary of resonator distribution objects
             self.cells = {} # Initialize empty dictionary of cell placement lists
+            self.undolog = []
+            self.redolog = []
+            self.undoids = set()
+            self.operationcount = 0
+
+    def __setstate__(self,state):
+        """ Restore from pickle, adding empty operation logs to instances saved without them """
+        self.__dict__.update(state)
+        if 'undolog' not in state:
+            self.undolog = []
+            self.redolog = []
+            self.undoids = set()
+            self.operationcount = 0
     
     def save(self,filename):
         """ Save chipDistribution object to pickle file """
@@ -72,7 +98,7 @@ class cellDistribution(object):
     def load(filename):
         """ Load chipDistribution object from pickle file """
         with open(filename,'rb') as f:
-            return pickle.load(self,f)
+            return pickle.load(f)
     
     def importResonatorDistribution(self,filename):
         """ Import resonatorDistribution object to be placed in cells """
@@ -91,16 +117,24 @@ class cellDistribution(object):
         cells       : list of [cx,cy] pairs specifying cell positions e.g. [[0,0],[0,1],[1,1]]
 
         Note: will not duplicate a placement of a band in the same cell
+
+        The placements made are logged as one operation that can be undone, even if
+        an invalid band or cell stops the placement part way.
         """
-        for bandname in bandnames:
-            if bandname not in self.bands:
-                raise ValueError('Unknown resonator distribution')
-            else:
-                for [cx,cy] in cells:
-                    if not self.wafer.cellValid(cx,cy):
-                        raise ValueError('Cell not valid')
-                    elif bandname not in self.getBandnames(cx,cy):
-                        self.cells[bandname].append([cx,cy])    # Add (cx,cy) to list of cell locations for that bandname
+        added = []
+        try:
+            for bandname in bandnames:
+                if bandname not in self.bands:
+                    raise ValueError('Unknown resonator distribution')
+                else:
+                    for [cx,cy] in cells:
+                        if not self.wafer.cellValid(cx,cy):
+                            raise ValueError('Cell not valid')
+                        elif bandname not in self.getBandnames(cx,cy):
+                            self.cells[bandname].append([cx,cy])    # Add (cx,cy) to list of cell locations for that bandname
+                            added.append((bandname,[cx,cy]))
+        finally:
+            self._logOperation('place',added)
     
     def removeResonatorDistribution(self,bandnames=None,cells=None):
         """ Remove resonator distribution from a cell
@@ -110,17 +144,142 @@ class cellDistribution(object):
         bands from all cells. If the cells are specified and the band names are not,
         removes all bands from those cells. If neither are specified, fully clear
         the distribution.
+
+        The removals are logged as one operation that can be undone.
         """
         if bandnames is None:
-            self.removeResonatorDistribution(self.bands.keys(),cells)   # Clear all bands from specified cells
-        elif cells is None:
+            self.removeResonatorDistribution(list(self.bands.keys()),cells)   # Clear all bands from specified cells
+            return
+
+        removed = []    # (bandname, index, cell) of each removal, in order
+        if cells is None:
             for bandname in bandnames:
-                self.cells[bandname] = []                               # Clear all cells for specified bands
+                placements = self.cells[bandname]
+                while placements:                                       # Clear all cells for specified bands
+                    removed.append((bandname,len(placements)-1,placements.pop()))
         else:
             for bandname in bandnames:
                 for cell in cells:
                     if cell in self.cells[bandname]:
-                        self.cells[bandname].remove[cell]               # Clear specified bands from specified cells
+                        index = self.cells[bandname].index(cell)
+                        removed.append((bandname,index,self.cells[bandname].pop(index)))   # Clear specified bands from specified cells
+        self._logOperation('remove',removed)
+
+    def _logOperation(self,operation,changes):
+        """ Log a placement operation for undo, discarding undone operations """
+        if changes:
+            self.operationcount += 1
+            self.undolog.append((self.operationcount,operation,changes))
+            self.undoids.add(self.operationcount)
+            del self.redolog[:]
+
+    def _applyOperation(self,operation,changes,reverse=False):
+        """ Apply or reverse the changes of a logged operation
+
+        Operations are undone in reverse order of application, so the placements of
+        a 'place' operation are at the ends of the lists, and each removal of a
+        'remove' operation is reinserted at the index it was removed from.
+        Takes time proportional to the number of changes.
+        """
+        if operation == 'place':
+            if reverse:
+                for bandname, cell in reversed(changes):
+                    self.cells[bandname].pop()
+            else:
+                for bandname, cell in changes:
+                    self.cells[bandname].append(cell)
+        elif operation == 'remove':
+            if reverse:
+                for bandname, index, cell in reversed(changes):
+                    self.cells[bandname].insert(index,cell)
+            else:
+                for bandname, index, cell in changes:
+                    del self.cells[bandname][index]
+        else:
+            raise ValueError('Unknown operation {}'.format(operation))
+
+    def undo(self):
+        """ Undo the last placement operation
+
+        Returns boolean indicating whether there was an operation to undo.
+        """
+        if not self.undolog:
+            return False
+        entry = self.undolog.pop()
+        self.undoids.discard(entry[0])
+        self._applyOperation(entry[1],entry[2],reverse=True)
+        self.redolog.append(entry)
+        return True
+
+    def redo(self):
+        """ Redo the last undone placement operation
+
+        Returns boolean indicating whether there was an operation to redo. Any new
+        placement operation discards the operations that can be redone.
+        """
+        if not self.redolog:
+            return False
+        entry = self.redolog.pop()
+        self._applyOperation(entry[1],entry[2])
+        self.undolog.append(entry)
+        self.undoids.add(entry[0])
+        return True
+
+    def snapshot(self):
+        """ Mark the current placements, to revert to later
+
+        Returns a marker for revert: the id of the last operation applied, or 0
+        if there is none. Only the id is recorded, so taking a snapshot costs
+        nothing however large the wafer.
+        """
+        return self.undolog[-1][0] if self.undolog else 0
+
+    def revert(self,snapshot):
+        """ Revert the placements to a snapshot, undoing the operations since
+
+        The undone operations can be redone. Raises ValueError if the snapshot's
+        operation is no longer in the undo log, i.e. if it has been undone, or was
+        discarded by a placement operation made after undoing it. Takes time
+        proportional to the changes made since the snapshot.
+        """
+        if snapshot != 0 and snapshot not in self.undoids:
+            raise ValueError('Snapshot is not in the undo history')
+        while self.undolog and self.undolog[-1][0] != snapshot:
+            self.undo()
+
+    def checkCollisions(self,guardband,cells=None):
+        """ Finds resonators in the same cell whose predicted frequencies are too close
+
+        Checks all bands placed in each cell together, so collisions within a band
+        and across bands are both found. Frequencies are predicted once per band.
+
+        Returns a dictionary indexed by (cx,cy) tuples of the cells with collisions,
+        each a list of (bandname1, n1, bandname2, n2, f1, f2) tuples with f1 <= f2.
+        """
+        if cells is None:
+            cells = []
+            for bandname in self.cells:
+                for cell in self.cells[bandname]:
+                    if cell not in cells:
+                        cells.append(cell)
+
+        frequencies = {}
+        collisions = {}
+        for [cx,cy] in cells:
+            bandnames = self.getBandnames(cx,cy)
+            for bandname in bandnames:
+                if bandname not in frequencies:
+                    frequencies[bandname] = self.bands[bandname].predictFrequencies()
+            if not bandnames:
+                continue
+
+            labels = [(bandname,n) for bandname in bandnames for n in range(len(frequencies[bandname]))]
+            cellfrequencies = np.concatenate([frequencies[bandname] for bandname in bandnames])
+            pairs = resonatorDistribution.findCollisions(cellfrequencies,guardband)
+            if len(pairs):
+                collisions[(cx,cy)] = [labels[i] + labels[j] + (cellfrequencies[i], cellfrequencies[j]) for i, j in pairs.tolist()]
+
+        return collisions
 
     def getBandnames(self,cx,cy):
         """ Find band names present in a given cell """
@@ -143,52 +302,135 @@ class cellDistribution(object):
     #     else:
     #         return True
 
-    # def plotCellDistribution(self):
-    #     """ Plot the cell distribution """
+    def cellBands(self):
+        """ Index of band names by cell
 
-    #     wafer = semiwafer.semiWafer(size='3 inch')
+        Returns a dictionary indexed by (cx,cy) tuples of the occupied cells, each a
+        tuple of the band names placed there, built in a single pass over all placements.
+        """
+        index = {}
+        for bandname in sorted(self.cells):
+            for [cx,cy] in self.cells[bandname]:
+                index[(cx,cy)] = index.get((cx,cy),()) + (bandname,)
 
-    #     theta1 = np.arcsin(wafer.secondary_flat_length / wafer.diameter)
-    #     theta2 = np.arcsin(wafer.primary_flat_length / wafer.diameter)
+        return index
 
-    #     r = wafer.diameter / 2.
-    #     theta = np.concatenate((np.linspace(-(np.pi/2. - theta2),(np.pi/2. - theta1),100),np.linspace((np.pi/2. + theta1),(3*np.pi/2. - theta2),100),np.array([(3*np.pi/2. + theta2)])))
+    def plotCellDistribution(self,filename,labels=False,dpi=150,maxcombinations=20):
+        """ Render the cell distribution to an image file without a display
 
-    #     fig,ax = plt.subplots(1)
-    #     ax.plot(r*np.cos(theta),r*np.sin(theta),'k')
-    #     plt.axis('equal')
+        Draws the wafer outline and every valid cell, colored by the combination of
+        bands placed in it, with a legend of the combinations. If there are more
+        combinations than distinct colors (maxcombinations), cells are instead
+        colored by the number of bands placed in them, with a colorbar. The format
+        follows the file extension, e.g. .png or .svg.
 
-    #     for cx in range(-int((r+self.x0)/self.width)-1,int((r-self.x0)/self.width)+1):
-    #         for cy in range(-int((r+self.y0)/self.height)-1,int((r-self.y0)/self.height)+1):
-    #             if self.cellValid(cx,cy):
-    #                 ax.add_patch(patches.Rectangle((self.x0+self.width*(cx-0.5),self.y0+self.height*(cy-0.5)),self.width,self.height,linewidth=1,edgecolor='k',facecolor='none',fill=False))
-    #                 bandstring = ''
-    #                 for bandname in self.getBandnames(cx,cy):
-    #                     bandstring = bandstring + bandname + ' / '
-    #                 bandstring = bandstring[:-3]
-    #                 ax.text(self.x0+self.width*cx, self.y0+self.height*cy,bandstring,horizontalalignment='center',verticalalignment='center')
+        All cells are drawn as a single polygon collection, so dense wafers render
+        quickly. Labelling each cell with its band names (labels=True) draws one
+        text per occupied cell, which is much slower.
+        """
+        # Plotting is optional, so matplotlib is only imported when needed
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.collections import PolyCollection
+        from matplotlib.patches import Patch
+        import matplotlib
+
+        x0, y0 = self.wafer.x0, self.wafer.y0
+        width, height = self.wafer.width, self.wafer.height
+        import semiwafer
+        wafer = semiwafer.semiWafer(size='3 inch')
+        r = wafer.diameter / 2.
+
+        # Wafer outline with primary and secondary flats
+        theta1 = np.arcsin(wafer.secondary_flat_length / wafer.diameter)
+        theta2 = np.arcsin(wafer.primary_flat_length / wafer.diameter)
+        theta = np.concatenate((np.linspace(-(np.pi/2. - theta2),(np.pi/2. - theta1),100),np.linspace((np.pi/2. + theta1),(3*np.pi/2. - theta2),100),np.array([(3*np.pi/2. + theta2)])))
+
+        cells = [(cx,cy) for cx in range(-int((r+x0)/width)-1,int((r-x0)/width)+2)
+                         for cy in range(-int((r+y0)/height)-1,int((r-y0)/height)+2)
+                         if self.wafer.cellValid(cx,cy)]
+        index = self.cellBands()
+        combinations = sorted(set(index.values()))
+
+        centers = np.array([[x0 + width*cx, y0 + height*cy] for cx, cy in cells]).reshape(-1,2)
+        corners = np.array([[-0.5,-0.5],[0.5,-0.5],[0.5,0.5],[-0.5,0.5]])*[width,height]
+        collection = PolyCollection(centers[:,np.newaxis,:] + corners,edgecolors='k',linewidths=0.5)
+        if len(combinations) <= maxcombinations:
+            colormap = matplotlib.colormaps['tab20']
+            colors = dict((bandnames,colormap(n % 20)) for n, bandnames in enumerate(combinations))
+            collection.set_facecolors([colors[index[cell]] if cell in index else (1.0,1.0,1.0,0.0) for cell in cells])
+        else:
+            collection.set_array(np.array([len(index.get(cell,())) for cell in cells]))
+            collection.set_cmap('viridis')
+
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1,1,1)
+        ax.plot(r*np.cos(theta),r*np.sin(theta),'k')
+        ax.add_collection(collection)
+        if labels:
+            for (cx,cy), center in zip(cells,centers):
+                if (cx,cy) in index:
+                    ax.text(center[0],center[1],' / '.join(index[(cx,cy)]),horizontalalignment='center',verticalalignment='center',fontsize=4)
+        if len(combinations) > maxcombinations:
+            fig.colorbar(collection,ax=ax,label='Number of bands')
+        elif combinations:
+            ax.legend(handles=[Patch(facecolor=colors[bandnames],edgecolor='k',label=' / '.join(bandnames)) for bandnames in combinations],
+                      loc='upper left',bbox_to_anchor=(1.0,1.0),fontsize='small')
+        ax.set_aspect('equal')
+        ax.autoscale_view()
+        fig.savefig(filename,dpi=dpi,bbox_inches='tight')
+
+
+    def _makeJobfile(self,reticlesetreportfilename,placements,reticleimages,template,layers):
+        """ Generate ASCII jobfile for a list of (bandname, cx, cy) placements
+
+        Gives the same jobfile as merging the chip jobfile of each placement into the
+        template in turn, but each band's memoized section block is copied only once,
+        with just the image distribution stamped out per cell, and all sections are
+        added in one pass with hashed interference checks.
+        """
+        if template is None:
+            template = asmlAscii()
+            template.readAsciiJobfile(resonatorDistribution.TEMPLATEFILENAME)
+        if reticleimages is None:
+            reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+
+        jobfile = copy.deepcopy(template)    # Leave the passed-in template unmodified
+        resonatorDistribution.addLayers(jobfile,layers)
+
+        sections = []
+        blocks = {}
+        layerimages = readReticlesetReport.groupByLayer(reticleimages)
+        for bandname, cx, cy in placements:
+            if bandname not in blocks:
+                blocks[bandname] = self.bands[bandname].makeSectionBlock(reticlesetreportfilename,reticleimages,layers,layerimages)
+                sections.extend(resonatorDistribution.stampSectionBlock(blocks[bandname],cx,cy))
+            else:
+                # The band's other sections would interfere with those already added
+                sections.extend(resonatorDistribution.stampImageDistribution(blocks[bandname],cx,cy))
+        jobfile.extend(sections,check_interference=True)
 
-    #     plt.show()
+        return jobfile
 
+    def makeJobfileByCells(self,reticlesetreportfilename,cells,reticleimages=None,template=None,layers=('BEV',)):
+        """ Generate ASCII jobfile for specified cells
 
-    def makeJobfileByCells(self,reticlesetreportfilename,cells):
-        """ Generate ASCII jobfile for specified cells """
+        The Reticleset report and template are read once for all cells, unless
+        already read reticle images and a parsed template are passed in.
 
-        jobfile = asmlAscii(filename='umuxbevtemplate.txt')
+        The bands are exposed in each of the requested layers, as in
+        resonatorDistribution.makeChipJobfile.
+        """
+        placements = [(bandname,cx,cy) for [cx,cy] in cells for bandname in self.getBandnames(cx,cy)]
 
-        for [cx,cy] in cells:
-            for bandname in self.getBandnames(cx,cy):
-                jobfile.merge(self.bands['bandname'].makeChipJobfile(reticlesetreportfilename,cx,cy))
-        
-        return jobfile
+        return self._makeJobfile(reticlesetreportfilename,placements,reticleimages,template,layers)
     
-    def makeJobfileByBands(self,reticlesetreportfilename,bandnames):
-        """ Generate ASCII jobfile for specified bands """
+    def makeJobfileByBands(self,reticlesetreportfilename,bandnames,reticleimages=None,template=None,layers=('BEV',)):
+        """ Generate ASCII jobfile for specified bands
 
-        jobfile = asmlAscii(filename='umuxbevtemplate.txt')
+        Accepts already read reticle images, template and layers, as makeJobfileByCells.
+        """
+        placements = [(bandname,cx,cy) for bandname in bandnames for [cx,cy] in self.cells[bandname]]
 
-        for bandname in bandnames:
-            for [cx,cy] in self.cells[bandname]:
-                jobfile.merge(self.bands['bandname'].makeChipJobfile(reticlesetreportfilename,cx,cy))
-        
-        return jobfile
\ No newline at end of file
+        return self._makeJobfile(reticlesetreportfilename,placements,reticleimages,template,layers)
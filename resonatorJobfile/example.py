@@ -1,8 +1,6 @@
 import resonatorDistribution
 import numpy as np
-import sys
-sys.path.insert(0, './asml_ascii')
-from asml_ascii import asmlAscii, asmlCells, asmlSection, asmlSectionList
+from resonatorDistribution import asmlAscii
 
 rd = resonatorDistribution.resonatorDistribution(nres=4)
 rd.setImages('BAND04','band04.gds','slider3.gds')
@@ -16,17 +14,15 @@ rd.calculateShifts()
 rd.resonators[3].__dict__
 
 aa = asmlAscii()
-asl = rd.makeImageDefinitionSectionList('retsetrep.txt')
-aa.append(asl)
-asl = rd.makeImageDistributionSectionList(cx=0,cy=0)
-aa.append(asl)
-asl = rd.makeInstanceDefinitionSectionList()
-aa.append(asl)
-asl = rd.makeReticleDataSectionList('retsetrep.txt')
-aa.append(asl)
-with open('tmp.txt','w') as f:
-    aa.writer(f)
+for section in rd.makeImageDefinitionSectionList('retsetrep.txt'):
+    aa.append(section)
+for section in rd.makeImageDistributionSectionList(cx=0,cy=0):
+    aa.append(section)
+for section in rd.makeInstanceDefinitionSectionList():
+    aa.append(section)
+for section in rd.makeReticleDataSectionList('retsetrep.txt'):
+    aa.append(section)
+aa.writeAsciiJobfile('tmp.txt')
 
 jobfile = rd.makeChipJobfile(reticlesetreportfilename='retsetrep.txt',cx=0,cy=0)
-with open('tmp2.txt','w') as f:
-    jobfile.writer(f)
\ No newline at end of file
+jobfile.writeAsciiJobfile('tmp2.txt')
\ No newline at end of file
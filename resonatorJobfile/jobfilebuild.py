@@ -0,0 +1,246 @@
+"""
+Dependency-tracked incremental build of cell distribution jobfiles.
+
+The build of a jobfile is split into stages, each cached on disk under a key
+that hashes exactly the inputs the stage depends on:
+
+    band     : resonator distribution with shifts recalculated
+               <- band contents, fingerprints of the resonator models it uses
+    chip     : section block of one band placed in one cell
+               <- band stage key, the band's images in the Reticleset report, cell,
+                  layers
+    jobfile  : template merged with the chip blocks
+               <- template file contents, layers, chip stage keys in order
+
+After an input changes, only the stages whose keys change are rebuilt. Editing
+one band's distribution rebuilds that band's chips only; editing the report
+rebuilds only the bands whose images changed; editing the template only
+repeats the final merge.
+
+The cache directory holds at most a given number of stage outputs; when it is
+full, the least recently used ones are deleted until it is three quarters full.
+"""
+
+import copy
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+import resonatorDistribution
+import resonatorModels
+import readReticlesetReport
+from resonatorDistribution import asmlAscii
+
+
+def _hash(*parts):
+    """ Hashes a sequence of strings into a hexadecimal key """
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def _hasModels(rd):
+    """ Checks whether every resonator has a target frequency and model to recalculate its shift """
+    for res in rd.resonators:
+        if not (hasattr(res,'f0') and hasattr(res,'modelname') and hasattr(res,'wx')):
+            return False
+    return True
+
+
+
+class jobfileBuilder(object):
+    """ Incremental builder of jobfiles from a cell distribution
+
+    Parameters:
+    ===========
+    cachedir   : directory holding the cached stage outputs
+    maxentries : maximum number of stage outputs kept in the cache directory
+    log        : list of (stage, description, 'hit' or 'build') tuples for the
+                 stages run since the builder was created
+    """
+    MAXREPORTS = 4      # Reticleset reports kept in memory
+
+    def __init__(self,cachedir,maxentries=1024):
+        self.cachedir = cachedir
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.maxentries = maxentries
+        self.log = []
+        self._filekeys = {}             # (filename, size, mtime) : content hash
+        self._reports = OrderedDict()   # content hash : reticle images, least recently used first
+        self._entries = None            # Number of cache files, counted on the first write
+
+    def _cached(self,stage,key,description,function):
+        """ Returns a stage output from the cache, or computes and caches it
+
+        Each cache file holds the stage output together with a description of
+        the inputs it was built from. The modification time of a cache file marks
+        its last use, and the least recently used files are deleted once the cache
+        holds more than maxentries files.
+        """
+        filename = os.path.join(self.cachedir,'{}-{}.pkl'.format(stage,key))
+        if os.path.exists(filename):
+            with open(filename,'rb') as f:
+                entry = pickle.load(f)
+            os.utime(filename)
+            self.log.append((stage,description,'hit'))
+            return entry['value']
+
+        value = function()
+        with open(filename + '.tmp','wb') as f:
+            pickle.dump({'depends':description, 'value':value},f)
+        os.replace(filename + '.tmp',filename)
+        self.log.append((stage,description,'build'))
+        self._prune()
+
+        return value
+
+    def _prune(self):
+        """ Counts a new cache file, and deletes the least recently used ones once there are more than maxentries
+
+        The cache files are listed on the first write and then counted as they are
+        written. A full cache is pruned to three quarters of maxentries, so that the
+        directory is listed once per maxentries/4 writes rather than on every write.
+        """
+        if self._entries is not None:
+            self._entries += 1
+            if self._entries <= self.maxentries:
+                return
+        filenames = [os.path.join(self.cachedir,name) for name in os.listdir(self.cachedir) if name.endswith('.pkl')]
+        self._entries = len(filenames)
+        if len(filenames) <= self.maxentries:
+            return
+        filenames.sort(key=os.path.getmtime)
+        for filename in filenames[:len(filenames) - 3*self.maxentries//4]:
+            os.remove(filename)
+        self._entries = 3*self.maxentries//4
+
+    def fileKey(self,filename):
+        """ Hashes the contents of a file, rehashing only if its size or mtime changed """
+        stat = os.stat(filename)
+        stamp = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+        if stamp not in self._filekeys:
+            with open(filename,'rb') as f:
+                self._filekeys[stamp] = hashlib.sha1(f.read()).hexdigest()
+        return self._filekeys[stamp]
+
+    def reticleImages(self,reticlesetreportfilename):
+        """ Reads the reticle images of a Reticleset report, once per report contents
+
+        Keeps the MAXREPORTS most recently used reports in memory.
+        """
+        key = self.fileKey(reticlesetreportfilename)
+        if key in self._reports:
+            reticleimages = self._reports.pop(key)
+        else:
+            reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+            if len(self._reports) >= self.MAXREPORTS:
+                self._reports.popitem(last=False)
+        self._reports[key] = reticleimages
+
+        return reticleimages
+
+    def bandKey(self,rd):
+        """ Hashes the contents of a band and the models it uses """
+        modelnames = sorted(set(res.modelname for res in rd.resonators if hasattr(res,'modelname')))
+        fingerprints = [resonatorModels.modelFingerprint(modelname) for modelname in modelnames]
+        return _hash(hashlib.sha1(pickle.dumps(rd,protocol=2)).hexdigest(),*fingerprints)
+
+    def band(self,rd,bandkey=None):
+        """ Band stage: the distribution with shifts recalculated by the current models
+
+        Distributions whose resonators lack a target frequency or model are used as
+        they are. bandkey is bandKey(rd), computed if not given.
+        """
+        def function():
+            rdcopy = copy.deepcopy(rd)
+            if _hasModels(rdcopy):
+                rdcopy.calculateShifts()
+            return rdcopy
+        if bandkey is None:
+            bandkey = self.bandKey(rd)
+        return self._cached('band',bandkey,{'band':rd.bandname},function)
+
+    def imagesKey(self,rd,reticleimages):
+        """ Hashes the reticle images a band uses, ignoring the rest of the report """
+        parts = []
+        for retim in reticleimages:
+            if retim.gds_file in (rd.wigglegds, rd.slidergds):
+                parts.append(repr(sorted(retim.__dict__.items())))
+        return _hash(*parts)
+
+    def chipKey(self,bandkey,imageskey,cx,cy,layers=('BEV',)):
+        """ Hashes the inputs of the section block of a band in a cell
+
+        bandkey and imageskey are the bandKey and imagesKey of the band, which are
+        the same for all its cells and so are computed once per band by the caller.
+        """
+        return _hash(bandkey,imageskey,cx,cy,','.join(layers))
+
+    def chip(self,rd,reticlesetreportfilename,cx,cy,layers=('BEV',),bandkey=None,imageskey=None):
+        """ Chip stage: the list of sections of a band in a cell, exposed in each of the layers
+
+        bandkey and imageskey are the bandKey and imagesKey of rd, computed if not given.
+        """
+        reticleimages = self.reticleImages(reticlesetreportfilename)
+        if bandkey is None:
+            bandkey = self.bandKey(rd)
+        if imageskey is None:
+            imageskey = self.imagesKey(rd,reticleimages)
+        def function():
+            band = self.band(rd,bandkey)
+            layerimages = readReticlesetReport.groupByLayer(reticleimages)
+            return (band.makeImageDefinitionSectionList(reticlesetreportfilename,reticleimages,layers,layerimages)
+                    + band.makeImageDistributionSectionList(cx,cy)
+                    + band.makeInstanceDefinitionSectionList()
+                    + band.makeReticleDataSectionList(reticlesetreportfilename,reticleimages,layers,layerimages))
+        return self._cached('chip',self.chipKey(bandkey,imageskey,cx,cy,layers),
+                            {'band':rd.bandname, 'cell':[cx,cy], 'layers':list(layers)},function)
+
+    def build(self,cd,reticlesetreportfilename,cells=None,bandnames=None,templatefilename=resonatorDistribution.TEMPLATEFILENAME,
+              layers=('BEV',)):
+        """ Builds the jobfile for cells or bands of a cell distribution
+
+        Gives the same jobfile as cellDistribution.makeJobfileByCells if cells are
+        given, or as makeJobfileByBands if band names are given, with the bands
+        exposed in each of the layers, but reuses every cached stage whose inputs
+        have not changed.
+        """
+        if (cells is None) == (bandnames is None):
+            raise ValueError('Specify either cells or band names')
+
+        placements = []
+        if cells is not None:
+            for [cx,cy] in cells:
+                for bandname in cd.getBandnames(cx,cy):
+                    placements.append((bandname,cx,cy))
+        else:
+            for bandname in bandnames:
+                for [cx,cy] in cd.cells[bandname]:
+                    placements.append((bandname,cx,cy))
+
+        # Band and images keys are hashed once per band, not once per placement
+        reticleimages = self.reticleImages(reticlesetreportfilename)
+        bandkeys = {}
+        imageskeys = {}
+        for bandname, cx, cy in placements:
+            if bandname not in bandkeys:
+                bandkeys[bandname] = self.bandKey(cd.bands[bandname])
+                imageskeys[bandname] = self.imagesKey(cd.bands[bandname],reticleimages)
+        chipkeys = [self.chipKey(bandkeys[bandname],imageskeys[bandname],cx,cy,layers) for bandname, cx, cy in placements]
+
+        def function():
+            jobfile = asmlAscii()
+            jobfile.readAsciiJobfile(templatefilename)
+            resonatorDistribution.addLayers(jobfile,layers)
+            sections = []
+            for bandname, cx, cy in placements:
+                sections.extend(self.chip(cd.bands[bandname],reticlesetreportfilename,cx,cy,layers,
+                                          bandkeys[bandname],imageskeys[bandname]))
+            # Extending with interference checks matches asmlAscii.merge of the chip jobfiles
+            jobfile.extend(sections,check_interference=True)
+            return jobfile
+        key = _hash(self.fileKey(templatefilename),','.join(layers),*chipkeys)
+        return self._cached('jobfile',key,{'placements':placements, 'layers':list(layers)},function)
@@ -0,0 +1,263 @@
+"""
+Local jobfile generation service that keeps its inputs warm in memory.
+
+Parsed templates, Reticleset reports and pickled distributions are cached by
+file name and reloaded only when the file's size or modification time changes,
+so repeated requests from interactive placement tooling skip the imports and
+parsing that a fresh run would repeat.
+
+Usage:
+    python jobfileservice.py [--port PORT] [--unix-socket PATH] [--root DIR] [--token TOKEN]
+
+The service listens on 127.0.0.1 only. Requests are HTTP POST requests with
+form-encoded parameters in the body, and must carry the service token in an
+X-Jobfile-Token header; a token is generated and printed at startup unless one
+is given. Since pickled distributions are loaded from the files named in a
+request, file names are resolved relative to the root directory (default: the
+working directory) and files outside it are refused. Paths and parameters:
+
+    /chip   band=BAND.pkl&report=REPORT&cx=0&cy=0
+        single-chip jobfile of a pickled resonatorDistribution
+    /cells  distribution=CELLS.pkl&report=REPORT&cells=0,0;1,0
+        jobfile of the given cells of a pickled cellDistribution
+    /bands  distribution=CELLS.pkl&report=REPORT&bands=BAND04,BAND05
+        jobfile of the given bands of a pickled cellDistribution
+    /status
+        list of cached files
+
+All jobfile requests take an optional template parameter, which defaults to
+resonatorDistribution.TEMPLATEFILENAME. Jobfiles are returned as text/plain.
+"""
+
+import argparse
+import asyncio
+import hmac
+import os
+import secrets
+import sys
+import time
+import traceback
+from urllib.parse import urlsplit, parse_qs
+
+import resonatorDistribution
+import cellDistribution
+import readReticlesetReport
+from resonatorDistribution import asmlAscii
+
+
+class warmCache(object):
+    """ Cache of parsed input files
+
+    Entries are keyed by kind of file and absolute file name, and store the
+    size and modification time of the file when it was loaded, so that a
+    changed file is reloaded on its next use.
+    """
+    def __init__(self,root='.'):
+        self.root = os.path.realpath(root)
+        self.entries = {}
+
+    def resolve(self,filename):
+        """ Resolves a requested file name under the root directory
+
+        Raises ValueError for names that resolve outside the root, including
+        through symbolic links.
+        """
+        path = os.path.realpath(os.path.join(self.root,filename))
+        if os.path.commonpath([self.root,path]) != self.root:
+            raise ValueError('File {} is outside {}'.format(filename,self.root))
+        return path
+
+    def _load(self,kind,filename,loader):
+        """ Returns the cached object for a file, loading it if missing or stale """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        stamp = (stat.st_size, stat.st_mtime)
+
+        entry = self.entries.get((kind,filename))
+        if entry is None or entry['stamp'] != stamp:
+            start = time.time()
+            entry = {'stamp':stamp, 'value':loader(filename), 'loadtime':time.time() - start, 'hits':0}
+            self.entries[(kind,filename)] = entry
+        else:
+            entry['hits'] += 1
+
+        return entry['value']
+
+    def template(self,filename):
+        """ Gets a parsed template jobfile """
+        def loader(filename):
+            jobfile = asmlAscii()
+            jobfile.readAsciiJobfile(filename)
+            return jobfile
+        return self._load('template',filename,loader)
+
+    def reticleImages(self,filename):
+        """ Gets the reticle images of a Reticleset report """
+        return self._load('report',filename,readReticlesetReport.readReticlesetReport)
+
+    def band(self,filename):
+        """ Gets a pickled resonatorDistribution """
+        return self._load('band',filename,lambda f: resonatorDistribution.resonatorDistribution(filename=f))
+
+    def distribution(self,filename):
+        """ Gets a pickled cellDistribution """
+        return self._load('distribution',filename,lambda f: cellDistribution.cellDistribution(filename=f))
+
+    def status(self):
+        """ Describes the cache entries, one line per file """
+        lines = []
+        for (kind,filename), entry in sorted(self.entries.items()):
+            lines.append('{:<12} {} (loaded in {:.3f} s, {:d} hits)'.format(kind,filename,entry['loadtime'],entry['hits']))
+        return '\n'.join(lines) + '\n'
+
+
+
+class unknownPathError(Exception):
+    """ Raised by generate for request paths the service does not answer """
+
+def _parameter(query,name,default=None):
+    """ Gets a single query parameter, raising ValueError if a required one is missing """
+    if name in query:
+        return query[name][0]
+    if default is None:
+        raise ValueError('Missing parameter {}'.format(name))
+    return default
+
+def generate(cache,path,query):
+    """ Generates the response text for a request path and parsed query
+
+    File names in the query are resolved under the root directory of the cache.
+    Raises ValueError for bad requests and unknownPathError for unknown paths.
+    """
+    if path == '/status':
+        return cache.status()
+    if path not in ('/chip', '/cells', '/bands'):
+        raise unknownPathError(path)
+
+    if 'template' in query:
+        template = cache.template(cache.resolve(_parameter(query,'template')))
+    else:
+        template = cache.template(resonatorDistribution.TEMPLATEFILENAME)
+    reportfilename = cache.resolve(_parameter(query,'report'))
+    reticleimages = cache.reticleImages(reportfilename)
+
+    if path == '/chip':
+        rd = cache.band(cache.resolve(_parameter(query,'band')))
+        jobfile = rd.makeChipJobfile(reportfilename,int(_parameter(query,'cx')),int(_parameter(query,'cy')),
+                                     reticleimages=reticleimages,template=template)
+    elif path == '/cells':
+        cd = cache.distribution(cache.resolve(_parameter(query,'distribution')))
+        cells = [[int(c) for c in cell.split(',')] for cell in _parameter(query,'cells').split(';')]
+        jobfile = cd.makeJobfileByCells(reportfilename,cells,reticleimages=reticleimages,template=template)
+    elif path == '/bands':
+        cd = cache.distribution(cache.resolve(_parameter(query,'distribution')))
+        bandnames = _parameter(query,'bands').split(',')
+        for bandname in bandnames:
+            if bandname not in cd.bands:
+                raise ValueError('Unknown band {}'.format(bandname))
+        jobfile = cd.makeJobfileByBands(reportfilename,bandnames,reticleimages=reticleimages,template=template)
+
+    return jobfile.makeAscii()
+
+
+
+class jobfileService(object):
+    """ asyncio HTTP server answering jobfile requests from a warm cache
+
+    Requests are handled one at a time, in a worker thread, so the event loop
+    keeps accepting connections while a jobfile is generated and the cache is
+    never used by two requests at once.
+
+    Only POST requests carrying the token in an X-Jobfile-Token header are
+    answered. A browser cannot add that header to a cross-site request without
+    a CORS preflight, which the service does not answer.
+    """
+    MAXBODY = 65536     # Largest accepted request body in bytes
+
+    def __init__(self,token,root='.'):
+        self.token = token
+        self.cache = warmCache(root)
+        self.lock = asyncio.Lock()
+
+    async def handle(self,reader,writer):
+        """ Reads one HTTP request and writes the response """
+        try:
+            requestline = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                length = int(headers.get('content-length','0'))
+            except ValueError:
+                length = -1
+
+            if len(requestline) < 2 or requestline[0] != 'POST':
+                status, body = '405 Method Not Allowed', 'Only POST requests are supported\n'
+            elif not hmac.compare_digest(headers.get('x-jobfile-token','').encode('latin-1'),self.token.encode('utf-8')):
+                status, body = '403 Forbidden', 'Missing or wrong X-Jobfile-Token header\n'
+            elif not 0 <= length <= self.MAXBODY:
+                status, body = '400 Bad Request', 'Bad Content-Length\n'
+            else:
+                url = urlsplit(requestline[1])
+                requestbody = await reader.readexactly(length)
+                start = time.time()
+                try:
+                    query = parse_qs(requestbody.decode('utf-8'))
+                    async with self.lock:
+                        body = await asyncio.get_running_loop().run_in_executor(
+                            None,generate,self.cache,url.path,query)
+                    status = '200 OK'
+                except unknownPathError:
+                    status, body = '404 Not Found', 'Unknown path {}\n'.format(url.path)
+                except (ValueError, TypeError, OSError) as error:
+                    status, body = '400 Bad Request', '{}\n'.format(error)
+                except Exception:
+                    sys.stderr.write(traceback.format_exc())
+                    status, body = '500 Internal Server Error', 'Internal error, see the service log\n'
+                sys.stderr.write('{} {} ({:.3f} s)\n'.format(requestline[1],status,time.time() - start))
+
+            body = body.encode('utf-8')
+            writer.write('HTTP/1.0 {}\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Length: {:d}\r\nConnection: close\r\n\r\n'
+                         .format(status,len(body)).encode('latin-1') + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self,port=8765,path=None):
+        """ Serves requests on a localhost TCP port, or on a Unix socket if a path is given """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle,path=path)
+        else:
+            server = await asyncio.start_server(self.handle,host='127.0.0.1',port=port)
+        async with server:
+            await server.serve_forever()
+
+
+
+def main(argv=None):
+    """ Parses command-line arguments and runs the service until interrupted """
+    parser = argparse.ArgumentParser(description='Local warm-cache jobfile generation service')
+    parser.add_argument('--port',type=int,default=8765,help='port to listen on at 127.0.0.1 (default: 8765)')
+    parser.add_argument('--unix-socket',default=None,help='listen on a Unix socket instead of a TCP port')
+    parser.add_argument('--root',default='.',help='directory containing all requested files (default: working directory)')
+    parser.add_argument('--token',default=None,help='token required in the X-Jobfile-Token header (default: generated)')
+    args = parser.parse_args(argv)
+
+    token = args.token
+    if token is None:
+        token = secrets.token_urlsafe(24)
+        sys.stderr.write('X-Jobfile-Token: {}\n'.format(token))
+
+    try:
+        asyncio.run(jobfileService(token,args.root).serve(args.port,args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
+import os
 import sys
-sys.path.insert(0, './asml_ascii')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'asmlAscii'))
 
-from asml_ascii import asmlAscii, asmlCells, asmlSection, asmlSectionList
+from asmlascii import asmlSection
 import re
 
 UMUXEXPOSURES = {'CE':150.0,
@@ -13,6 +14,9 @@ UMUXEXPOSURES = {'CE':150.0,
                  'I1X':190.0,
                  'BEV':190.0}
 
+# Device layers in process order
+UMUXLAYERS = ['CE', 'AL', 'BES', 'R1', 'I1', 'W1', 'I1X', 'BEV']
+
 class ReticleImage():
     """
     Class that holds relevant parameters for each image on a reticle plate, as specified
@@ -62,16 +66,16 @@ class ReticleImage():
         if exposure == 0.0:
             exposure = UMUXEXPOSURES[layer]
 
-        section = asmlSection('reticle_data')
-        section.set('image_id', image)
-        section.set('layer_id', layer)
-        section.set('reticle_id', self.reticle_id)
-        section.set('image_size', [self.width, self.height])
-        section.set('mask_size', [self.width, self.height])
-        section.set('image_shift', [self.x_shift, self.y_shift])
-        section.set('mask_shift', [self.x_shift, self.y_shift])
-        section.set('energy_actual', float(exposure))
-        section.set('image_usage','Y')
+        section = asmlSection('RETICLE_DATA')
+        section.set('IMAGE_ID', image)
+        section.set('LAYER_ID', layer)
+        section.set('RETICLE_ID', self.reticle_id)
+        section.set('IMAGE_SIZE', [self.width, self.height])
+        section.set('MASK_SIZE', [self.width, self.height])
+        section.set('IMAGE_SHIFT', [self.x_shift, self.y_shift])
+        section.set('MASK_SHIFT', [self.x_shift, self.y_shift])
+        section.set('ENERGY_ACTUAL', float(exposure))
+        section.set('IMAGE_USAGE','Y')
 
         return section
 
@@ -117,4 +121,128 @@ def readReticlesetReport(filename):
             # Create ReticleImage object and add it to the list
             reticleimages.append(ReticleImage(reticle_id, gds_file, xic_layer, x_shift, y_shift, width, height))
 
-    return reticleimages
\ No newline at end of file
+    return reticleimages
+
+
+def groupByLayer(reticleimages):
+    """
+    Groups reticle images by Xic layer and GDS file in a single pass.
+
+    Returns a dictionary indexed by Xic layer of dictionaries indexed by GDS
+    file name, holding the first image found for each layer and GDS file.
+    """
+    layerimages = {}
+    for retim in reticleimages:
+        gdsimages = layerimages.setdefault(retim.xic_layer, {})
+        if retim.gds_file not in gdsimages:
+            gdsimages[retim.gds_file] = retim
+
+    return layerimages
+
+
+class ReticlePlateIndex():
+    """
+    Spatial index of the reticle images on each reticle plate, for overlap and
+    blade clearance checks and point queries.
+
+    Each plate is covered by a uniform grid with cells about the size of its
+    images, and each image is registered in the grid cells its rectangle covers.
+    Only images sharing a grid cell are compared, so checking a plate takes
+    near-linear time in its number of images.
+    """
+    def __init__(self, reticleimages, clearance=0.0):
+        """
+        Parameters
+        ==========
+        reticleimages : list of ReticleImage
+            Images to index, e.g. as returned by readReticlesetReport.
+        clearance : float
+            Minimum distance (in mm) between the edges of neighbouring images, so
+            that the reticle masking blades can cover one image without cutting
+            into the other. Images are registered in the grid with their
+            rectangles grown by the clearance, so that too-close pairs share a cell.
+        """
+        self.clearance = clearance
+        self.plates = {}
+        for retim in reticleimages:
+            self.plates.setdefault(retim.reticle_id, []).append(retim)
+
+        self.cellsizes = {}
+        self.grids = {}
+        for reticle_id, images in self.plates.items():
+            cellsize = sum(max(retim.width, retim.height) for retim in images)/len(images) + clearance
+            if cellsize <= 0.0:
+                cellsize = 1.0
+            self.cellsizes[reticle_id] = cellsize
+
+            grid = {}
+            for n, retim in enumerate(images):
+                for key in self._cells(reticle_id, retim, clearance):
+                    grid.setdefault(key, []).append(n)
+            self.grids[reticle_id] = grid
+
+    def _cells(self, reticle_id, retim, margin):
+        """
+        Returns the grid cells covered by the rectangle of an image grown by margin.
+        """
+        cellsize = self.cellsizes[reticle_id]
+        imin = int((retim.x_shift - retim.width/2 - margin)//cellsize)
+        imax = int((retim.x_shift + retim.width/2 + margin)//cellsize)
+        jmin = int((retim.y_shift - retim.height/2 - margin)//cellsize)
+        jmax = int((retim.y_shift + retim.height/2 + margin)//cellsize)
+        return [(i, j) for i in range(imin, imax+1) for j in range(jmin, jmax+1)]
+
+    def find_conflicts(self, reticle_id=None):
+        """
+        Finds pairs of images that overlap or violate the blade clearance.
+
+        Checks the given plate, or all plates. Returns a list of tuples
+        (image1, image2, kind), with kind 'overlap' if the image rectangles
+        overlap and 'clearance' if they are closer than the clearance in both
+        x and y, i.e. the blades around one image would cut into the other.
+        Images that only touch do not overlap.
+        """
+        if reticle_id is None:
+            reticle_ids = list(self.plates)
+        else:
+            reticle_ids = [reticle_id]
+
+        conflicts = []
+        for reticle_id in reticle_ids:
+            images = self.plates[reticle_id]
+            seen = set()
+            for indices in self.grids[reticle_id].values():
+                for a in range(len(indices)):
+                    for b in range(a+1, len(indices)):
+                        pair = (indices[a], indices[b])
+                        if pair in seen:
+                            continue
+                        seen.add(pair)
+                        im1, im2 = images[pair[0]], images[pair[1]]
+                        gapx = abs(im1.x_shift - im2.x_shift) - (im1.width + im2.width)/2
+                        gapy = abs(im1.y_shift - im2.y_shift) - (im1.height + im2.height)/2
+                        if gapx < 0.0 and gapy < 0.0:
+                            conflicts.append((im1, im2, 'overlap'))
+                        elif gapx < self.clearance and gapy < self.clearance:
+                            conflicts.append((im1, im2, 'clearance'))
+
+        return conflicts
+
+    def images_at(self, reticle_id, x, y):
+        """
+        Returns the list of images on a reticle plate whose rectangle contains
+        the point (x, y) (in mm), edges included.
+        """
+        if reticle_id not in self.plates:
+            raise ValueError('Reticle plate {} not in index'.format(reticle_id))
+
+        cellsize = self.cellsizes[reticle_id]
+        images = self.plates[reticle_id]
+        # The grid cell of the point is among the cells of every image containing it
+        found = []
+        for n in self.grids[reticle_id].get((int(x//cellsize), int(y//cellsize)), []):
+            retim = images[n]
+            if abs(x - retim.x_shift) <= retim.width/2 and abs(y - retim.y_shift) <= retim.height/2:
+                found.append(retim)
+
+        return found
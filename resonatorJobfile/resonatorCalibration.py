@@ -0,0 +1,122 @@
+###################################################################################
+#
+# Resonator Calibration
+#
+# Fits the coefficients of the linear wiggle model to measured resonance
+# frequencies, accumulating the normal equations in a single streaming pass so
+# that datasets of any size can be fitted in constant memory.
+#
+
+import itertools
+import numpy as np
+import resonatorModels
+
+# Columns of measurement data, in the order of the wiggle model arguments
+COLUMNS = ['delta','e','w','s','Z1','Cc','Lc','f0']
+COEFFICIENTS = ['fitoffset','fitdlde','fitdldw','fitdldsdelta']
+
+
+class wiggleCalibration(object):
+    """ Streaming least-squares fit of the linear wiggle model
+
+    The wiggle model is linear in its coefficients after inverting the frequency:
+
+        1/f0 - 4*Cc*Z1 - 4*Lc/Z1 = fitoffset + fitdlde*e + fitdldw*w + fitdldsdelta*s*delta
+
+    Measurements are added in chunks, each updating the normal equations X'X and
+    X'y of this linear system, so only the 4x4 matrix and its right-hand side are
+    kept in memory.
+
+    Parameters:
+    ===========
+    xtx     : accumulated X'X
+    xty     : accumulated X'y
+    yty     : accumulated y'y, for the residual
+    count   : number of measurements added
+    """
+    def __init__(self):
+        """ Initializes empty normal equations """
+        self.xtx = np.zeros((4,4))
+        self.xty = np.zeros(4)
+        self.yty = 0.0
+        self.count = 0
+
+    def addData(self,delta,e,w,s,Z1,Cc,Lc,f0):
+        """ Adds measurements to the normal equations
+
+        All arguments are arrays of the same length (or scalars, broadcast
+        against the others) with one entry per measured resonator.
+        """
+        delta, e, w, s, Z1, Cc, Lc, f0 = np.broadcast_arrays(*[np.asarray(a,dtype=float) for a in (delta,e,w,s,Z1,Cc,Lc,f0)])
+        x = np.column_stack((np.ones(f0.size),e.ravel(),w.ravel(),(s*delta).ravel()))
+        y = (1/f0 - 4*Cc*Z1 - 4*Lc/Z1).ravel()
+
+        self.xtx += x.T.dot(x)
+        self.xty += x.T.dot(y)
+        self.yty += y.dot(y)
+        self.count += f0.size
+
+    def addFile(self,filename,chunksize=100000,delimiter=','):
+        """ Adds measurements from a delimited text file, chunk by chunk
+
+        The first line names the columns, which must include those in COLUMNS in
+        any order; other columns are ignored. The file is read chunksize lines at
+        a time, so it never has to fit in memory.
+        """
+        with open(filename,'r') as f:
+            header = [name.strip() for name in f.readline().split(delimiter)]
+            for name in COLUMNS:
+                if name not in header:
+                    raise ValueError('Column {} not found in {}'.format(name,filename))
+            usecols = [header.index(name) for name in COLUMNS]
+
+            while True:
+                lines = list(itertools.islice(f,chunksize))
+                if not lines:
+                    break
+                data = np.loadtxt(lines,delimiter=delimiter,usecols=usecols,ndmin=2)
+                self.addData(*data.T)
+
+    def merge(self,other):
+        """ Adds the normal equations of another calibration, e.g. from a parallel pass """
+        self.xtx += other.xtx
+        self.xty += other.xty
+        self.yty += other.yty
+        self.count += other.count
+
+    def solve(self):
+        """ Solves the normal equations for the model coefficients
+
+        The columns are scaled to unit norm before solving, as the constant,
+        excess length, wiggle and shift terms differ by orders of magnitude.
+
+        Returns a dictionary of the coefficients in COEFFICIENTS, and 'rms', the
+        root-mean-square residual of the inverse frequency (in s).
+        """
+        if self.count < 4:
+            raise ValueError('At least 4 measurements are needed to fit the model')
+
+        scale = np.sqrt(np.diag(self.xtx))
+        if np.any(scale == 0.0):
+            raise ValueError('Measurements do not vary all model terms')
+        a = self.xtx/np.outer(scale,scale)
+        if np.linalg.matrix_rank(a) < 4:
+            raise ValueError('Measurements do not determine all coefficients (e.g. wiggle count never varies)')
+        beta = np.linalg.solve(a,self.xty/scale)/scale
+
+        rss = self.yty - 2*beta.dot(self.xty) + beta.dot(self.xtx).dot(beta)
+        result = dict(zip(COEFFICIENTS,beta.tolist()))
+        result['rms'] = float(np.sqrt(max(rss,0.0)/self.count))
+
+        return result
+
+    def register(self,modelname,maxshift):
+        """ Fits the coefficients and registers them as a new model in resonatorModels
+
+        Returns the fitted coefficients, as solve.
+        """
+        result = self.solve()
+        model = resonatorModels.makeWigglemodel(modelname,*[result[name] for name in COEFFICIENTS])
+        resonatorModels.registerModel(modelname,model,maxshift)
+
+        return result
@@ -2,12 +2,116 @@ import numpy as np
 import resonatorModels
 import readReticlesetReport
 import pickle
+import copy
+import hashlib
+import os
+from collections import OrderedDict
 
 import sys
-sys.path.insert(0, './asml_ascii')
-sys.path.insert(0, './semiwafer')
-from asml_ascii import asmlAscii, asmlCells, asmlSection, asmlSectionList
-import semiwafer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'asmlAscii'))
+from asmlascii import asmlAscii, asmlSection, makeColumnSections, firstValue
+from asmljobsdef import ASMLJOBSECTIONS
+
+# Template jobfile into which the band sections are merged
+TEMPLATEFILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'umuxbevtemplate.txt')
+
+# Memoized section blocks of bands, indexed by resonatorDistribution.sectionBlockKey,
+# least recently used first
+SECTIONBLOCKS = OrderedDict()
+MAXSECTIONBLOCKS = 64
+
+def findCollisions(frequencies,guardband):
+    """ Finds all pairs of frequencies closer than a guard band
+
+    Sorts the frequencies once and uses searchsorted to find, for each frequency,
+    the range of higher frequencies within the guard band, so the cost is
+    O(n log n) plus the number of pairs found.
+
+    Returns a (k,2) array of index pairs (i,j) into frequencies, with
+    frequencies[i] <= frequencies[j], sorted by the lower frequency.
+    """
+    frequencies = np.asarray(frequencies,dtype=float)
+    order = np.argsort(frequencies,kind='stable')
+    sortedf = frequencies[order]
+
+    ends = np.searchsorted(sortedf,sortedf + guardband,side='left')
+    counts = ends - np.arange(len(sortedf)) - 1     # Partners above each frequency
+    first = np.repeat(np.arange(len(sortedf)),counts)
+    # Offsets 1..count of each partner from its lower frequency
+    offsets = np.arange(len(first)) - np.repeat(np.cumsum(counts) - counts,counts) + 1
+
+    return np.column_stack((order[first],order[first + offsets]))
+
+# Sections copied from the prototype layer when adding a layer to a jobfile
+LAYERSECTIONS = ['MARKS_SELECTION', 'STRATEGY_SELECTION', 'PROCESS_DATA']
+
+def addLayers(jobfile,layers,prototypelayer='BEV'):
+    """ Adds layers to a jobfile, modelled on an existing layer
+
+    For each requested layer not yet defined in the jobfile, adds a layer
+    definition and copies of the LAYERSECTIONS sections of the prototype layer.
+    If the prototype layer is not itself requested, it is removed, with all
+    sections selected by its LAYER_ID. Layers are then renumbered: the jobfile's
+    other layers (e.g. the alignment layer, and layer definitions without a
+    LAYER_ID) come first, followed by the requested layers in the given order.
+    A jobfile that already defines all requested layers, and does not define an
+    unrequested prototype layer, is left unchanged.
+    """
+    laydefs = dict((firstValue(section,'LAYER_ID'),section) for section in jobfile.sections['LAYER_DEFINITION']
+                   if firstValue(section,'LAYER_ID') is not None)
+    newlayers = [layer for layer in layers if layer not in laydefs]
+    removeprototype = prototypelayer not in layers and prototypelayer in laydefs
+    if not newlayers and not removeprototype:
+        return
+    if prototypelayer not in laydefs:
+        raise ValueError('Prototype layer {} not defined in jobfile'.format(prototypelayer))
+
+    prototype = laydefs[prototypelayer]
+    prototypesections = [section for sectionname in LAYERSECTIONS
+                         for section in jobfile.get(sectionname,LAYER_ID=[prototypelayer])]
+    if removeprototype:
+        for sectionname in jobfile.sections:
+            if 'LAYER_ID' in ASMLJOBSECTIONS[sectionname]['id_elements']:
+                jobfile.remove(sectionname,LAYER_ID=[prototypelayer])
+        jobfile.remove('LAYER_DEFINITION',LAYER_NO=laydefs.pop(prototypelayer).get('LAYER_NO'))
+
+    for layer in newlayers:
+        laydef = copy.deepcopy(prototype)
+        laydef.set('LAYER_ID',layer)
+        jobfile.append(laydef)
+        laydefs[layer] = laydef
+        for section in prototypesections:
+            newsection = copy.deepcopy(section)
+            newsection.set('LAYER_ID',layer)
+            jobfile.append(newsection)
+
+    existing = sorted(jobfile.sections['LAYER_DEFINITION'],key=lambda section: section.get('LAYER_NO')[0])
+    ordered = [section for section in existing if firstValue(section,'LAYER_ID') not in layers] + [laydefs[layer] for layer in layers]
+    for n, section in enumerate(ordered):
+        section.set('LAYER_NO',n)
+    jobfile.sections['LAYER_DEFINITION'] = ordered
+
+def stampImageDistribution(block,cx,cy):
+    """ Copies the image distribution sections of a section block into a cell """
+    sections = [section.copy() for section in block['IMAGE_DISTRIBUTION']]
+    for section in sections:
+        section.set('CELL_SELECTION',[str(cx),str(cy)])
+    return sections
+
+def stampSectionBlock(block,cx,cy):
+    """ Copies a section block for a cell
+
+    Returns the list of sections of the block, in the order of the block, with
+    the image distribution placed in cell (cx,cy). The copies can be modified
+    without affecting the memoized block.
+    """
+    sections = []
+    for sectionname in block:
+        if sectionname == 'IMAGE_DISTRIBUTION':
+            sections.extend(stampImageDistribution(block,cx,cy))
+        else:
+            sections.extend([section.copy() for section in block[sectionname]])
+    return sections
 
 class resonator(object):
     """ Class that represents a single resonator
@@ -182,140 +286,193 @@ class resonatorDistribution(object):
         for n in range(self.nres):
             self.resonators[n].calculateShift()
     
+    def predictFrequencies(self):
+        """ Predicts the resonance frequencies from the calculated shifts
+
+        Evaluates each resonator's model at its shift, so the result reflects the
+        frequencies that will be fabricated rather than the targets.
+        """
+        frequencies = np.empty(self.nres)
+        for n in range(self.nres):
+            res = self.resonators[n]
+            if not hasattr(res,'delta'):
+                raise ValueError('Shifts must be calculated before predicting frequencies.')
+            frequencies[n] = resonatorModels.getModel(res.modelname)(res.delta,**res.designparams)
+
+        return frequencies
+
+    def checkCollisions(self,guardband):
+        """ Finds pairs of resonators whose predicted frequencies are closer than a guard band
+
+        Returns a list of (n1, n2, f1, f2) tuples of resonator indices and predicted
+        frequencies, with f1 <= f2.
+        """
+        frequencies = self.predictFrequencies()
+
+        return [(int(n1), int(n2), frequencies[n1], frequencies[n2]) for n1, n2 in findCollisions(frequencies,guardband).tolist()]
+
     def makeImageDistributionSectionList(self,cx,cy):
-        """ Creates a list of image distribution sections """
-        imdistseclist = asmlSectionList('image_distribution')
+        """ Creates a list of image distribution sections
+
+        The sections are built column-wise, with one wiggle and one slider
+        placement per resonator.
+        """
+        shifts = np.empty((2*self.nres,2))
         for n in range(self.nres):
-            wigglesec = asmlSection('image_distribution')
-            wigglesec.set('image_id', 'WIGGLE-'+str.upper(self.bandname))
-            wigglesec.set('instance_id', '{:03d}'.format(n+2))
-            wigglesec.set('cell_selection', [str(cx), str(cy)])
-            wigglesec.set('distribution_action', 'I')
-            wigglesec.set('image_cell_shift', [self.resonators[n].wx, self.resonators[n].wy])
-            imdistseclist.append(wigglesec)
-
-            slidersec = asmlSection('image_distribution')
-            slidersec.set('image_id', 'SLIDER-'+str.upper(self.bandname))
-            slidersec.set('instance_id', '{:03d}'.format(n+2))
-            slidersec.set('cell_selection', [str(cx), str(cy)])
-            slidersec.set('distribution_action', 'I')
-            slidersec.set('image_cell_shift', [self.resonators[n].sx, self.resonators[n].sy])
-            imdistseclist.append(slidersec)
-        
-        return imdistseclist
-    
+            shifts[2*n] = [self.resonators[n].wx, self.resonators[n].wy]
+            shifts[2*n+1] = [self.resonators[n].sx, self.resonators[n].sy]
+
+        image_ids = ['WIGGLE-'+str.upper(self.bandname), 'SLIDER-'+str.upper(self.bandname)]*self.nres
+        instance_ids = ['{:03d}'.format(n//2+2) for n in range(2*self.nres)]
+
+        return makeColumnSections('IMAGE_DISTRIBUTION', IMAGE_ID=image_ids, INSTANCE_ID=instance_ids,
+                                  CELL_SELECTION=[str(cx), str(cy)], DISTRIBUTION_ACTION='I',
+                                  IMAGE_CELL_SHIFT=shifts)
+
     def makeInstanceDefinitionSectionList(self):
         """ Creates a list of instance definition sections """
-        instseclist = asmlSectionList('instance_definition')
-        for n in range(self.nres):
-            instsec = asmlSection('instance_definition')
-            instsec.set('instance_id', '{:03d}'.format(n+2)) # Instance ids start at 2 for some reason
-            instseclist.append(instsec)
+        instance_ids = ['{:03d}'.format(n+2) for n in range(self.nres)] # Instance ids start at 2 for some reason
 
-        return instseclist
-    
-    def makeImageDefinitionSectionList(self,reticlesetreportfilename):
-        """ Creates a list of image definition sections """
-        reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
-
-        imdefseclist = asmlSectionList('image_definition')
-
-        image_id = 'WIGGLE-'+str.upper(self.bandname)
-        for n in range(len(reticleimages)):
-            retim = reticleimages[n]
-            if (retim.gds_file == self.wigglegds) and (retim.xic_layer == 'BEV'):
-                imdefsec = asmlSection('image_definition')
-                imdefsec.set('image_id', image_id)
-                imdefsec.set('reticle_id', retim.reticle_id)
-                imdefsec.set('image_size', [retim.width,retim.height])
-                imdefsec.set('mask_size', [retim.width,retim.height])
-                imdefsec.set('image_shift', [retim.x_shift,retim.y_shift])
-                imdefsec.set('mask_shift', [retim.x_shift,retim.y_shift])
-                imdefseclist.append(imdefsec)
-                break
-        else:
-            raise ValueError('Couldn\'t find resonator base image in reticle plates')
-
-        image_id = 'SLIDER-'+str.upper(self.bandname)
-        for n in range(len(reticleimages)):
-            retim = reticleimages[n]
-            if (retim.gds_file == self.slidergds) and (retim.xic_layer == 'BEV'):
-                imdefsec = asmlSection('image_definition')
-                imdefsec.set('image_id', image_id)
-                imdefsec.set('reticle_id', retim.reticle_id)
-                imdefsec.set('image_size', [retim.width,retim.height])
-                imdefsec.set('mask_size', [retim.width,retim.height])
-                imdefsec.set('image_shift', [retim.x_shift,retim.y_shift])
-                imdefsec.set('mask_shift', [retim.x_shift,retim.y_shift])
-                imdefseclist.append(imdefsec)
-                break
-        else:
-            raise ValueError('Couldn\'t find slider image in reticle plates')
+        return makeColumnSections('INSTANCE_DEFINITION', INSTANCE_ID=instance_ids)
+
+    def _layerImages(self,layerimages,layers):
+        """ Finds the wiggle and slider images of each layer
+
+        Takes the reticle images grouped by readReticlesetReport.groupByLayer, and
+        returns a list of (layer, wiggle image, slider image) tuples in the order
+        of the requested layers.
+        """
+        images = []
+        for layer in layers:
+            gdsimages = layerimages.get(layer,{})
+            if self.wigglegds not in gdsimages:
+                raise ValueError('Couldn\'t find resonator base image for layer {} in reticle plates'.format(layer))
+            if self.slidergds not in gdsimages:
+                raise ValueError('Couldn\'t find slider image for layer {} in reticle plates'.format(layer))
+            images.append((layer,gdsimages[self.wigglegds],gdsimages[self.slidergds]))
+
+        return images
+
+    def makeImageDefinitionSectionList(self,reticlesetreportfilename,reticleimages=None,layers=('BEV',),layerimages=None):
+        """ Creates a list of image definition sections
+
+        If the reticle images have already been read from the Reticleset report,
+        they can be passed in to avoid parsing the report again, or passed grouped
+        by layer (see readReticlesetReport.groupByLayer) to avoid grouping them again.
+
+        The wiggle and slider images are each defined once, at their reticle
+        location in the first of the requested layers; the location in each
+        layer is given by the reticle data sections.
+        """
+        if layerimages is None:
+            if reticleimages is None:
+                reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+            layerimages = readReticlesetReport.groupByLayer(reticleimages)
+
+        imdefseclist = []
+
+        layer, wiggleimage, sliderimage = self._layerImages(layerimages,layers)[0]
+        for image_id, retim in [('WIGGLE-'+str.upper(self.bandname), wiggleimage),
+                                ('SLIDER-'+str.upper(self.bandname), sliderimage)]:
+            imdefsec = asmlSection('IMAGE_DEFINITION')
+            imdefsec.set('IMAGE_ID', image_id)
+            imdefsec.set('RETICLE_ID', retim.reticle_id)
+            imdefsec.set('IMAGE_SIZE', [retim.width,retim.height])
+            imdefsec.set('MASK_SIZE', [retim.width,retim.height])
+            imdefsec.set('IMAGE_SHIFT', [retim.x_shift,retim.y_shift])
+            imdefsec.set('MASK_SHIFT', [retim.x_shift,retim.y_shift])
+            imdefseclist.append(imdefsec)
 
         return imdefseclist
 
-    def makeReticleDataSectionList(self,reticlesetreportfilename):
-        """ Creates a list of reticle data sections """
-        reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+    def makeReticleDataSectionList(self,reticlesetreportfilename,reticleimages=None,layers=('BEV',),layerimages=None):
+        """ Creates a list of reticle data sections
+
+        Accepts already read or grouped reticle images, as makeImageDefinitionSectionList.
+        Creates sections for the wiggle and slider images in each of the requested
+        layers.
+        """
+        if layerimages is None:
+            if reticleimages is None:
+                reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+            layerimages = readReticlesetReport.groupByLayer(reticleimages)
 
-        retdataseclist = asmlSectionList('reticle_data')
+        retdataseclist = []
+        for layer, wiggleimage, sliderimage in self._layerImages(layerimages,layers):
+            retdataseclist.append(wiggleimage.make_reticle_data_section(joblayer=layer,jobimage='WIGGLE-'+str.upper(self.bandname)))
+            retdataseclist.append(sliderimage.make_reticle_data_section(joblayer=layer,jobimage='SLIDER-'+str.upper(self.bandname)))
 
-        image_id = 'WIGGLE-'+str.upper(self.bandname)
-        for n in range(len(reticleimages)):
-            retim = reticleimages[n]
-            if (retim.gds_file == self.wigglegds) and (retim.xic_layer == 'BEV'):
-                retdataseclist.append(retim.make_reticle_data_section(jobimage=image_id))
-                break
+        return retdataseclist
+
+    def sectionBlockKey(self,reticleimages,layers=('BEV',)):
+        """ Hashes the inputs of the section block of the band
+
+        The key covers the band's contents (including the calculated shifts), the
+        reticle images of its GDS files and the requested layers.
+        """
+        h = hashlib.sha1(pickle.dumps(self,protocol=2))
+        for retim in reticleimages:
+            if retim.gds_file in (self.wigglegds, self.slidergds):
+                h.update(repr(sorted(retim.__dict__.items())).encode('utf-8'))
+        h.update(repr(list(layers)).encode('utf-8'))
+        return h.hexdigest()
+
+    def makeSectionBlock(self,reticlesetreportfilename,reticleimages=None,layers=('BEV',),layerimages=None):
+        """ Creates the sections of the band, memoized on the band's contents and inputs
+
+        Returns an OrderedDict of section name to list of sections, with the image
+        distribution placed in cell (0,0). Blocks are shared between calls and must
+        not be modified; use stampSectionBlock to get copies placed in a cell.
+
+        The reticle images grouped by layer can be passed in when building the
+        blocks of several bands from the same report.
+        """
+        if reticleimages is None:
+            reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+
+        key = self.sectionBlockKey(reticleimages,layers)
+        if key in SECTIONBLOCKS:
+            block = SECTIONBLOCKS.pop(key)
         else:
-            raise ValueError('Couldn\'t find resonator base image in reticle plates')
-
-        image_id = 'SLIDER-'+str.upper(self.bandname)
-        for n in range(len(reticleimages)):
-            retim = reticleimages[n]
-            if (retim.gds_file == self.slidergds) and (retim.xic_layer == 'BEV'):
-                retdataseclist.append(retim.make_reticle_data_section(jobimage=image_id))
-                break
+            if layerimages is None:
+                layerimages = readReticlesetReport.groupByLayer(reticleimages)
+            block = OrderedDict([
+                ('IMAGE_DEFINITION', self.makeImageDefinitionSectionList(reticlesetreportfilename,reticleimages,layers,layerimages)),
+                ('IMAGE_DISTRIBUTION', self.makeImageDistributionSectionList(0,0)),
+                ('INSTANCE_DEFINITION', self.makeInstanceDefinitionSectionList()),
+                ('RETICLE_DATA', self.makeReticleDataSectionList(reticlesetreportfilename,reticleimages,layers,layerimages))])
+            if len(SECTIONBLOCKS) >= MAXSECTIONBLOCKS:
+                SECTIONBLOCKS.popitem(last=False)
+        SECTIONBLOCKS[key] = block
+
+        return block
+
+    def makeChipJobfile(self,reticlesetreportfilename,cx,cy,templatefilename=TEMPLATEFILENAME,reticleimages=None,template=None,
+                        layers=('BEV',)):
+        """ Creates a single-chip jobfile from the resonator distribution
+
+        Already read reticle images and an already parsed template jobfile can be
+        passed in to avoid reading the files again. The template is copied, not
+        modified.
+
+        The wiggles and sliders are exposed in each of the requested layers (e.g.
+        readReticlesetReport.UMUXLAYERS); layers missing from the template are
+        added with addLayers.
+
+        The sections of the band are built once and memoized (see makeSectionBlock),
+        so repeated calls for other cells only copy them.
+        """
+        if template is None:
+            jobfile = asmlAscii()
+            jobfile.readAsciiJobfile(templatefilename)
         else:
-            raise ValueError('Couldn\'t find resonator base image in reticle plates')
+            jobfile = copy.deepcopy(template)
+        if reticleimages is None:
+            reticleimages = readReticlesetReport.readReticlesetReport(reticlesetreportfilename)
+        addLayers(jobfile,layers)
 
-        return retdataseclist
-    
-    def makeChipJobfile(self,reticlesetreportfilename,cx,cy):
-        """ Creates a single-chip jobfile from the resonator distribution """
-        jobfile = asmlAscii(filename='umuxbevtemplate.txt')
-
-        # # Need to rewrite asml_ascii to make a functional merge
-        # jobfile.merge(self.makeImageDefinitionSectionList(reticlesetreportfilename))
-        # jobfile.merge(self.makeImageDistributionSectionList(0,0))
-        # jobfile.merge(self.makeInstanceDefinitionSectionList())
-        # jobfile.merge(self.makeReticleDataSectionList(reticlesetreportfilename))
-
-        imdefseclist = self.makeImageDefinitionSectionList(reticlesetreportfilename)
-        for s in jobfile.sections:
-            if s.name == 'image_definition':
-                for t in imdefseclist.sections:
-                    s.append(t)
-                break
-
-        imdistseclist = self.makeImageDistributionSectionList(0,0)
-        for s in jobfile.sections:
-            if s.name == 'image_distribution':
-                for t in imdistseclist.sections:
-                    s.append(t)
-                break
-        
-        instdefseclist = self.makeInstanceDefinitionSectionList()
-        for s in jobfile.sections:
-            if s.name == 'instance_definition':
-                for t in instdefseclist.sections:
-                    s.append(t)
-                break
-
-        retdataseclist = self.makeReticleDataSectionList(reticlesetreportfilename)
-        for s in jobfile.sections:
-            if s.name == 'reticle_data':
-                for t in retdataseclist.sections:
-                    s.append(t)
-                break
-
-        return jobfile
\ No newline at end of file
+        block = self.makeSectionBlock(reticlesetreportfilename,reticleimages,layers)
+        for section in stampSectionBlock(block,cx,cy):
+            jobfile.append(section)
+
+        return jobfile
@@ -7,8 +7,10 @@
 # resonance frequencies.
 #
 
+import hashlib
+import inspect
+from collections import OrderedDict
 import numpy as np
-import scipy.optimize as op
 
 # Maximum allowed shift for the various models
 MAXSHIFT = {'wigglemodel1':95,
@@ -26,8 +28,10 @@ def wigglemodel1(delta,e,w,s,Z1,Cc,Lc):
     impedance (Z1).
 
     Note: this is the model based off the measurement of 16 wiggletest chips.
+
+    All arguments may be arrays, which are broadcast against each other.
     """
-    if delta<0.0 or delta>MAXSHIFT['wigglemodel1']:
+    if np.any(np.less(delta,0.0)) or np.any(np.greater(delta,MAXSHIFT['wigglemodel1'])):
         raise ValueError('Slider shift out of range.')
 
     # Coefficients taken from fit to resonance data from 16 chips:
@@ -52,8 +56,10 @@ def wigglemodel1b(delta,e,w,s,Z1,Cc,Lc):
     impedance (Z1).
 
     Note: this is a modification of wigglemodel1 for slightly broader wiggles
+
+    All arguments may be arrays, which are broadcast against each other.
     """
-    if delta<0.0 or delta>MAXSHIFT['wigglemodel1b']:
+    if np.any(np.less(delta,0.0)) or np.any(np.greater(delta,MAXSHIFT['wigglemodel1b'])):
         raise ValueError('Slider shift out of range.')
 
     # Coefficients modified from wigglemodel1: NOTE: I HAVENT CHANGED THESE VALUES YET!
@@ -67,6 +73,28 @@ def wigglemodel1b(delta,e,w,s,Z1,Cc,Lc):
 
     return model_f0
 
+def makeWigglemodel(modelname,fitoffset,fitdlde,fitdldw,fitdldsdelta):
+    """ Create a linear wiggle model with given coefficients
+
+    The model has the form of wigglemodel1, with coefficients e.g. fitted by
+    resonatorCalibration. The coefficients are stored in the coefficients
+    attribute of the returned function, and the shift range is checked against
+    MAXSHIFT[modelname].
+    """
+    def wigglemodel(delta,e,w,s,Z1,Cc,Lc):
+        if np.any(np.less(delta,0.0)) or np.any(np.greater(delta,MAXSHIFT[modelname])):
+            raise ValueError('Slider shift out of range.')
+
+        model_l = fitoffset + fitdlde*e + fitdldw*w + fitdldsdelta*s*delta
+        model_f0 = 1 / (model_l + 4*Cc*Z1 + 4*Lc/Z1)
+
+        return model_f0
+
+    wigglemodel.__name__ = modelname
+    wigglemodel.coefficients = OrderedDict([('fitoffset',fitoffset), ('fitdlde',fitdlde),
+                                            ('fitdldw',fitdldw), ('fitdldsdelta',fitdldsdelta)])
+    return wigglemodel
+
 
 ######################################################################################
 ######################################################################################
@@ -74,15 +102,63 @@ def wigglemodel1b(delta,e,w,s,Z1,Cc,Lc):
 ######################################################################################
 ######################################################################################
 
+# Model functions by name
+MODELS = {'wigglemodel1':wigglemodel1,
+          'wigglemodel1b':wigglemodel1b}
+
+def registerModel(modelname,model,maxshift):
+    """ Register a model function under a name
+
+    The model must take the slider shift followed by the design parameters as
+    keyword arguments, and return the resonance frequency. Registration lasts
+    for the running process only, so a model used by pickled distributions must
+    be registered again before their shifts are recalculated.
+    """
+    MODELS[modelname] = model
+    MAXSHIFT[modelname] = maxshift
+
+def modelSpec(modelname):
+    """ Picklable specification of a registered model, for use in other processes
+
+    Returns a (modelname, model, maxshift) tuple. Models made by makeWigglemodel
+    cannot be pickled, so they are given by their coefficients attribute; other
+    model functions are pickled by reference to their module. See
+    registerModelSpec.
+    """
+    model = getModel(modelname)
+    if getattr(model,'coefficients',None) is not None:
+        model = dict(model.coefficients)
+
+    return (modelname, model, MAXSHIFT[modelname])
+
+def registerModelSpec(spec):
+    """ Register a model from its specification, as returned by modelSpec """
+    modelname, model, maxshift = spec
+    if isinstance(model,dict):
+        model = makeWigglemodel(modelname,**model)
+    registerModel(modelname,model,maxshift)
+
 def getModel(modelname):
     """ Select a model function by name """
-    if modelname == 'wigglemodel1':
-        return wigglemodel1
-    elif modelname == 'wigglemodel1b':
-        return wigglemodel1b
-    else:
+    if modelname not in MODELS:
         raise ValueError('Model not found.')
 
+    return MODELS[modelname]
+
+def modelFingerprint(modelname):
+    """ Fingerprint of a model's code and shift range
+
+    Changes whenever the model function (including its coefficients) or its
+    maximum shift changes, so that results computed with an older version of
+    the model can be recognized as stale.
+    """
+    model = getModel(modelname)
+    fingerprint = hashlib.sha1(inspect.getsource(model).encode('utf-8'))
+    fingerprint.update(repr(getattr(model,'coefficients',None)).encode('utf-8'))
+    fingerprint.update(repr(MAXSHIFT[modelname]).encode('utf-8'))
+
+    return fingerprint.hexdigest()
+
 def calcDelta(modelname,designparams,f0):
     """ Calculate deltas for a target frequency
 
@@ -90,6 +166,8 @@ def calcDelta(modelname,designparams,f0):
     that this assumes the model is monotonic across the range and spans
     the target frequency.
     """
+    import scipy.optimize as op     # Loaded on first use, as it is slow to import
+
     model = getModel(modelname)
     tempfun = lambda delta : model(delta,**designparams) - f0
     delta = op.bisect(tempfun,0.0,MAXSHIFT[modelname])
@@ -103,6 +181,8 @@ def calcDeltas(modelname,designparams,f0s):
     that this assumes the model is monotonic across the range and spans
     the target frequency.
     """
+    import scipy.optimize as op
+
     deltas = np.zeros_like(f0s)
     model = getModel(modelname)
 
@@ -0,0 +1,143 @@
+###################################################################################
+#
+# Resonator Monte Carlo
+#
+# Simulates the spread of fabricated resonance frequencies due to placement error
+# of the sliders and variation of the design parameters, and the resulting
+# probability of frequency collisions within a band.
+#
+
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import resonatorModels
+
+
+def _bandArrays(rd):
+    """ Gathers the shifts and design parameters of a band into arrays
+
+    Returns a list of (modelname, indices, deltas, designparams) tuples, one per
+    model used in the band, where designparams is a dictionary of arrays over the
+    resonators at the indices.
+    """
+    groups = OrderedDict()
+    for n in range(rd.nres):
+        res = rd.resonators[n]
+        if not hasattr(res,'delta'):
+            raise ValueError('Shifts must be calculated before simulation.')
+        groups.setdefault(res.modelname,[]).append(n)
+
+    arrays = []
+    for modelname, indices in groups.items():
+        paramnames = sorted(rd.resonators[indices[0]].designparams)
+        for n in indices:
+            if sorted(rd.resonators[n].designparams) != paramnames:
+                raise ValueError('Resonators using model {} have different design parameters.'.format(modelname))
+        designparams = dict((name,np.array([rd.resonators[n].designparams[name] for n in indices],dtype=float))
+                            for name in paramnames)
+        deltas = np.array([rd.resonators[n].delta for n in indices])
+        arrays.append((modelname,np.array(indices),deltas,designparams))
+
+    return arrays
+
+def _registerModels(specs):
+    """ Worker initializer registering the models of a band
+
+    Models registered at runtime (see resonatorModels.registerModel) exist only
+    in the process that registered them, and are missing in worker processes
+    that are spawned rather than forked.
+    """
+    for spec in specs:
+        resonatorModels.registerModelSpec(spec)
+
+def _simulateBatch(arrays,nominal,nsamples,sigma_delta,relsigmas,guardband,seed):
+    """ Simulates one batch of samples of a band
+
+    Returns sums over the batch, which can be added across batches: the sum and
+    sum of squares of the deviations from the nominal frequencies, the number of
+    collisions of each resonator, and the number of samples with any collision.
+    """
+    rng = np.random.default_rng(seed)
+    frequencies = np.empty((nsamples,len(nominal)))
+    for modelname, indices, deltas, designparams in arrays:
+        # Draw all errors of the group at once, and scale them in place into the
+        # model arguments, so that each batch-sized array is allocated only once
+        varied = [name for name in designparams if name in relsigmas]
+        errors = rng.standard_normal((1 + len(varied),nsamples,len(indices)))
+        d = errors[0]
+        d *= sigma_delta
+        d += deltas
+        # Shifts outside the model range would be rejected by the model
+        np.clip(d,0.0,resonatorModels.MAXSHIFT[modelname],out=d)
+        params = dict(designparams)
+        for name, e in zip(varied,errors[1:]):
+            e *= relsigmas[name]
+            e += 1.0
+            e *= designparams[name]
+            params[name] = e
+        frequencies[:,indices] = resonatorModels.getModel(modelname)(d,**params)
+
+    deviations = frequencies - nominal      # Small numbers, to keep the sums accurate
+
+    # Neighbours in frequency order closer than the guard band collide
+    order = np.argsort(frequencies,axis=1)
+    close = np.diff(np.take_along_axis(frequencies,order,axis=1),axis=1) < guardband
+    collided = np.zeros(frequencies.shape,dtype=bool)
+    collided[:,:-1] |= close
+    collided[:,1:] |= close
+    np.put_along_axis(collided,order,collided.copy(),axis=1)
+
+    return {'sum':deviations.sum(axis=0), 'sumsq':np.square(deviations).sum(axis=0),
+            'collisions':collided.sum(axis=0), 'anycollision':int(np.any(close,axis=1).sum())}
+
+def simulateBand(rd,nsamples=1000000,sigma_delta=0.0,relsigmas=None,guardband=0.0,batchsize=10000,workers=None,seed=None):
+    """ Monte Carlo simulation of the fabricated frequencies of a band
+
+    rd          : resonatorDistribution with calculated shifts
+    nsamples    : number of fabricated bands to simulate
+    sigma_delta : standard deviation of the slider shift (placement error)
+    relsigmas   : dictionary of relative standard deviations of design parameters,
+                  e.g. {'Cc':0.02, 'Lc':0.02, 'Z1':0.01}
+    guardband   : minimum frequency spacing; closer resonators count as collided
+    batchsize   : number of samples evaluated at once; batches of a few MB are
+                  evaluated fastest, as their arrays stay in the CPU caches
+    workers     : number of worker processes, or None to run in this process;
+                  the models of the band are registered in each worker
+    seed        : seed of the random number generator
+
+    Each resonator's errors are drawn independently. Samples are drawn in batches
+    with seeds spawned from the given seed, so results do not depend on the
+    number of workers.
+
+    Returns an OrderedDict with:
+        nominal                   : predicted frequencies without errors
+        mean, std                 : mean and standard deviation of each frequency
+        collision_probability     : probability of each resonator colliding
+        any_collision_probability : probability of any collision in the band
+    """
+    if relsigmas is None:
+        relsigmas = {}
+    arrays = _bandArrays(rd)
+    nominal = rd.predictFrequencies()
+
+    sizes = [batchsize]*(nsamples//batchsize) + ([nsamples % batchsize] if nsamples % batchsize else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(arrays,nominal,size,sigma_delta,relsigmas,guardband,batchseed) for size, batchseed in zip(sizes,seeds)]
+
+    if workers is None:
+        results = [_simulateBatch(*batchargs) for batchargs in args]
+    else:
+        specs = [resonatorModels.modelSpec(modelname) for modelname, indices, deltas, designparams in arrays]
+        with ProcessPoolExecutor(max_workers=workers,initializer=_registerModels,initargs=(specs,)) as pool:
+            results = list(pool.map(_simulateBatch,*zip(*args)))
+
+    total = sum(result['sum'] for result in results)
+    totalsq = sum(result['sumsq'] for result in results)
+    mean = total/nsamples
+
+    return OrderedDict([
+        ('nominal', nominal),
+        ('mean', nominal + mean),
+        ('std', np.sqrt(np.maximum(totalsq/nsamples - mean**2,0.0))),
+        ('collision_probability', sum(result['collisions'] for result in results)/nsamples),
+        ('any_collision_probability', sum(result['anycollision'] for result in results)/nsamples)])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for cellDistribution.
+"""
+
+from __future__ import print_function, absolute_import, division
+import pytest
+import resonatorDistribution
+from cellDistribution import cellDistribution
+
+
+class _squareWafer(object):
+    """ Wafer of 5 mm cells (cx,cy) with |cx|, |cy| <= 5, in place of semiwafer.semiWaferCells """
+    x0, y0, width, height = 0.0, 0.0, 5.0, 5.0
+
+    def cellValid(self,cx,cy):
+        return abs(cx) <= 5 and abs(cy) <= 5
+
+
+def _cellDistribution(tmp_path,bandnames=('BAND04','BAND05')):
+    """ Makes a cell distribution with empty bands imported under the given names """
+    cd = cellDistribution(wafer=_squareWafer())
+    for bandname in bandnames:
+        rd = resonatorDistribution.resonatorDistribution(nres=2)
+        rd.setImages(bandname,'band04.gds','slider3.gds')
+        filename = str(tmp_path / (bandname + '.pkl'))
+        rd.save(filename)
+        cd.importResonatorDistribution(filename)
+    return cd
+
+
+def test_undo_redo_and_snapshots_after_branching(tmp_path):
+    cd = _cellDistribution(tmp_path)
+    empty = cd.snapshot()
+    cd.placeResonatorDistribution(['BAND04'],[[0,0],[1,0]])
+    placed = cd.snapshot()
+    cd.removeResonatorDistribution(['BAND04'],[[0,0]])
+    assert cd.cells['BAND04'] == [[1,0]]
+
+    assert cd.undo()
+    assert cd.cells['BAND04'] == [[0,0],[1,0]]
+    assert cd.redo()
+    assert cd.cells['BAND04'] == [[1,0]]
+    assert cd.undo()
+
+    # A new operation after undoing discards the redo log, and the undo log is as long as before
+    cd.placeResonatorDistribution(['BAND05'],[[0,0]])
+    branched = cd.snapshot()
+    assert not cd.redo()
+    assert branched != placed
+
+    cd.placeResonatorDistribution(['BAND05'],[[1,0]])
+    cd.revert(branched)
+    assert cd.cells == {'BAND04':[[0,0],[1,0]], 'BAND05':[[0,0]]}
+    cd.revert(placed)
+    assert cd.cells == {'BAND04':[[0,0],[1,0]], 'BAND05':[]}
+
+    # The snapshot of the branch is no longer in the undo log once the branch is undone and replaced
+    cd.placeResonatorDistribution(['BAND04'],[[0,1]])
+    with pytest.raises(ValueError):
+        cd.revert(branched)
+    assert cd.cells == {'BAND04':[[0,0],[1,0],[0,1]], 'BAND05':[]}
+
+    cd.revert(empty)
+    assert cd.cells == {'BAND04':[], 'BAND05':[]}
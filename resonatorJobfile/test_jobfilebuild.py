@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for jobfilebuild.
+"""
+
+from __future__ import print_function, absolute_import, division
+import resonatorDistribution
+from cellDistribution import cellDistribution
+from jobfilebuild import jobfileBuilder
+from test_cellDistribution import _squareWafer
+
+REPORT = """Reticle RET-00  plate
+GDS File: band04.gds
+Layer Name:BEV
+Center coordinates: x=40.0 y=-10.0
+Image Size: width=2.0 height=2.0
+
+GDS File: slider3.gds
+Layer Name:BEV
+Center coordinates: x=40.0 y=0.0
+Image Size: width=2.0 height=2.0
+
+GDS File: band05.gds
+Layer Name:BEV
+Center coordinates: x=40.0 y=10.0
+Image Size: width=2.0 height=2.0
+"""
+
+
+def _cellDistribution(tmp_path):
+    """ Makes a cell distribution with BAND04 in cells (0,0) and (1,0), and BAND05 in (0,0) """
+    cd = cellDistribution(wafer=_squareWafer())
+    for bandname, wigglegds in [('BAND04','band04.gds'),('BAND05','band05.gds')]:
+        rd = resonatorDistribution.resonatorDistribution(nres=2)
+        rd.setImages(bandname,wigglegds,'slider3.gds')
+        rd.distributePositions(0.0,0.0,0.0,0.5,0.1)
+        filename = str(tmp_path / (bandname + '.pkl'))
+        rd.save(filename)
+        cd.importResonatorDistribution(filename)
+    cd.placeResonatorDistribution(['BAND04'],[[0,0],[1,0]])
+    cd.placeResonatorDistribution(['BAND05'],[[0,0]])
+    return cd
+
+def test_rebuild_repeats_only_changed_stages(tmp_path):
+    cd = _cellDistribution(tmp_path)
+    reportfilename = str(tmp_path / 'report.txt')
+    with open(reportfilename,'w') as f:
+        f.write(REPORT)
+    cells = [[0,0],[1,0]]
+    builder = jobfileBuilder(str(tmp_path / 'cache'))
+
+    jobfile = builder.build(cd,reportfilename,cells=cells)
+    assert jobfile.makeAscii() == cd.makeJobfileByCells(reportfilename,cells).makeAscii()
+    assert [entry[2] for entry in builder.log if entry[0] == 'chip'] == ['build']*3
+
+    # An unchanged rebuild is a single cache hit
+    del builder.log[:]
+    builder.build(cd,reportfilename,cells=cells)
+    assert [(stage,result) for stage, description, result in builder.log] == [('jobfile','hit')]
+
+    # Editing one band rebuilds that band and its chip, and repeats the merge
+    cd.bands['BAND05'].distributePositions(0.0,0.0,0.0,0.6,0.1)
+    del builder.log[:]
+    jobfile = builder.build(cd,reportfilename,cells=cells)
+    assert sorted((stage,description.get('band'),result) for stage, description, result in builder.log) == [
+        ('band','BAND05','build'),('chip','BAND04','hit'),('chip','BAND04','hit'),('chip','BAND05','build'),
+        ('jobfile',None,'build')]
+    assert jobfile.makeAscii() == cd.makeJobfileByCells(reportfilename,cells).makeAscii()
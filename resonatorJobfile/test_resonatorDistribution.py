@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests for resonatorDistribution.
+"""
+
+from __future__ import print_function, absolute_import, division
+import resonatorDistribution
+from asmlascii import asmlAscii, asmlSection
+
+
+def _template():
+    jobfile = asmlAscii()
+    jobfile.readAsciiJobfile(resonatorDistribution.TEMPLATEFILENAME)
+    return jobfile
+
+def _layers(jobfile):
+    """ (LAYER_NO, LAYER_ID) of the layer definitions of a jobfile """
+    return [(section.get('LAYER_NO')[0],section.get('LAYER_ID') and section.get('LAYER_ID')[0])
+            for section in jobfile.sections['LAYER_DEFINITION']]
+
+def _layerIds(jobfile,sectionname):
+    return [section.get('LAYER_ID')[0] for section in jobfile.sections[sectionname]]
+
+def test_add_layers():
+    jobfile = _template()
+    asciistring = jobfile.makeAscii()
+    resonatorDistribution.addLayers(jobfile,('BEV',))
+    assert jobfile.makeAscii() == asciistring
+
+    resonatorDistribution.addLayers(jobfile,('BEV','AL'))
+    assert _layers(jobfile) == [(0,'PM'),(1,'BEV'),(2,'AL')]
+    for sectionname in resonatorDistribution.LAYERSECTIONS:
+        assert _layerIds(jobfile,sectionname).count('AL') == _layerIds(jobfile,sectionname).count('BEV') > 0
+    assert jobfile.getSummary()['layers'] == 3
+
+def test_add_layers_drops_unrequested_prototype():
+    jobfile = _template()
+    resonatorDistribution.addLayers(jobfile,('CE',))
+    assert _layers(jobfile) == [(0,'PM'),(1,'CE')]
+    for sectionname in jobfile.sections:
+        if jobfile.sections[sectionname] and 'LAYER_ID' in jobfile.sections[sectionname][0].id_elements:
+            assert 'BEV' not in _layerIds(jobfile,sectionname)
+    assert 'CE' in _layerIds(jobfile,'PROCESS_DATA')
+    assert jobfile.getSummary()['layers'] == 2
+
+    # The prototype is dropped even if all requested layers exist
+    jobfile = _template()
+    resonatorDistribution.addLayers(jobfile,('PM',))
+    assert _layers(jobfile) == [(0,'PM')]
+
+def test_add_layers_keeps_layer_definitions_without_id():
+    jobfile = _template()
+    section = asmlSection('LAYER_DEFINITION')
+    section.set('LAYER_NO',5)
+    jobfile.append(section)
+
+    resonatorDistribution.addLayers(jobfile,('BEV','AL'))
+    assert _layers(jobfile) == [(0,'PM'),(1,None),(2,'BEV'),(3,'AL')]